@@ -0,0 +1,186 @@
+from collections import deque
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter, time
+import numpy as np
+from scheduler import Schedule
+from metrics import READ_BUCKETS
+
+
+class SensorReader:
+    def __init__(self, name: str, read, fields: list, interval=5.0, timeout=2.0, latency_window=1024):
+        # one sensor's readings and read metrics, whichever engine schedules the reads: read() returns
+        # one value per field or raises, and only ever runs on one thread at a time
+        self.name = name
+        self.read = read
+        self.fields = list(fields)
+        self.interval = interval
+        self.timeout = timeout
+        self.values = None
+        self.timestamp = None
+        self._read_at = None
+        self._busy_since = None
+        self._stalled = False
+        self._lock = Lock()
+        self.schedule = None
+        self.latencies = deque(maxlen=latency_window)
+        self.reads = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.last_error = None
+        self.registry = None
+        self._read_seconds = None
+        self._failures = None
+
+    def instrument(self, registry):
+        # see metrics.Registry; counters read the reader's own fields when scraped
+        self.registry = registry
+        self._read_seconds = registry.histogram('environment_sensor_read_seconds', 'Time taken by one sensor read',
+                                                ('sensor',), READ_BUCKETS).labels(self.name)
+        self._failures = registry.counter('environment_sensor_failures_total',
+                                          'Sensor reads that raised, by exception type', ('sensor', 'error'))
+        registry.counter('environment_sensor_reads_total', 'Sensor reads, failed ones included',
+                         ('sensor',)).labels(self.name).set_function(lambda: self.reads)
+        registry.counter('environment_sensor_timeouts_total', 'Reads that ran past the timeout',
+                         ('sensor',)).labels(self.name).set_function(lambda: self.timeouts)
+        registry.gauge('environment_sensor_age_seconds', 'Age of the newest good reading',
+                       ('sensor',)).labels(self.name).set_function(
+            lambda: float('nan') if self.timestamp is None else time() - self.timestamp)
+
+    def create_schedule(self) -> Schedule:
+        self.schedule = Schedule(self.interval)
+        if self.registry is not None:
+            self.schedule.instrument(self.registry, self.name)
+        return self.schedule
+
+    def poll(self):
+        self._busy_since = monotonic()
+        started = perf_counter()
+        try:
+            values = list(self.read())
+        except Exception as e:
+            # RuntimeError from a bad PM frame, OSError from the bus, SerialTimeoutException, ...
+            values = None
+            self.last_error = repr(e)
+            if self._failures is not None:
+                self._failures.labels(self.name, type(e).__name__).inc()
+        latency = perf_counter() - started
+        if self._read_seconds is not None:
+            self._read_seconds.observe(latency)
+        with self._lock:
+            self._busy_since = None
+            self._stalled = False
+            self.latencies.append(latency)
+            self.reads += 1
+            if values is None:
+                self.failures += 1
+            else:
+                self.values = values
+                self.timestamp = time()
+                self._read_at = monotonic()
+
+    def reading(self, max_age=None):
+        # (values, timestamp) of the freshest good read, None where it is missing or too old
+        with self._lock:
+            if self._busy_since is not None and not self._stalled and monotonic() - self._busy_since > self.timeout:
+                self._stalled = True
+                self.timeouts += 1
+            if self.values is None or (max_age is not None and monotonic() - self._read_at > max_age):
+                return [None] * len(self.fields), None
+            return self.values, self.timestamp
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = np.array(self.latencies)
+            stats = {'reads': self.reads, 'failures': self.failures, 'timeouts': self.timeouts,
+                     'stalled': self._stalled, 'last_error': self.last_error}
+        if len(latencies):
+            stats.update({'mean': float(latencies.mean()), 'p99': float(np.percentile(latencies, 99)),
+                          'max': float(latencies.max())})
+        if self.schedule is not None:
+            stats['schedule'] = self.schedule.stats()
+        return stats
+
+
+class SensorWorker(SensorReader):
+    def __init__(self, *args, **kwargs):
+        # reads on a thread of its own, see SensorReader for the arguments
+        super().__init__(*args, **kwargs)
+        self._stop = Event()
+        self.ready = Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = Thread(target=self.run, name=f'sensor-{self.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        # a read stuck in a driver can't be interrupted, the thread is a daemon and gets left behind
+        if self._thread is not None:
+            self._thread.join(timeout=self.timeout)
+
+    def run(self):
+        schedule = self.create_schedule()
+        # the first read goes out straight away, Acquisition.start waits for it
+        self.poll()
+        while schedule.wait(self._stop):
+            self.poll()
+
+    def poll(self):
+        super().poll()
+        self.ready.set()
+
+
+class Acquisition:
+    def __init__(self, workers: list, max_age=None, times=False):
+        # None allows each sensor two of its own intervals, so slow and fast sensors age alike;
+        # times adds every worker's read time after the values, see Sensors.sensor_times
+        self.workers = workers
+        self.max_age = max_age
+        self.times = times
+        self._missing = None
+
+    def instrument(self, registry):
+        for worker in self.workers:
+            worker.instrument(registry)
+        # the records that went out with a sensor's fields empty
+        self._missing = {worker.name: registry.counter('environment_missing_readings_total',
+                                                       'Records written without a fresh reading of the sensor',
+                                                       ('sensor',)).labels(worker.name) for worker in self.workers}
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        # give every sensor one go at a first reading so the first record isn't empty
+        for worker in self.workers:
+            worker.ready.wait(worker.timeout)
+
+    def stop(self):
+        for worker in self.workers:
+            worker._stop.set()
+        for worker in self.workers:
+            worker.stop()
+
+    def sample(self) -> list:
+        # never waits on a sensor: every worker contributes its freshest reading, stale ones are None
+        values = [time()]
+        timestamps = []
+        for worker in self.workers:
+            reading, timestamp = worker.reading(self.age(worker))
+            if timestamp is None and self._missing is not None:
+                self._missing[worker.name].inc()
+            values.extend(reading)
+            timestamps.append(timestamp)
+        if self.times:
+            values.extend(timestamps)
+        return values
+
+    def timestamps(self) -> dict:
+        return {worker.name: worker.reading(self.age(worker))[1] for worker in self.workers}
+
+    def age(self, worker: SensorReader) -> float:
+        return 2 * worker.interval if self.max_age is None else self.max_age
+
+    def stats(self) -> dict:
+        return {worker.name: worker.stats() for worker in self.workers}
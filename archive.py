@@ -1,20 +1,69 @@
 from datetime import datetime, timedelta
 import pandas as pd
-import re, os
+import re, os, io
+from time import perf_counter
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor
+import columnar
+import compaction
+from manifest import ArchiveManifest
+from cache import ArrayCache
+from rollup import RollupStore
+import pipeline
+from readpool import ReaderPool
+from seekindex import SeekIndex
+from profiling import Profiler
+
+# whatever resolution pandas gives datetime.fromtimestamp values
+DATETIME_DTYPE = pd.to_datetime([datetime(2000, 1, 1)]).dtype
 
 class ReadArchive:
-    def __init__(self, data_dir='./data/'):
+    def __init__(self, data_dir='./data/', cache_limit=64 * 1024**2, profiler=None):
         self.data_dir = data_dir
         self.fn_format = '%Y-%m-%d %H-%M-%S'
         self.re_compile = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}-\d{2}-\d{2}')
         self.delta_dict = {'1h': timedelta(hours=1), '8h': timedelta(hours=8), '24h': timedelta(hours=24),
                            '7d': timedelta(days=7), '1m': timedelta(days=30), '6m': timedelta(days=180),
                            '1y': timedelta(days=365)}
+        self.resample_dict = {'1h': '5min', '8h': '20min', '24h': '60min', '7d': '60min', '1m': 'D', '6m': 'D',
+                              '1y': 'W'}
+        # long spans plot pre-aggregated rollups instead of millions of raw samples
+        self.rollup_dict = {'6m': '1h', '1y': '1D'}
+        self.manifest = ArchiveManifest(self)
+        self.cache = ArrayCache(cache_limit)
+        self.rollups = RollupStore(self)
+        self.pool = ReaderPool(self)
+        self.seek_index = SeekIndex()
+        # file -> (version, header), a file's header only changes if the file is written anew
+        self.headers = {}
+        self.stage_report = []
+        self.profiler = profiler or Profiler()
+
+    def __getstate__(self):
+        # worker processes only need the paths and parsers, not the index, cache or pool
+        state = self.__dict__.copy()
+        state['manifest'] = None
+        state['cache'] = None
+        state['rollups'] = None
+        state['pool'] = None
+        state['seek_index'] = None
+        state['headers'] = {}
+        state['profiler'] = None
+        return state
+
+    def close(self):
+        self.pool.close()
+
+    def stations(self) -> list:
+        # station folders under a collector root, see collector.Collector
+        return sorted(entry.name for entry in os.scandir(self.data_dir)
+                      if entry.is_dir() and os.path.exists(os.path.join(entry.path, '.collector.json')))
+
+    def station(self, name: str):
+        return ReadArchive(self.data_dir + name + '/', self.cache.limit, self.profiler)
     
     def txt2num(self, sample: str) -> list:
-        sample = sample.split(' ')
+        # any run of whitespace separates values, the same as np.loadtxt in parse_text
+        sample = sample.split()
         nums = []
         for value in sample:
             try:
@@ -26,73 +75,315 @@ class ReadArchive:
     def date_range(self, start_date: str, end_date: str) -> list:
         start_date = datetime.strptime(start_date, self.fn_format)
         end_date = datetime.strptime(end_date, self.fn_format)
-        all_files = os.listdir(self.data_dir)
-        selected_files = []
-        for file in all_files:
+        with self.profiler.stage('listing') as stage:
+            self.manifest.refresh()
+            # every file with rows in the range, pass the same bounds to create_df to trim them
+            files = self.manifest.overlapping(start_date.timestamp(), end_date.timestamp())
+            stage['rows'] = len(files)
+        return files
+
+    def archive_files(self, files: list) -> dict:
+        # one file per archive period, the binary copy wins over the text one
+        selected = {}
+        for file in files:
             match = self.re_compile.search(file)
-            if match:
-                file_date = datetime.strptime(match.group(), self.fn_format)
-                if start_date <= file_date <= end_date:
-                    selected_files.append(file)
-        return selected_files
-
-    def create_df(self, files: list) -> pd.DataFrame:
-        for i, file in enumerate(files):
-            if '.txt' not in file:
-                files.pop(i)
-        with open(self.data_dir + files[0]) as f:
-            header = f.readline()
-            header = header[:-1].split(' ')
-        with ProcessPoolExecutor() as executor:
-            data = [sample for result in executor.map(self.read_file, files) for sample in result]
-        data = self.remove_nan(data)
-        df = pd.DataFrame(data=data, columns=header)
-        df_datetime = pd.to_datetime([datetime.fromtimestamp(i) for i in df['timestamp'].values])
-        df['datetime'] = df_datetime
-        df = df.set_index('datetime')
-        df = df.drop(columns=['timestamp'])
-        df = df.dropna()
-        df['particles_03um'] = df['particles_03um'] - df['particles_05um']
-        df['particles_05um'] = df['particles_05um'] - df['particles_10um']
-        df['particles_10um'] = df['particles_10um'] - df['particles_25um']
-        df['particles_25um'] = df['particles_25um'] - df['particles_50um']
-        df['particles_50um'] = df['particles_50um'] - df['particles_100um']
-        df = df.sort_index()
+            if match and file.endswith('.chunk'):
+                selected[self.stem(file)] = file
+            elif match and file.endswith(('.txt', '.bin')):
+                if file.endswith('.bin') or match.group() not in selected:
+                    selected[match.group()] = file
+        shadowed = self.shadowed(list(selected.values()))
+        return {stem: file for stem, file in selected.items() if file not in shadowed}
+
+    def stem(self, filename: str) -> str:
+        # chunks share their start with the first file they replaced, the tier tells them apart
+        if filename.endswith('.chunk'):
+            return filename[:-len('.chunk')]
+        return self.re_compile.search(filename).group()
+
+    def shadowed(self, files: list) -> dict:
+        starts = {file: datetime.strptime(self.re_compile.search(file).group(), self.fn_format) for file in files}
+        return compaction.covering(files, starts)
+
+    def resolve(self, filename: str) -> str:
+        if filename.endswith('.txt'):
+            bin_name = filename[:-4] + '.bin'
+            if os.path.exists(self.data_dir + bin_name):
+                return bin_name
+        return filename
+
+    def read_header(self, filename: str) -> list:
+        filename = self.resolve(filename)
+        if filename.endswith('.bin'):
+            return columnar.read_header(self.data_dir + filename)[0]
+        if filename.endswith('.chunk'):
+            return compaction.read_header(self.data_dir + filename)['columns']
+        with open(self.data_dir + filename) as f:
+            return f.readline().split()
+
+    def create_df(self, files: list, start=None, end=None) -> pd.DataFrame:
+        files = [file for file in files if file.endswith(('.txt', '.bin', '.chunk'))]
+        files = [self.resolve(file) for file in files]
+        started = perf_counter()
+        versions = [self.file_version(file) for file in files]
+        # files written with and without Sensors.pm_extremes can sit side by side
+        headers = [self.cached_header(file, version) for file, version in zip(files, versions)]
+        header = pipeline.merge_headers(headers)
+        arrays = [self.cache.get(file, version) for file, version in zip(files, versions)]
+        if start is not None or end is not None:
+            # files cut by the range are read from their first to their last row in it, uncached
+            for i, file in enumerate(files):
+                if arrays[i] is None and not self.covered(file, start, end):
+                    arrays[i] = self.read_file(file, start, end)
+        missing = [i for i, array in enumerate(arrays) if array is None]
+        if missing:
+            # only files that are new or still being written get parsed again
+            parsed = self.pool.read([files[i] for i in missing])
+            for i, array in zip(missing, parsed):
+                self.cache.put(files[i], versions[i], array)
+                arrays[i] = array
+        report = [{'stage': 'read', 'seconds': perf_counter() - started, 'rows': sum(len(array) for array in arrays),
+                   'copies': len(missing)}]
+        started = perf_counter()
+        data = np.concatenate([pipeline.align(array, file_header, header)
+                               for array, file_header in zip(arrays, headers)])
+        report.append({'stage': 'concat', 'seconds': perf_counter() - started, 'rows': len(data), 'copies': 1})
+        df = self.build_df(data, header, report, start, end)
+        self.profiler.add(report)
         return df
 
-    def remove_nan(self, data: list) -> list:
-        pop_list = []
-        for i, sample in enumerate(data):
-            if np.isnan(sample[0]):
-                pop_list.append(i)
-        for i in pop_list[::-1]:
-            data.pop(i)
+    def cached_header(self, filename: str, version) -> list:
+        cached = self.headers.get(filename)
+        if cached is None or cached[0] != version:
+            cached = self.headers[filename] = (version, self.read_header(filename))
+        return cached[1]
+
+    def covered(self, filename: str, start=None, end=None) -> bool:
+        entry = self.manifest.by_file.get(filename)
+        if entry is None or entry['first'] is None or filename == self.manifest.entries[self.manifest.stems[-1]]['file']:
+            return False
+        return (start is None or entry['first'] >= start) and (end is None or entry['last'] <= end)
+
+    def build_df(self, data: np.ndarray, header: list, report=None, start=None, end=None) -> pd.DataFrame:
+        # one columnar pass over the parsed block, time and copies per stage end up in stage_report
+        report = [] if report is None else report
+        def stage(name, started, before, after):
+            report.append({'stage': name, 'seconds': perf_counter() - started, 'rows': len(after),
+                           'copies': int(not np.shares_memory(before, after))})
+        started = perf_counter()
+        required = pipeline.required_columns(header)
+        keep = ~np.isnan(data if len(required) == len(header) else data[:, required]).any(axis=1)
+        ts = header.index('timestamp')
+        if start is not None:
+            keep &= data[:, ts] >= start
+        if end is not None:
+            keep &= data[:, ts] <= end
+        filtered = data if keep.all() and data.flags.writeable else data[keep]
+        stage('filter', started, data, filtered)
+        data = filtered
+        started = perf_counter()
+        bins = pipeline.particle_bins(header)
+        for a, b in zip(bins, bins[1:]):
+            data[:, a] -= data[:, b]
+        stage('difference', started, data, data)
+        started = perf_counter()
+        index = pipeline.local_datetime64(data[:, ts]).astype(DATETIME_DTYPE)
+        report.append({'stage': 'datetime', 'seconds': perf_counter() - started, 'rows': len(index), 'copies': 0})
+        started = perf_counter()
+        sorted_data = data
+        if len(index) > 1 and (index[1:] < index[:-1]).any():
+            order = np.argsort(index, kind='stable')
+            index = index[order]
+            sorted_data = data[order]
+        stage('sort', started, data, sorted_data)
+        data = sorted_data
+        started = perf_counter()
+        values = data[:, ts + 1:] if ts == 0 else np.delete(data, ts, axis=1)
+        columns = header[:ts] + header[ts + 1:]
+        df = pd.DataFrame(values, index=pd.DatetimeIndex(index, name='datetime'), columns=columns, copy=False)
+        stage('frame', started, data, df.to_numpy(copy=False))
+        self.stage_report = report
+        return df
+
+    def file_version(self, filename: str):
+        version = self.manifest.version(filename)
+        if version is None or filename == self.manifest.entries[self.manifest.stems[-1]]['file']:
+            st = os.stat(self.data_dir + filename)
+            version = (st.st_mtime_ns, st.st_size)
+            if filename.endswith('.bin'):
+                version += (columnar.read_header(self.data_dir + filename)[3],)
+        return version
+
+    def load_file(self, filename: str) -> np.ndarray:
+        filename = self.resolve(filename)
+        version = self.file_version(filename)
+        data = self.cache.get(filename, version)
+        if data is None:
+            data = self.read_file(filename)
+            self.cache.put(filename, version, data)
         return data
 
-    def read_file(self, filename):
-        with open(self.data_dir + filename) as f:
-            f.readline()
-            contents = f.read()
-        lines = contents[:-1].split('\n')
-        data = []
-        for line in lines:
-            if line.endswith(' '):
-                data.append(self.txt2num(line[:-1]))
-            else:
-                data.append(self.txt2num(line))
+    def read_file(self, filename, start=None, end=None) -> np.ndarray:
+        filename = self.resolve(filename)
+        if filename.endswith('.bin'):
+            columns = columnar.slice_range(columnar.read_columns(self.data_dir + filename), start, end)
+            return np.column_stack([values.astype(np.float64) for values in columns.values()])
+        if filename.endswith('.chunk'):
+            columns = columnar.slice_range(compaction.read_chunk(self.data_dir + filename, start, end), start, end)
+            return np.column_stack([values.astype(np.float64) for values in columns.values()])
+        with open(self.data_dir + filename, 'rb') as f:
+            header = f.readline().split()
+            if start is None and end is None:
+                return self.parse_text(f.read(), len(header))
+            lo, hi = self.seek_index.span(self.data_dir + filename, start, end)
+            f.seek(lo)
+            data = self.parse_text(f.read() if hi is None else f.read(hi - lo), len(header))
+        # the index is sparse, trim the rows around the range exactly
+        timestamp = data[:, header.index(b'timestamp')]
+        keep = np.ones(len(data), dtype=bool)
+        if start is not None:
+            keep &= timestamp >= start
+        if end is not None:
+            keep &= timestamp <= end
+        return data[keep]
+
+    def parse_text(self, contents: bytes, ncols: int) -> np.ndarray:
+        # drop a half-written last line and map None to nan
+        contents = contents[:contents.rfind(b'\n') + 1].replace(b'None', b'nan')
+        if not contents:
+            return np.empty((0, ncols))
+        try:
+            data = np.loadtxt(io.BytesIO(contents), dtype=np.float64, ndmin=2)
+            if data.shape[1] == ncols:
+                return data
+        except ValueError:
+            pass
+        # malformed tokens or ragged lines somewhere in the file, fall back to line by line
+        lines = contents.decode(errors='replace').split('\n')[:-1]
+        data = np.full((len(lines), ncols), np.nan)
+        for i, line in enumerate(lines):
+            nums = self.txt2num(line)
+            if len(nums) == ncols:
+                data[i] = nums
         return data
 
-    def cap_archive_list(self, files: list, limit='1h') -> list:
-        files_str = ' '.join(files)
-        fn_list = re.findall(self.re_compile, files_str)
+    def stream(self, files: list, start=None, end=None, max_bytes=8 * 1024**2, align_to=None):
+        # yields row blocks of at most roughly max_bytes, one file at a time; align_to is a header every
+        # block is fitted to, for files that don't all share one
+        for file in files:
+            file = self.resolve(file)
+            header = self.read_header(file)
+            rows = max(1, max_bytes // (len(header) * 8 * 2))
+            cached = self.cache.get(file, self.file_version(file))
+            if cached is not None:
+                blocks = (cached[i:i + rows] for i in range(0, len(cached), rows))
+            elif file.endswith('.bin'):
+                columns = list(columnar.slice_range(columnar.read_columns(self.data_dir + file), start, end).values())
+                blocks = (np.column_stack([values[i:i + rows] for values in columns]).astype(np.float64)
+                          for i in range(0, len(columns[0]), rows))
+            elif file.endswith('.chunk'):
+                blocks = (np.column_stack(list(block.values())).astype(np.float64)
+                          for block in compaction.iter_chunk(self.data_dir + file, start, end))
+            else:
+                blocks = self.iter_text(file, max_bytes // 4, start, end)
+            if start is not None or end is not None:
+                blocks = pipeline.select_range(blocks, header.index('timestamp'), start, end)
+            for block in blocks:
+                if len(block):
+                    yield block if align_to is None else pipeline.align(block, header, align_to)
+
+    def iter_text(self, filename: str, chunk_bytes: int, start=None, end=None):
+        with open(self.data_dir + filename, 'rb') as f:
+            ncols = len(f.readline().split())
+            hi = None
+            if start is not None or end is not None:
+                lo, hi = self.seek_index.span(self.data_dir + filename, start, end)
+                f.seek(lo)
+            tail = b''
+            while True:
+                block = f.read(chunk_bytes if hi is None else min(chunk_bytes, hi - f.tell()))
+                if not block:
+                    break
+                block = tail + block
+                cut = block.rfind(b'\n') + 1
+                tail = block[cut:]
+                yield self.parse_text(block[:cut], ncols)
+
+    def stream_resample(self, files: list, rule: str, how='mean', start=None, end=None, max_bytes=8 * 1024**2):
+        # same result as create_df(files).resample(rule).agg(how), in bounded memory
+        header = pipeline.merge_headers([self.read_header(file) for file in files])
+        stream = self.stream(files, start, end, max_bytes, header)
+        stream = pipeline.difference_bins(pipeline.drop_incomplete(stream, pipeline.required_columns(header)), header)
+        return pipeline.StreamResampler(rule, header).consume(stream).result(how)
+
+    def read_columns(self, filename: str, start=None, end=None) -> dict:
+        # zero-copy column views for binary files, parsed columns for text ones
+        filename = self.resolve(filename)
+        if filename.endswith('.bin'):
+            columns = columnar.read_columns(self.data_dir + filename)
+        elif filename.endswith('.chunk'):
+            columns = compaction.read_chunk(self.data_dir + filename, start, end)
+        else:
+            header = self.read_header(filename)
+            data = self.load_file(filename)
+            columns = {name: data[:, i] for i, name in enumerate(header)}
+        return columnar.slice_range(columns, start, end)
+
+    def timespan_start(self, limit: str):
+        self.manifest.refresh()
+        recent = self.manifest.latest_start()
+        if recent is None:
+            return None
+        return recent - self.delta_dict[limit].total_seconds()
+
+    def recent(self, minutes: float):
+        # rows from the last few minutes of data, only the tail of the newest files is read
+        with self.profiler.stage('listing') as stage:
+            self.manifest.refresh()
+            if not self.manifest.stems:
+                return None
+            latest = self.manifest.lasts[-1]
+            start = latest - minutes * 60
+            files = self.manifest.overlapping(start, latest)
+            stage['rows'] = len(files)
+        return self.create_df(files, start)
+
+    def resample_span(self, limit: str, rule: str, how='mean'):
+        # pre-aggregated view of a toolbar timespan, None if no rollup tier fits the rule
+        start = self.timespan_start(limit)
+        if start is None:
+            return None
+        return self.rollups.query(start, datetime.now().timestamp(), rule, how)
+
+    def plot_data(self, timespan: str) -> tuple:
+        # the raw and resampled frames behind a toolbar timespan
+        plot_data = plot_data_rs = None
+        if timespan in self.rollup_dict:
+            with self.profiler.stage('rollups') as stage:
+                plot_data = self.resample_span(timespan, self.rollup_dict[timespan])
+                plot_data_rs = self.resample_span(timespan, self.resample_dict[timespan])
+                stage['rows'] = None if plot_data is None else len(plot_data)
+        if plot_data is None or plot_data_rs is None:
+            plot_data = self.recent(self.delta_dict[timespan].total_seconds() / 60)
+            with self.profiler.stage('resample', len(plot_data)):
+                plot_data_rs = plot_data.resample(self.resample_dict[timespan]).mean()
+        return plot_data, plot_data_rs
+
+    def cap_archive_list(self, files=None, limit='1h') -> list:
+        if files is None:
+            start = self.timespan_start(limit)
+            if start is None:
+                return []
+            return self.manifest.started_between(start, self.manifest.latest_start())
+        fn_files = self.archive_files(files)
         fn_datetime = []
         filenames = []
-        for fn in fn_list:
-            fn_datetime.append(datetime.strptime(fn, self.fn_format))
+        for fn in fn_files:
+            fn_datetime.append(datetime.strptime(self.re_compile.search(fn).group(), self.fn_format))
         recent_datetime = max(fn_datetime)
-        for time in fn_datetime:
+        for time, file in zip(fn_datetime, fn_files.values()):
             if time >= recent_datetime - self.delta_dict[limit]:
-                filenames.append(time.strftime(self.fn_format) + '.txt')
+                filenames.append(file)
         return filenames
 
 if __name__ == '__main__':
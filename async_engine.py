@@ -0,0 +1,246 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Thread
+from acquisition import SensorReader
+from archive import ReadArchive
+from scheduler import Schedule, next_boundary
+from writer import ArchiveWriter, recover
+
+logger = logging.getLogger(__name__)
+
+class Source(SensorReader):
+    def __init__(self, *args, **kwargs):
+        # read from the event loop rather than a thread of its own, see SensorReader for the arguments
+        super().__init__(*args, **kwargs)
+        self.ready = asyncio.Event()
+
+
+class AsyncEngine:
+    def __init__(self, sensors, stop_fd=None, subscriber_size=256):
+        # one event loop for every sensor: the PM UART is watched with add_reader, blocking
+        # reads (I2C, simulated drivers) and file writes go to single-thread executors
+        self.sensors = sensors
+        self.stop_fd = stop_fd
+        self.subscriber_size = subscriber_size
+        self.acquisition = sensors.create_acquisition(Source)
+        self.sources = {source.name: source for source in self.acquisition.workers}
+        # queue -> name, and records each name lost to a full queue
+        self.subscribers = {}
+        self.dropped = {}
+        self.schedule = None
+        self.loop = None
+        self.stopping = None
+        self.registry = None
+
+    def run(self):
+        asyncio.run(self.main())
+
+    def stop(self):
+        # from another thread of the same process; other processes write to stop_fd
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    def stop_requested(self):
+        # drain the byte and stop watching, a readable fd would call back on every loop iteration
+        try:
+            os.read(self.stop_fd, 1)
+        except BlockingIOError:
+            pass
+        self.loop.remove_reader(self.stop_fd)
+        self.stopping.set()
+
+    def subscribe(self, maxsize=None, name=None) -> asyncio.Queue:
+        # every record goes to every subscriber, a full queue loses its oldest record
+        queue = asyncio.Queue(self.subscriber_size if maxsize is None else maxsize)
+        name = str(name or len(self.subscribers) + 1)
+        self.subscribers[queue] = name
+        self.dropped.setdefault(name, 0)
+        if self.registry is not None:
+            self.registry.gauge('environment_subscriber_depth', 'Records waiting in a subscriber queue',
+                                ('subscriber',)).labels(name).set_function(queue.qsize)
+            self.registry.counter('environment_subscriber_dropped_total', 'Records a full subscriber queue lost',
+                                  ('subscriber',)).labels(name).set_function(lambda: self.dropped[name])
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        del self.subscribers[queue]
+
+    def publish(self, values: list):
+        self.sensors.ring.append(values)
+        self.sensors.window_stats.update(values[0], values[1:])
+        for queue, name in self.subscribers.items():
+            if queue.full():
+                queue.get_nowait()
+                self.dropped[name] += 1
+            queue.put_nowait(values)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.registry = self.sensors.start_metrics()
+        # before the first record, see Sensors.start_loop
+        recover(self.sensors.data_folder)
+        self.sensors.window_stats.rebuild(ReadArchive(self.sensors.data_folder))
+        self.acquisition.instrument(self.registry)
+        if self.stop_fd is not None:
+            self.loop.add_reader(self.stop_fd, self.stop_requested)
+        self.i2c = ThreadPoolExecutor(1, thread_name_prefix='i2c')
+        self.blocking = ThreadPoolExecutor(1, thread_name_prefix='driver')
+        self.io = ThreadPoolExecutor(1, thread_name_prefix='archive')
+        # room for a whole file of records while the disk stalls, past that the oldest go like any subscriber's
+        records = self.subscribe(maxsize=self.sensors.reset_threshold, name='archive')
+        tasks = [asyncio.create_task(self.poll(self.sources['bme280'], self.i2c), name='bme280'),
+                 asyncio.create_task(self.watch_pm25(), name='pm25'),
+                 asyncio.create_task(self.record(), name='record')]
+        archive = asyncio.create_task(self.archive(records), name='archive')
+        stopping = asyncio.create_task(self.stopping.wait())
+        # none of the tasks ends before the stop signal unless it failed, and then the rest stop with it
+        done, _ = await asyncio.wait([stopping, archive, *tasks], return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.sensors.window_stats.publish()
+        if not archive.done():
+            # everything recorded so far still reaches the disk
+            await records.put(None)
+        await asyncio.gather(archive, return_exceptions=True)
+        if self.stop_fd is not None:
+            # still watched when stop() ended the run
+            self.loop.remove_reader(self.stop_fd)
+        self.i2c.shutdown(wait=False, cancel_futures=True)
+        self.blocking.shutdown(wait=False, cancel_futures=True)
+        self.io.shutdown()
+        failures = []
+        for task in [*tasks, archive]:
+            if not task.cancelled() and task.exception() is not None:
+                failures.append(task.exception())
+            elif task in done:
+                failures.append(RuntimeError(f'{task.get_name()} task ended'))
+        for error in failures[1:]:
+            logger.error('Engine task failed', exc_info=error)
+        if failures:
+            raise failures[0]
+
+    async def tick(self, schedule: Schedule):
+        # Schedule.wait on the loop: sleep to the deadline without blocking the other tasks
+        await asyncio.sleep(schedule.delay())
+        schedule.tick()
+
+    async def poll(self, source: Source, executor: ThreadPoolExecutor):
+        schedule = source.create_schedule()
+        # the first read goes out straight away like SensorWorker.run, record waits for it
+        while True:
+            # no executor for reads that never block, like averaging frames already decoded
+            if executor is None:
+                source.poll()
+            else:
+                await self.loop.run_in_executor(executor, source.poll)
+            source.ready.set()
+            await self.tick(schedule)
+
+    async def watch_pm25(self):
+        # the sensor streams a frame about every second, decode whatever the UART has instead of
+        # parking a thread in a blocking read; drivers without a port are polled in the executor
+        source = self.sources['pm25']
+        frames = getattr(self.sensors.driver, 'frames', None)
+        if frames is None:
+            await self.poll(source, self.blocking)
+            return
+        watched = {'fd': None, 'retry': None}
+
+        def readable():
+            try:
+                data = os.read(watched['fd'], 4096)
+                if not data:
+                    # hung up, the fd would stay readable for good
+                    raise OSError('UART hung up')
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # like FrameReader.run: count it, stop watching the dead fd and reopen the port a little later
+                frames.failed(e)
+                self.loop.remove_reader(watched['fd'])
+                watched['retry'] = self.loop.call_later(frames.retry_seconds, rewatch)
+                return
+            frames.last_error = None
+            frames.feed(data)
+
+        def watch():
+            watched['fd'] = frames.uart.fileno()
+            os.set_blocking(watched['fd'], False)
+            self.loop.add_reader(watched['fd'], readable)
+
+        def rewatch():
+            frames.reopen()
+            try:
+                watch()
+            except Exception as e:
+                frames.failed(e)
+                watched['retry'] = self.loop.call_later(frames.retry_seconds, rewatch)
+
+        watch()
+        try:
+            # every interval reports the average of the frames that came in meanwhile
+            source.read = lambda: frames.read(self.sensors.pm_extremes)
+            await self.poll(source, None)
+        finally:
+            if watched['retry'] is not None:
+                watched['retry'].cancel()
+            self.loop.remove_reader(watched['fd'])
+
+    async def record(self):
+        sources = self.sources.values()
+        try:
+            # like Acquisition.start, without holding up the loop
+            await asyncio.wait_for(asyncio.gather(*(source.ready.wait() for source in sources)),
+                                   max(source.timeout for source in sources))
+        except asyncio.TimeoutError:
+            pass
+        # started once the first readings are in, as in Sensors.start_loop
+        self.schedule = Schedule(self.sensors.sampling_delay)
+        self.schedule.instrument(self.registry, 'record')
+        while True:
+            self.publish(self.acquisition.sample())
+            await self.tick(self.schedule)
+
+    async def archive(self, records: asyncio.Queue):
+        # same files as Sensors.start_loop, the writes run off the loop
+        sensors = self.sensors
+        writer = ArchiveWriter(sensors.data_folder, sensors.header, binary=sensors.binary_archive,
+                               capacity=sensors.reset_threshold + 64, **sensors.write_policy)
+        writer.instrument(self.registry)
+        rotate_at = None
+        while True:
+            values = await records.get()
+            if values is None:
+                break
+            # by the record's own time, a record queued just before the hour still goes in that hour's file
+            fn_dt = datetime.fromtimestamp(values[0])
+            if rotate_at is None or fn_dt >= rotate_at:
+                if rotate_at is not None:
+                    await self.loop.run_in_executor(self.io, writer.close)
+                    self.report(writer)
+                rotate_at = next_boundary(fn_dt, sensors.rotation_seconds)
+                await self.loop.run_in_executor(self.io, writer.open, fn_dt)
+                sensors.filename = writer.filename
+            await self.loop.run_in_executor(self.io, writer.write, values)
+        if rotate_at is not None:
+            await self.loop.run_in_executor(self.io, writer.close)
+            self.report(writer)
+
+    def report(self, writer: ArchiveWriter):
+        logger.info('Write latency: %s', writer.stats())
+        logger.info('Sensor latency: %s', self.stats())
+        # fold the file that just closed into the rollup tiers without holding up sampling
+        Thread(target=ReadArchive(self.sensors.data_folder).rollups.update, daemon=True).start()
+
+    def stats(self) -> dict:
+        stats = self.acquisition.stats()
+        if self.schedule is not None:
+            stats['record'] = {'schedule': self.schedule.stats()}
+        stats['dropped'] = dict(self.dropped)
+        return stats
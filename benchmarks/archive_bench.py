@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import shutil
+import platform
+import tempfile
+from time import perf_counter
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from archive import ReadArchive
+from compaction import Compactor
+from synth import write_archive
+
+SIZES = {'1d': 24, '1w': 24 * 7, '1m': 24 * 30, '1y': 24 * 365, '3y': 24 * 365 * 3}
+TIMESPANS = ['1h', '8h', '24h', '7d', '1m', '6m', '1y']
+START = datetime(2021, 1, 1)
+
+
+def prepare(root: str, size: str, binary=False, compact=False) -> str:
+    # generated archives are kept under root and reused by later runs
+    data_dir = os.path.join(root, size + ('-bin' if binary else '') + ('-compact' if compact else '')) + '/'
+    if os.path.exists(data_dir + '.complete'):
+        # RollupStore.query doesn't update, tiers from an older layout are built again here
+        archive = ReadArchive(data_dir)
+        archive.rollups.update()
+        archive.close()
+        return data_dir
+    shutil.rmtree(data_dir, ignore_errors=True)
+    write_archive(data_dir, START, SIZES[size], binary=binary)
+    archive = ReadArchive(data_dir)
+    if compact:
+        # the second pass removes the files the first one merged
+        Compactor(archive, grace=0).run()
+        Compactor(archive, grace=0).run()
+    # the toolbar's long spans read rollups, build them up front like the daemon would
+    archive.rollups.update()
+    archive.close()
+    open(data_dir + '.complete', 'w').close()
+    return data_dir
+
+
+def timed(fn) -> tuple:
+    start = perf_counter()
+    result = fn()
+    return perf_counter() - start, result
+
+
+def count(result) -> int:
+    if isinstance(result, tuple):
+        result = result[0]
+    return 0 if result is None else len(result)
+
+
+def run(data_dir: str, timespans=TIMESPANS, repeat=3) -> list:
+    # cold: a fresh ReadArchive on a saved manifest, warm: best of `repeat` calls on the same one
+    archive = ReadArchive(data_dir)
+    archive.manifest.refresh()
+    end = archive.manifest.lasts[-1]
+    archive.close()
+    fmt = archive.fn_format
+    ops = [('listing', None, lambda a: a.archive_files(os.listdir(data_dir)))]
+    for timespan in timespans:
+        start = end - archive.delta_dict[timespan].total_seconds()
+        sd = datetime.fromtimestamp(start).strftime(fmt)
+        ed = datetime.fromtimestamp(end).strftime(fmt)
+        files = ReadArchive(data_dir).cap_archive_list(limit=timespan)
+        ops.append(('date_range', timespan, lambda a, sd=sd, ed=ed: a.date_range(sd, ed)))
+        ops.append(('cap_archive_list', timespan, lambda a, timespan=timespan: a.cap_archive_list(limit=timespan)))
+        ops.append(('create_df', timespan, lambda a, files=files: a.create_df(files)))
+        ops.append(('plot_data', timespan, lambda a, timespan=timespan: a.plot_data(timespan)))
+    results = []
+    for op, timespan, fn in ops:
+        archive = ReadArchive(data_dir)
+        cold, result = timed(lambda: fn(archive))
+        warm = min(timed(lambda: fn(archive))[0] for _ in range(repeat))
+        archive.close()
+        results.append({'op': op, 'timespan': timespan, 'cold': cold, 'warm': warm, 'rows': count(result)})
+    return results
+
+
+def describe(data_dir: str) -> dict:
+    archive = ReadArchive(data_dir)
+    archive.manifest.refresh()
+    entries = archive.manifest.entries.values()
+    info = {'files': len(archive.manifest.stems), 'rows': sum(entry['rows'] for entry in entries),
+            'bytes': sum(entry['size'] for entry in entries)}
+    archive.close()
+    return info
+
+
+def compare(old: dict, new: dict, threshold=1.2, min_delta=0.005) -> list:
+    # warm and cold ratios of matching measurements, slower than threshold counts as a regression
+    # unless it's only a few milliseconds of noise
+    def key(run, row):
+        return run['size'], run['binary'], run['compact'], row['op'], row['timespan']
+    before = {key(run, row): row for run in old['archives'] for row in run['results']}
+    regressions = []
+    for run in new['archives']:
+        for row in run['results']:
+            base = before.get(key(run, row))
+            if base is None:
+                continue
+            for phase in ('cold', 'warm'):
+                ratio = row[phase] / max(base[phase], 1e-9)
+                if ratio > threshold and row[phase] - base[phase] > min_delta:
+                    regressions.append({'size': run['size'], 'op': row['op'], 'timespan': row['timespan'],
+                                        'phase': phase, 'before': base[phase], 'after': row[phase], 'ratio': ratio})
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Time archive listing, loading and plot data preparation')
+    parser.add_argument('--sizes', default='1d,1w,1m', help=f"comma separated, any of {', '.join(SIZES)}")
+    parser.add_argument('--root', default=os.path.join(tempfile.gettempdir(), 'environment-bench'),
+                        help='where generated archives are kept between runs')
+    parser.add_argument('--binary', action='store_true', help='write .bin copies like Sensors does')
+    parser.add_argument('--compact', action='store_true', help='compact the archives before timing')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='earlier --json output to check for regressions')
+    args = parser.parse_args()
+    report = {'meta': {'created': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'pandas': pd.__version__, 'platform': platform.platform(),
+                       'cpus': os.cpu_count()},
+              'archives': []}
+    for size in args.sizes.split(','):
+        data_dir = prepare(args.root, size, args.binary, args.compact)
+        results = run(data_dir, repeat=args.repeat)
+        report['archives'].append({'size': size, 'hours': SIZES[size], 'binary': args.binary,
+                                   'compact': args.compact, **describe(data_dir), 'results': results})
+        print(f"{size}: {report['archives'][-1]['files']} files, {report['archives'][-1]['rows']} rows")
+        print(f"{'op':>18} {'span':>5} {'cold':>10} {'warm':>10} {'rows':>9}")
+        for row in results:
+            print(f"{row['op']:>18} {row['timespan'] or '':>5} {row['cold'] * 1000:>8.1f}ms "
+                  f"{row['warm'] * 1000:>8.1f}ms {row['rows']:>9}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report)
+        for row in regressions:
+            print(f"slower: {row['size']} {row['op']} {row['timespan'] or ''} {row['phase']} "
+                  f"{row['before'] * 1000:.1f}ms -> {row['after'] * 1000:.1f}ms ({row['ratio']:.2f}x)")
+        sys.exit(1 if regressions else 0)
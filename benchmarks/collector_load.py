@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import tempfile
+from threading import Event, Thread
+from time import monotonic, sleep, time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from archive import ReadArchive
+from collector import Collector, Uploader
+from ringbuffer import SampleRing
+from drivers import SyntheticDriver
+from synth import HEADER
+
+
+def produce(ring: SampleRing, rate: float, stop: Event, seed: int):
+    # what a station's daemon puts in its ring, in bursts of 10 ms so high rates stay cheap
+    driver = SyntheticDriver(seed=seed, pm_failure_rate=0.01)
+    period = 1 / rate
+    base = time()
+    started = monotonic()
+    count = 0
+    while not stop.is_set():
+        due = int((monotonic() - started) * rate)
+        for _ in range(due - count):
+            try:
+                particles = driver.read_pm25()
+            except RuntimeError:
+                particles = [None] * 12
+            ring.append([base + count * period, *driver.read_bme280(), *particles])
+            count += 1
+        sleep(0.01)
+
+
+def run(root: str, stations=4, rate=1000.0, seconds=10.0, drop_every=3.0) -> dict:
+    collector = Collector(root, host='127.0.0.1', port=0)
+    collector.ready = Event()
+    server = Thread(target=collector.run, daemon=True)
+    server.start()
+    collector.ready.wait()
+    columns = HEADER.split()
+    rings = [SampleRing.create(columns, capacity=max(17280, int(rate * 30))) for _ in range(stations)]
+    stop_producers = Event()
+    stop_uploaders = Event()
+    uploaders = [Uploader(ring, '127.0.0.1', collector.port, f'station-{i}', batch_seconds=0.2)
+                 for i, ring in enumerate(rings)]
+    producers = [Thread(target=produce, args=(ring, rate, stop_producers, i), daemon=True)
+                 for i, ring in enumerate(rings)]
+    senders = [Thread(target=uploader.run, args=(stop_uploaders,), daemon=True) for uploader in uploaders]
+    started = monotonic()
+    for thread in producers + senders:
+        thread.start()
+    # cut every station's connection now and then to exercise reconnect and resume
+    next_drop = started + drop_every
+    while monotonic() - started < seconds:
+        sleep(0.05)
+        if drop_every and monotonic() >= next_drop:
+            for uploader in uploaders:
+                uploader.drop()
+            next_drop += drop_every
+    stop_producers.set()
+    for thread in producers:
+        thread.join()
+    produced = [ring.seq for ring in rings]
+    deadline = monotonic() + 30
+    while monotonic() < deadline and any(u.acked < n for u, n in zip(uploaders, produced)):
+        sleep(0.05)
+    drained = monotonic() - started
+    stop_uploaders.set()
+    for thread in senders:
+        thread.join()
+    collector.stop()
+    server.join()
+    results = {'stations': stations, 'rate': rate, 'seconds': drained, 'produced': sum(produced),
+               'throughput': sum(produced) / drained, 'uploaders': [u.stats() for u in uploaders],
+               'collector': collector.stats()}
+    # read everything back the way a user would, per station
+    archive = ReadArchive(os.path.join(root, ''))
+    stored = {}
+    for name in archive.stations():
+        station = archive.station(name)
+        station.manifest.refresh()
+        # raw columns, create_df would also drop the rows with a failed PM read
+        timestamps = np.concatenate([station.read_columns(file)['timestamp']
+                                     for file in station.manifest.files(0, None)])
+        stored[name] = {'rows': len(timestamps), 'unique': len(np.unique(timestamps))}
+        station.close()
+    archive.close()
+    results['stored'] = stored
+    results['complete'] = all(stored.get(u.station, {}).get('unique') == n for u, n in zip(uploaders, produced))
+    for ring in rings:
+        ring.unlink()
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Stream simulated stations to a collector over localhost')
+    parser.add_argument('--stations', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=1000.0, help='samples per second per station')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--drop-every', type=float, default=3.0, help='seconds between forced reconnects, 0 for none')
+    parser.add_argument('--root', help='collector root, a temporary directory otherwise')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args.root or tmp, args.stations, args.rate, args.seconds, args.drop_every)
+    print(f"{results['stations']} stations x {results['rate']:.0f}/s: {results['produced']} samples in "
+          f"{results['seconds']:.1f}s, {results['throughput']:.0f} samples/s, complete: {results['complete']}")
+    for uploader in results['uploaders']:
+        name = uploader['station']
+        print(f"  {name}: sent {uploader['sent']} acked {uploader['acked']} batches {uploader['batches']} "
+              f"reconnects {uploader['reconnects']} | stored {results['stored'].get(name)} | "
+              f"collector {results['collector'].get(name)}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import tempfile
+from time import monotonic, sleep, time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sensors import Sensors
+import drivers
+
+
+def watch(sensors: Sensors, seconds: float, poll=0.01) -> dict:
+    # what the GUI live paths do: follow the ring and ask for the latest reading
+    ring = sensors.ring
+    seq = ring.seq
+    delays = []
+    gaps = 0
+    latest = 0
+    started = monotonic()
+    while monotonic() - started < seconds:
+        records, current = ring.since(seq)
+        now = time()
+        if len(records):
+            if int(records['seq'][0]) != seq + 1:
+                gaps += int(records['seq'][0]) - seq - 1
+            delays.extend(now - records['timestamp'])
+        seq = current
+        if sensors.get_latest_reading() is not None:
+            latest += 1
+        sleep(poll)
+    return {'delays': np.array(delays), 'gaps': gaps, 'latest_reads': latest}
+
+
+def run(driver, rate=100.0, seconds=10.0, data_dir=None, sensor_rate=None, engine='threads') -> dict:
+    with tempfile.TemporaryDirectory(dir=data_dir) as tmp:
+        intervals = None
+        if sensor_rate is not None:
+            intervals = {'bme280': 1 / sensor_rate, 'pm25': 1 / sensor_rate}
+        sensors = Sensors(data_folder=tmp + '/', driver=driver, sampling_delay=1 / rate,
+                          sensor_intervals=intervals, ring_capacity=max(17280, int(rate * seconds * 2)),
+                          engine=engine)
+        sensors.start_daemon()
+        started = time()
+        watched = watch(sensors, seconds)
+        sensors.stop_daemon()
+        elapsed = time() - started
+        records = sensors.ring.latest(sensors.ring.seq).copy()
+        sensors.close()
+    timestamps = records['timestamp']
+    # the daemon spends its first moments waiting for the sensors, count from the first record
+    span = timestamps[-1] - timestamps[0] if len(timestamps) > 1 else 0.0
+    expected = int(span * rate) + 1
+    intervals = np.diff(timestamps)
+    delays = watched['delays']
+    return {'rate': rate, 'seconds': elapsed, 'records': len(records),
+            'throughput': len(records) / span if span else 0.0,
+            'drop_rate': max(0.0, 1 - len(records) / expected),
+            'pm_failures': float(np.isnan(records['pm25_standard']).mean()) if len(records) else 0.0,
+            'interval_p99': float(np.percentile(intervals, 99)) if len(intervals) else None,
+            'interval_max': float(intervals.max()) if len(intervals) else None,
+            'reader_gaps': watched['gaps'], 'latest_reads': watched['latest_reads'],
+            'delay_p50': float(np.percentile(delays, 50)) if len(delays) else None,
+            'delay_p99': float(np.percentile(delays, 99)) if len(delays) else None,
+            'delay_max': float(delays.max()) if len(delays) else None}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the sampling daemon on simulated sensors and report '
+                                                 'throughput, drop rate and latency')
+    parser.add_argument('--rates', default='10,100,200', help='record rates in Hz, comma separated')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--sensor-rate', type=float, help='sensor read rate in Hz, at most the record rate (the default)')
+    parser.add_argument('--replay', help='replay this archive directory instead of synthetic readings')
+    parser.add_argument('--speed', type=float, default=60.0, help='replay speed')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean synthetic read time in seconds')
+    parser.add_argument('--pm-failures', type=float, default=0.01, help='rate of PM RuntimeErrors')
+    parser.add_argument('--stalls', type=float, default=0.0, help='rate of reads that hang for 5 s')
+    parser.add_argument('--engine', default='threads', choices=('threads', 'asyncio'))
+    parser.add_argument('--data-dir', help='directory on the card to test, a temporary one otherwise')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    results = []
+    for rate in [float(rate) for rate in args.rates.split(',')]:
+        if args.replay:
+            driver = drivers.ReplayDriver(args.replay, speed=args.speed)
+        else:
+            driver = drivers.SyntheticDriver(latency=args.latency, pm_failure_rate=args.pm_failures,
+                                             stall_rate=args.stalls)
+        results.append(run(driver, rate, args.seconds, args.data_dir, args.sensor_rate, args.engine))
+    print(f"{'rate':>6} {'records':>8} {'rec/s':>8} {'drops':>7} {'pm fail':>7} {'ivl p99':>9} "
+          f"{'delay p50':>10} {'delay p99':>10} {'gaps':>5}")
+    for row in results:
+        print(f"{row['rate']:>6.0f} {row['records']:>8} {row['throughput']:>8.1f} {row['drop_rate']:>7.2%} "
+              f"{row['pm_failures']:>7.2%} {(row['interval_p99'] or 0) * 1e3:>7.1f}ms "
+              f"{(row['delay_p50'] or 0) * 1e3:>8.1f}ms {(row['delay_p99'] or 0) * 1e3:>8.1f}ms {row['reader_gaps']:>5}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
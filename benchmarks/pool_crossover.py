@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import tempfile
+from time import perf_counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from archive import ReadArchive
+from synth import write_archive
+
+SIZES = [1, 2, 4, 8, 16, 32, 64, 128]
+MODES = ['inline', 'thread', 'process']
+
+
+def best_of(fn, repeat=3) -> float:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def run(data_dir: str, sizes=SIZES, repeat=3) -> list:
+    archive = ReadArchive(data_dir)
+    files = sorted(archive.archive_files(os.listdir(data_dir)).values())
+    results = []
+    # warm every pool once so worker startup doesn't land in the first measurement
+    for mode in MODES:
+        archive.pool.read(files[:2], mode=mode)
+    for n in sizes:
+        row = {'files': n}
+        for mode in MODES:
+            row[mode] = best_of(lambda: archive.pool.read(files[:n], mode=mode), repeat)
+        row['fastest'] = min(MODES, key=lambda mode: row[mode])
+        results.append(row)
+    archive.close()
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Find where threads and processes start to pay off for archive reads')
+    parser.add_argument('--data-dir', help='existing archive to read, a synthetic one is generated otherwise')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp + '/'
+        if args.data_dir is None:
+            write_archive(data_dir, datetime(2024, 1, 1), max(SIZES))
+        results = run(data_dir)
+    print(f"cpus: {os.cpu_count()}")
+    print(f"{'files':>6} {'inline':>10} {'thread':>10} {'process':>10}  fastest")
+    for row in results:
+        print(f"{row['files']:>6} " + ' '.join(f'{row[mode] * 1000:>8.1f}ms' for mode in MODES) + f"  {row['fastest']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'cpus': os.cpu_count(), 'results': results}, f, indent=2)
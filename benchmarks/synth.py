@@ -0,0 +1,76 @@
+import os
+import sys
+import numpy as np
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from columnar import ColumnarWriter
+
+HEADER = 'timestamp temperature humidity pressure pm10_standard pm25_standard pm100_standard pm10_env pm25_env pm100_env particles_03um particles_05um particles_10um particles_25um particles_50um particles_100um\n'
+
+
+def hourly_file(start: datetime, rng: np.random.Generator, samples=720, cadence=5.0, none_rate=0.01) -> tuple:
+    # one file the way Sensors.start_loop writes it: the period drifts by the read time
+    period = cadence + rng.uniform(0.05, 0.3, samples)
+    timestamps = start.timestamp() + np.concatenate([[0.0], np.cumsum(period[:-1])])
+    hours = timestamps / 3600
+    temperature = np.round(21 + 2 * np.sin(2 * np.pi * hours / 24) + rng.normal(0, 0.1, samples), 1)
+    humidity = np.round(45 + 8 * np.sin(2 * np.pi * hours / 24 + 1) + rng.normal(0, 0.5, samples), 1)
+    pressure = np.round(1013 + 5 * np.sin(2 * np.pi * hours / 240) + rng.normal(0, 0.2, samples), 1)
+    pm = rng.poisson(8, (samples, 6)).cumsum(axis=1)
+    # particle counts are cumulative, larger bins never exceed smaller ones
+    counts = np.sort(rng.poisson(40, (samples, 6)).cumsum(axis=1) * 10, axis=1)[:, ::-1]
+    lines = []
+    rows = []
+    # a RuntimeError from the PM sensor leaves every particle field as None
+    failed = rng.random(samples) < none_rate
+    for i in range(samples):
+        if failed[i]:
+            particles = [None] * 12
+        else:
+            particles = [*pm[i].tolist(), *counts[i].tolist()]
+        values = [float(timestamps[i]), float(temperature[i]), float(humidity[i]), float(pressure[i]), *particles]
+        lines.append(' '.join(str(value) for value in values) + '\n')
+        rows.append(values)
+    end = datetime.fromtimestamp(timestamps[-1] + period[-1])
+    return ''.join(lines), end, rows
+
+
+def write_archive(data_dir: str, start: datetime, hours: int, cadence=5.0, none_rate=0.01, seed=0,
+                  binary=False) -> list:
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    samples = int(round(3600 / cadence))
+    files = []
+    dt = start
+    for _ in range(hours):
+        filename = dt.strftime('%Y-%m-%d %H-%M-%S') + '.txt'
+        body, dt, rows = hourly_file(dt, rng, samples, cadence, none_rate)
+        with open(os.path.join(data_dir, filename), 'w') as f:
+            f.write(HEADER)
+            f.write(body)
+        if binary:
+            # the columnar copy Sensors writes next to the text file
+            writer = ColumnarWriter(os.path.join(data_dir, filename[:-4] + '.bin'), HEADER.split(),
+                                    capacity=samples + 64)
+            for values in rows:
+                writer.append(values)
+            writer.close()
+        files.append(filename)
+    return files
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Write a synthetic sensor archive')
+    parser.add_argument('data_dir')
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--days', type=int, help='overrides --hours')
+    parser.add_argument('--start', default=(datetime.now() - timedelta(hours=24)).strftime('%Y-%m-%d %H-%M-%S'))
+    parser.add_argument('--cadence', type=float, default=5.0)
+    parser.add_argument('--none-rate', type=float, default=0.01)
+    parser.add_argument('--binary', action='store_true', help='also write the .bin copies')
+    args = parser.parse_args()
+    hours = args.hours if args.days is None else args.days * 24
+    write_archive(args.data_dir, datetime.strptime(args.start, '%Y-%m-%d %H-%M-%S'), hours,
+                  args.cadence, args.none_rate, binary=args.binary)
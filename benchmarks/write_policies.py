@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import tempfile
+from time import perf_counter
+from datetime import datetime
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from writer import ArchiveWriter
+from synth import HEADER
+
+POLICIES = {
+    'per-sample': {'flush_samples': 1, 'fsync': 'rotation'},
+    'every-12': {'flush_samples': 12, 'fsync': 'rotation'},
+    'every-60s': {'flush_samples': None, 'flush_seconds': 60, 'fsync': 'rotation'},
+    'rotation': {'flush_samples': None, 'fsync': 'rotation'},
+    'fsync-each': {'flush_samples': 1, 'fsync': 'flush'},
+}
+
+
+def sample(i: int) -> list:
+    return [1704067200.0 + i * 5.1, 21.3, 45.2, 1013.4, 8, 16, 24, 8, 16, 24, 2400, 2000, 1600, 1200, 800, 400]
+
+
+def reopen_per_sample(data_dir: str, samples: int) -> list:
+    # what Sensors.start_loop used to do: open, append one line, close
+    filename = data_dir + 'reopen.txt'
+    with open(filename, 'w') as f:
+        f.write(HEADER)
+    latencies = []
+    for i in range(samples):
+        started = perf_counter()
+        f = open(filename, 'a')
+        f.write(' '.join(str(value) for value in sample(i)) + '\n')
+        f.close()
+        latencies.append(perf_counter() - started)
+    return latencies
+
+
+def run(data_dir: str, samples=720, binary=True) -> dict:
+    latencies = np.array(reopen_per_sample(data_dir, samples))
+    results = {'reopen': {'mean': latencies.mean(), 'p50': np.percentile(latencies, 50),
+                          'p99': np.percentile(latencies, 99), 'max': latencies.max()}}
+    for name, policy in POLICIES.items():
+        folder = data_dir + name + '/'
+        os.makedirs(folder)
+        writer = ArchiveWriter(folder, HEADER, binary=binary, capacity=samples + 64, **policy)
+        writer.open(datetime(2024, 1, 1))
+        for i in range(samples):
+            writer.write(sample(i))
+        started = perf_counter()
+        writer.close()
+        results[name] = {**writer.stats(), 'close': perf_counter() - started}
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Per-sample write latency of the archive writer flush policies')
+    parser.add_argument('--data-dir', help='directory on the card to test, a temporary one otherwise')
+    parser.add_argument('--samples', type=int, default=720)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(dir=args.data_dir) as tmp:
+        results = run(tmp + '/', args.samples)
+    print(f"{'policy':>12} {'mean':>9} {'p50':>9} {'p99':>9} {'max':>9}")
+    for name, row in results.items():
+        print(f'{name:>12} ' + ' '.join(f'{row[key] * 1e6:>7.0f}us' for key in ('mean', 'p50', 'p99', 'max')))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({name: {key: float(value) for key, value in row.items()} for name, row in results.items()}, f, indent=2)
@@ -0,0 +1,302 @@
+import os
+import re
+import json
+import select
+import socket
+import struct
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Thread
+from time import monotonic
+import numpy as np
+from ringbuffer import record_dtype
+from scheduler import next_boundary
+from writer import ArchiveWriter, recover
+
+# Every message is kind (u1) | payload length (u4) | payload
+#   HELLO    station -> collector  JSON {station, session, columns}
+#   WELCOME  collector -> station  last seq stored for that session (u8), 0 for a new one
+#   BATCH    station -> collector  ring records as they are in shared memory: seq (u8) + one f8 per column
+#   ACK      collector -> station  highest seq written to the station's archive (u8)
+MESSAGE = struct.Struct('<BI')
+SEQ = struct.Struct('<Q')
+HELLO, WELCOME, BATCH, ACK = 1, 2, 3, 4
+MAX_PAYLOAD = 16 * 1024**2
+STATION_NAME = re.compile(r'[A-Za-z0-9_.-]+')
+
+
+def message(kind: int, payload: bytes) -> bytes:
+    return MESSAGE.pack(kind, len(payload)) + payload
+
+
+async def read_message(reader: asyncio.StreamReader) -> tuple:
+    kind, length = MESSAGE.unpack(await reader.readexactly(MESSAGE.size))
+    if length > MAX_PAYLOAD:
+        raise ValueError(f'message of {length} bytes')
+    return kind, await reader.readexactly(length)
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        block = sock.recv(size - len(data))
+        if not block:
+            raise ConnectionError('collector closed the connection')
+        data.extend(block)
+    return bytes(data)
+
+
+def recv_message(sock: socket.socket) -> tuple:
+    kind, length = MESSAGE.unpack(recv_exactly(sock, MESSAGE.size))
+    return kind, recv_exactly(sock, length)
+
+
+class StationArchive:
+    def __init__(self, root: str, station: str, columns: list, binary=True, rotation_seconds=3600):
+        # <root>/<station>/ is an ordinary data folder, ReadArchive(root).station(name) reads it
+        self.data_folder = os.path.join(root, station, '')
+        os.makedirs(self.data_folder, exist_ok=True)
+        self.columns = list(columns)
+        self.dtype = record_dtype(self.columns)
+        self.timestamp = self.columns.index('timestamp')
+        self.rotation_seconds = rotation_seconds
+        self.state_file = self.data_folder + '.collector.json'
+        try:
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {'session': None, 'seq': 0}
+        recover(self.data_folder)
+        # flushed once per batch, the ack tells the station what it may forget
+        self.writer = ArchiveWriter(self.data_folder, ' '.join(self.columns) + '\n', binary=binary, capacity=4096,
+                                    flush_samples=None)
+        # one thread per station keeps its writes in order without holding up the others
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix=f'station-{station}')
+        self.rotate_at = None
+        self.samples = 0
+        self.lost = 0
+        self.duplicates = 0
+
+    def resume(self, session: str) -> int:
+        # a daemon restart starts a new ring and with it a new session counting from 1
+        if session != self.state['session']:
+            self.state = {'session': session, 'seq': 0}
+        return self.state['seq']
+
+    def write(self, records: np.ndarray) -> int:
+        seq = self.state['seq']
+        fresh = records[records['seq'] > seq]
+        self.duplicates += len(records) - len(fresh)
+        if not len(fresh):
+            return seq
+        # the station's ring lapped what it hadn't sent yet
+        self.lost += max(0, int(fresh['seq'][0]) - seq - 1)
+        for row in fresh.tolist():
+            values = [None if value != value else value for value in row[1:]]
+            if self.rotate_at is None or values[self.timestamp] >= self.rotate_at:
+                self.rotate(values[self.timestamp])
+            self.writer.write(values)
+        self.writer.flush()
+        self.samples += len(fresh)
+        self.state['seq'] = int(fresh['seq'][-1])
+        with open(self.state_file + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(self.state_file + '.tmp', self.state_file)
+        return self.state['seq']
+
+    def rotate(self, timestamp: float):
+        # files follow the samples' own clock, not the collector's
+        closing = self.writer.filename is not None
+        dt = datetime.fromtimestamp(timestamp)
+        self.writer.open(dt)
+        self.rotate_at = next_boundary(dt, self.rotation_seconds).timestamp()
+        if closing:
+            from archive import ReadArchive
+            Thread(target=ReadArchive(self.data_folder).rollups.update, daemon=True).start()
+
+    def close(self):
+        self.executor.shutdown()
+        self.writer.close()
+
+    def stats(self) -> dict:
+        return {'samples': self.samples, 'lost': self.lost, 'duplicates': self.duplicates, **self.state}
+
+
+class Collector:
+    def __init__(self, root='./stations/', host='0.0.0.0', port=8765, binary=True):
+        self.root = os.path.join(root, '')
+        self.host = host
+        self.port = port
+        self.binary = binary
+        self.stations = {}
+        self.connections = {}
+        self.loop = None
+        self.stopping = None
+        self.ready = None
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        # port 0 picks a free one, the bound port is what stations need
+        self.port = server.sockets[0].getsockname()[1]
+        if self.ready is not None:
+            self.ready.set()
+        async with server:
+            await self.stopping.wait()
+        for task in list(self.connections.values()):
+            task.cancel()
+        await asyncio.gather(*self.connections.values(), return_exceptions=True)
+        for archive in self.stations.values():
+            archive.close()
+
+    def station(self, name: str, columns: list) -> StationArchive:
+        archive = self.stations.get(name)
+        if archive is not None and archive.columns != list(columns):
+            archive.close()
+            archive = None
+        if archive is None:
+            archive = self.stations[name] = StationArchive(self.root, name, columns, self.binary)
+        return archive
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        name = None
+        try:
+            kind, payload = await read_message(reader)
+            hello = json.loads(payload)
+            name = hello['station']
+            if kind != HELLO or not STATION_NAME.fullmatch(name):
+                return
+            # a station that reconnects before its old connection timed out replaces it
+            previous = self.connections.pop(name, None)
+            if previous is not None:
+                previous.cancel()
+                await asyncio.gather(previous, return_exceptions=True)
+            self.connections[name] = asyncio.current_task()
+            archive = self.station(name, hello['columns'])
+            writer.write(message(WELCOME, SEQ.pack(archive.resume(hello['session']))))
+            await writer.drain()
+            while True:
+                kind, payload = await read_message(reader)
+                if kind != BATCH:
+                    break
+                records = np.frombuffer(payload, dtype=archive.dtype)
+                # the next batch isn't read before this one is on disk, a slow disk backs up
+                # into the TCP window and from there into the station's send
+                seq = await self.loop.run_in_executor(archive.executor, archive.write, records)
+                writer.write(message(ACK, SEQ.pack(seq)))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, KeyError):
+            pass
+        finally:
+            if name is not None and self.connections.get(name) is asyncio.current_task():
+                del self.connections[name]
+            writer.close()
+
+    def stats(self) -> dict:
+        return {name: archive.stats() for name, archive in self.stations.items()}
+
+
+class Uploader:
+    def __init__(self, ring, host: str, port: int, station=None, batch_size=1024, batch_seconds=1.0, window=4,
+                 timeout=10.0):
+        # streams a SampleRing to a Collector, at most window unacknowledged batches at a time
+        self.ring = ring
+        self.host = host
+        self.port = port
+        self.station = station or socket.gethostname()
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.window = window
+        self.timeout = timeout
+        self.acked = 0
+        self.sent = 0
+        self.batches = 0
+        self.reconnects = 0
+        self.last_error = None
+        self.sock = None
+
+    def run(self, stop):
+        # reconnects with backoff until stop (an Event) is set
+        backoff = 0.5
+        while not stop.is_set():
+            try:
+                with socket.create_connection((self.host, self.port), self.timeout) as self.sock:
+                    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self.session(stop)
+                    backoff = 0.5
+            except (OSError, ValueError) as e:
+                self.last_error = repr(e)
+                self.reconnects += 1
+                stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                self.sock = None
+
+    def drop(self):
+        # cut the current connection, the next one resumes from the collector's ack
+        sock = self.sock
+        try:
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # it was closing already
+            pass
+
+    def session(self, stop):
+        hello = {'station': self.station, 'session': self.ring.name, 'columns': self.ring.columns}
+        self.sock.sendall(message(HELLO, json.dumps(hello).encode()))
+        kind, payload = recv_message(self.sock)
+        if kind != WELCOME:
+            raise ValueError('collector did not welcome us')
+        self.acked = self.sent = SEQ.unpack(payload)[0]
+        in_flight = 0
+        last_send = monotonic()
+        while not stop.is_set():
+            pending = self.ring.seq - self.sent
+            due = pending >= self.batch_size or (pending and monotonic() - last_send >= self.batch_seconds)
+            if due and in_flight < self.window:
+                self.send(self.batch())
+                in_flight += 1
+                last_send = monotonic()
+                continue
+            wait = self.batch_seconds / 4 if in_flight < self.window else self.timeout
+            readable, _, _ = select.select([self.sock], [], [], wait)
+            if readable:
+                kind, payload = recv_message(self.sock)
+                if kind == ACK:
+                    self.acked = SEQ.unpack(payload)[0]
+                    in_flight -= 1
+            elif in_flight >= self.window:
+                raise TimeoutError('no ack from the collector')
+
+    def batch(self) -> np.ndarray:
+        # a copy of the next records, taken again if the writer lapped it while copying
+        while True:
+            records, _ = self.ring.since(self.sent)
+            records = records[:self.batch_size].copy()
+            seqs = records['seq']
+            if len(records) and seqs[-1] - seqs[0] == len(records) - 1 and seqs[0] > self.sent:
+                return records
+
+    def send(self, records: np.ndarray):
+        self.sock.sendall(message(BATCH, records.tobytes()))
+        self.sent = int(records['seq'][-1])
+        self.batches += 1
+
+    def stats(self) -> dict:
+        return {'station': self.station, 'sent': self.sent, 'acked': self.acked, 'batches': self.batches,
+                'reconnects': self.reconnects, 'last_error': self.last_error}
+
+
+def upload_forever(ring, host: str, port: int, station: str, stop, **kwargs):
+    # process target next to the sampling daemon
+    Uploader(ring, host, port, station, **kwargs).run(stop)
@@ -0,0 +1,110 @@
+import os
+import struct
+import numpy as np
+
+# File layout:
+#   magic (8s) | ncols (u4) | capacity (u4) | nrows (u8)
+#   ncols x [name (32s) | dtype (8s)]
+#   padding up to DATA_ALIGN, then one array of `capacity` values per column
+MAGIC = b'ENVCOL01'
+PREFIX = struct.Struct('<8sIIQ')
+COLUMN = struct.Struct('<32s8s')
+NROWS_OFFSET = 16
+DATA_ALIGN = 64
+
+
+# PM values are fractional means of the sensor's frames (see pms5003.FrameReader), float32 would turn
+# 6.8 into 6.80000019; every column is written as float64 so the binary copy reads back exactly like the
+# text one. files written with float32 PM columns keep them, the dtype is stored per column
+COLUMN_DTYPE = '<f8'
+
+
+def _layout(columns: list, dtypes: list, capacity: int):
+    header_size = PREFIX.size + COLUMN.size * len(columns)
+    offset = -(-header_size // DATA_ALIGN) * DATA_ALIGN
+    offsets = []
+    for dtype in dtypes:
+        offsets.append(offset)
+        offset += -(-np.dtype(dtype).itemsize * capacity // 8) * 8
+    return offsets, offset
+
+
+def read_header(filename: str):
+    with open(filename, 'rb') as f:
+        magic, ncols, capacity, nrows = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a columnar archive file')
+        columns, dtypes = [], []
+        for _ in range(ncols):
+            name, dtype = COLUMN.unpack(f.read(COLUMN.size))
+            columns.append(name.rstrip(b'\0').decode())
+            dtypes.append(dtype.rstrip(b'\0').decode())
+    return columns, dtypes, capacity, nrows
+
+
+def read_columns(filename: str) -> dict:
+    # zero-copy views of the rows written so far, keyed by column name
+    columns, dtypes, capacity, nrows = read_header(filename)
+    offsets, size = _layout(columns, dtypes, capacity)
+    mm = np.memmap(filename, dtype=np.uint8, mode='r', shape=(size,))
+    return {name: mm[offset:offset + np.dtype(dtype).itemsize * capacity].view(dtype)[:nrows]
+            for name, dtype, offset in zip(columns, dtypes, offsets)}
+
+
+def slice_range(columns: dict, start=None, end=None) -> dict:
+    # rows are appended in time order, so a time range is a contiguous slice
+    timestamp = columns['timestamp']
+    lo = 0 if start is None else np.searchsorted(timestamp, start, side='left')
+    hi = len(timestamp) if end is None else np.searchsorted(timestamp, end, side='right')
+    return {name: values[lo:hi] for name, values in columns.items()}
+
+
+class ColumnarWriter:
+    def __init__(self, filename: str, columns: list, dtypes=None, capacity=1024):
+        self.filename = filename
+        self.columns = list(columns)
+        self.dtypes = dtypes or [COLUMN_DTYPE] * len(self.columns)
+        self.nrows = 0
+        self._create(filename, capacity)
+
+    def _create(self, filename: str, capacity: int):
+        self.capacity = capacity
+        offsets, size = _layout(self.columns, self.dtypes, capacity)
+        with open(filename, 'wb') as f:
+            f.write(PREFIX.pack(MAGIC, len(self.columns), capacity, self.nrows))
+            for name, dtype in zip(self.columns, self.dtypes):
+                f.write(COLUMN.pack(name.encode(), dtype.encode()))
+            f.truncate(size)
+        self._mm = np.memmap(filename, dtype=np.uint8, mode='r+', shape=(size,))
+        self._nrows = self._mm[NROWS_OFFSET:NROWS_OFFSET + 8].view('<u8')
+        self._data = [self._mm[offset:offset + np.dtype(dtype).itemsize * capacity].view(dtype)
+                      for dtype, offset in zip(self.dtypes, offsets)]
+
+    def _grow(self):
+        old = [column[:self.nrows].copy() for column in self._data]
+        self.flush()
+        tmp = self.filename + '.tmp'
+        self._create(tmp, self.capacity * 2)
+        for column, values in zip(self._data, old):
+            column[:self.nrows] = values
+        self.flush()
+        os.replace(tmp, self.filename)
+
+    def append(self, values):
+        if self.nrows == self.capacity:
+            self._grow()
+        for column, value in zip(self._data, values):
+            column[self.nrows] = np.nan if value is None else value
+        # publish the row count last so readers never see a half-written row
+        self.nrows += 1
+        self._nrows[0] = self.nrows
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        if self._mm is not None:
+            self.flush()
+            self._mm = None
+            self._data = None
+            self._nrows = None
@@ -0,0 +1,223 @@
+import os
+import bz2
+import lzma
+import zlib
+import struct
+from bisect import bisect_right
+from datetime import datetime, timedelta
+import numpy as np
+import columnar
+import pipeline
+
+# File layout:
+#   magic (8s) | codec (8s) | ncols (u4) | nblocks (u4) | nrows (u8)
+#   ncols x [name (32s) | dtype (8s)]
+#   nblocks x [rows (u4) | first timestamp (f8) | last timestamp (f8)]
+#   nblocks x ncols compressed sizes (u8), then the compressed columns block by block
+MAGIC = b'ENVCHK01'
+PREFIX = struct.Struct('<8s8sIIQ')
+BLOCK = struct.Struct('<Idd')
+COMPRESS = {'zlib': lambda data, level: zlib.compress(data, level),
+            'lzma': lambda data, level: lzma.compress(data, preset=level),
+            'bz2': lambda data, level: bz2.compress(data, level)}
+DECOMPRESS = {'zlib': zlib.decompress, 'lzma': lzma.decompress, 'bz2': bz2.decompress}
+TIERS = ('day', 'month')
+
+
+def chunk_name(tier: str, start: datetime) -> str:
+    return start.strftime('%Y-%m-%d %H-%M-%S') + f'.{tier}.chunk'
+
+
+def chunk_span(filename: str) -> tuple:
+    stem, tier, _ = os.path.basename(filename).rsplit('.', 2)
+    start = datetime.strptime(stem, '%Y-%m-%d %H-%M-%S')
+    if tier == 'day':
+        return tier, start, start + timedelta(days=1)
+    return tier, start, (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _shuffle(values: np.ndarray) -> bytes:
+    # byte planes of slowly changing values compress far better than interleaved floats
+    return values.view(np.uint8).reshape(-1, values.itemsize).T.tobytes()
+
+
+def _unshuffle(raw: bytes, dtype: str, rows: int) -> np.ndarray:
+    dtype = np.dtype(dtype)
+    return np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, rows).T.copy().view(dtype).reshape(-1)
+
+
+def write_chunk(filename: str, columns: dict, codec='zlib', level=6, block_rows=32768):
+    names = list(columns)
+    dtypes = [columnar.COLUMN_DTYPE] * len(names)
+    timestamp = columns['timestamp']
+    blocks, sizes, blobs = [], [], []
+    for lo in range(0, len(timestamp), block_rows):
+        hi = min(lo + block_rows, len(timestamp))
+        blocks.append(BLOCK.pack(hi - lo, timestamp[lo], timestamp[hi - 1]))
+        for name, dtype in zip(names, dtypes):
+            blob = COMPRESS[codec](_shuffle(np.ascontiguousarray(columns[name][lo:hi], dtype=dtype)), level)
+            sizes.append(len(blob))
+            blobs.append(blob)
+    with open(filename, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, codec.encode(), len(names), len(blocks), len(timestamp)))
+        for name, dtype in zip(names, dtypes):
+            f.write(columnar.COLUMN.pack(name.encode(), dtype.encode()))
+        f.write(b''.join(blocks))
+        f.write(np.array(sizes, dtype='<u8').tobytes())
+        f.writelines(blobs)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_header(filename: str):
+    with open(filename, 'rb') as f:
+        magic, codec, ncols, nblocks, nrows = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a chunk file')
+        columns, dtypes = [], []
+        for _ in range(ncols):
+            name, dtype = columnar.COLUMN.unpack(f.read(columnar.COLUMN.size))
+            columns.append(name.rstrip(b'\0').decode())
+            dtypes.append(dtype.rstrip(b'\0').decode())
+        blocks = [BLOCK.unpack(f.read(BLOCK.size)) for _ in range(nblocks)]
+        sizes = np.frombuffer(f.read(8 * nblocks * ncols), dtype='<u8').reshape(nblocks, ncols)
+        data_start = f.tell()
+    return {'codec': codec.rstrip(b'\0').decode(), 'columns': columns, 'dtypes': dtypes, 'blocks': blocks,
+            'sizes': sizes, 'data_start': data_start, 'rows': nrows}
+
+
+def iter_chunk(filename: str, start=None, end=None):
+    # one dict of columns per block, blocks outside the range are never decompressed
+    header = read_header(filename)
+    decompress = DECOMPRESS[header['codec']]
+    offsets = header['data_start'] + np.concatenate([[0], np.cumsum(header['sizes'].reshape(-1))])
+    ncols = len(header['columns'])
+    with open(filename, 'rb') as f:
+        for i, (rows, first, last) in enumerate(header['blocks']):
+            if (start is not None and last < start) or (end is not None and first > end):
+                continue
+            f.seek(int(offsets[i * ncols]))
+            yield {name: _unshuffle(decompress(f.read(int(size))), dtype, rows)
+                   for name, dtype, size in zip(header['columns'], header['dtypes'], header['sizes'][i])}
+
+
+def read_chunk(filename: str, start=None, end=None) -> dict:
+    header = read_header(filename)
+    blocks = list(iter_chunk(filename, start, end))
+    if not blocks:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in zip(header['columns'], header['dtypes'])}
+    return {name: np.concatenate([block[name] for block in blocks]) for name in header['columns']}
+
+
+def covering(files: list, starts: dict) -> dict:
+    # file -> chunk for every file a coarser chunk already holds, the leftovers of a compaction
+    spans = {tier: [] for tier in TIERS}
+    for file in files:
+        if file.endswith('.chunk'):
+            tier, lo, hi = chunk_span(file)
+            spans[tier].append((lo, hi, file))
+    if not any(spans.values()):
+        return {}
+    for tier in TIERS:
+        spans[tier].sort()
+    lows = {tier: [span[0] for span in spans[tier]] for tier in TIERS}
+    covered = {}
+    for file in files:
+        # day chunks can only sit inside month chunks, raw files inside either, the coarsest one wins
+        tiers = () if file.endswith('.month.chunk') else ('month',) if file.endswith('.chunk') else TIERS[::-1]
+        for tier in tiers:
+            i = bisect_right(lows[tier], starts[file]) - 1
+            if i >= 0 and starts[file] < spans[tier][i][1]:
+                covered[file] = spans[tier][i][2]
+                break
+    return covered
+
+
+class Compactor:
+    def __init__(self, archive, codec='zlib', level=6, grace=3600):
+        self.archive = archive
+        self.codec = codec
+        self.level = level
+        # readers may still hold a listing with the merged files in it, keep them around a while
+        self.grace = grace
+
+    def run(self, stop=None) -> int:
+        manifest = self.archive.manifest
+        # chunks inherit the rollup state of their sources, so roll everything closed up first
+        self.archive.rollups.update()
+        self.remove_leftovers()
+        if len(manifest.stems) < 2:
+            return 0
+        newest = datetime.fromtimestamp(manifest.starts[-1])
+        today = newest.replace(hour=0, minute=0, second=0, microsecond=0)
+        written = 0
+        for tier, current in (('day', today), ('month', today.replace(day=1))):
+            groups = {}
+            for stem in manifest.stems[:-1]:
+                file = manifest.entries[stem]['file']
+                if file.endswith(f'.{tier}.chunk') or file.endswith('.month.chunk'):
+                    continue
+                start = datetime.fromtimestamp(manifest.entries[stem]['start'])
+                key = start.replace(hour=0, minute=0, second=0, microsecond=0)
+                if tier == 'month':
+                    key = key.replace(day=1)
+                if key < current:
+                    groups.setdefault(key, []).append(stem)
+            for key, stems in sorted(groups.items()):
+                if stop is not None and stop.is_set():
+                    return written
+                written += self.compact(tier, key, stems)
+            manifest.refresh()
+        return written
+
+    def compact(self, tier: str, start: datetime, stems: list) -> int:
+        manifest = self.archive.manifest
+        files = [manifest.entries[stem]['file'] for stem in stems]
+        parts = [self.archive.read_columns(file) for file in files]
+        # a day that switched Sensors.pm_extremes keeps every column, nan where a file didn't have it
+        names = pipeline.merge_headers([list(part) for part in parts])
+        columns = {name: np.concatenate([part[name] if name in part else np.full(len(part['timestamp']), np.nan)
+                                         for part in parts]) for name in names}
+        # sorted by time, rows without a timestamp and repeated timestamps dropped
+        order = np.argsort(columns['timestamp'], kind='stable')
+        timestamp = columns['timestamp'][order]
+        keep = ~np.isnan(timestamp)
+        keep[1:] &= timestamp[1:] != timestamp[:-1]
+        order = order[keep]
+        columns = {name: values[order] for name, values in columns.items()}
+        name = chunk_name(tier, start)
+        path = self.archive.data_dir + name
+        write_chunk(path + '.tmp', columns, self.codec, self.level)
+
+        def swap():
+            os.replace(path + '.tmp', path)
+            fd = os.open(self.archive.data_dir, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        if not self.archive.rollups.transfer(stems, self.archive.stem(name), swap):
+            os.remove(path + '.tmp')
+            return 0
+        return 1
+
+    def remove_leftovers(self):
+        self.archive.manifest.refresh()
+        files = [file for file in os.listdir(self.archive.data_dir)
+                 if file.endswith(('.txt', '.bin', '.chunk')) and self.archive.re_compile.search(file)]
+        now = datetime.now().timestamp()
+        for file, chunk in self.archive.shadowed(files).items():
+            if now - os.stat(self.archive.data_dir + chunk).st_mtime > self.grace:
+                os.remove(self.archive.data_dir + file)
+
+
+def run_forever(data_dir: str, stop, interval=3600, **kwargs):
+    # process target, compacts once right away and then every interval until stop is set
+    from archive import ReadArchive
+    archive = ReadArchive(data_dir)
+    compactor = Compactor(archive, **kwargs)
+    while not stop.is_set():
+        compactor.run(stop)
+        stop.wait(interval)
+    archive.close()
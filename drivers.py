@@ -0,0 +1,195 @@
+import os
+from threading import Lock
+from time import monotonic, sleep, time
+import numpy as np
+import pms5003
+from archive import ReadArchive
+# Raspberry Pi specific libraries below, only HardwareDriver needs them
+try:
+    import serial
+    import board
+    import busio
+    import adafruit_bme280, adafruit_pm25
+except ModuleNotFoundError:
+    print('Raspberry Pi libraries not found. Continuing anyway...')
+
+# every driver has read_bme280() -> [temperature, humidity, pressure] and read_pm25(extremes=False) -> the
+# 12 PM fields, averaged over the sensor's frames since the last read and followed by their 12 minima and
+# 12 maxima with extremes; both raise like the real sensors do, and close()
+
+
+class HardwareDriver:
+    def __init__(self, serial_port='/dev/ttyS0', serial_timeout=2.0, stream=True):
+        self.reset_pin = None
+        self.i2c = busio.I2C(board.SCL, board.SDA)
+        self.bme280 = adafruit_bme280.Adafruit_BME280_I2C(self.i2c)
+        self.serial_timeout = serial_timeout
+        self.uart = None
+        self.pm25 = None
+        self.frames = None
+        self.error = None
+        try:
+            # a silent sensor fails the read after serial_timeout instead of blocking its worker forever
+            self.uart = serial.Serial(serial_port, baudrate=9600, timeout=serial_timeout)
+            if stream:
+                # decode every frame the sensor sends instead of one blocking read per sample
+                self.frames = pms5003.FrameReader(self.uart)
+            else:
+                self.pm25 = adafruit_pm25.PM25_UART(self.uart, self.reset_pin)
+        except serial.SerialException:
+            self.error = 'Serial device not found.'
+
+    def read_bme280(self) -> list:
+        return [round(self.bme280.temperature, 1), round(self.bme280.humidity, 1), round(self.bme280.pressure, 1)]
+
+    def read_pm25(self, extremes=False) -> list:
+        if self.frames is not None:
+            # started on first use, the asyncio engine feeds the reader from its own loop instead
+            self.frames.start()
+            return self.frames.read(extremes)
+        if self.pm25 is None:
+            raise RuntimeError('PM2.5 sensor not connected')
+        values = list(self.pm25.read().values())
+        return values + values + values if extremes else values
+
+    def close(self):
+        if self.frames is not None:
+            self.frames.stop()
+        if self.uart is not None:
+            self.uart.close()
+
+
+class SyntheticDriver:
+    def __init__(self, seed=0, latency=0.0, pm_failure_rate=0.01, bme_failure_rate=0.0, stall_rate=0.0,
+                 stall_seconds=5.0):
+        # latency is the mean read time, failures raise what the adafruit drivers raise and
+        # stalls hang a read for stall_seconds like a wedged bus or a silent UART
+        self.latency = latency
+        self.pm_failure_rate = pm_failure_rate
+        self.bme_failure_rate = bme_failure_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        # one generator per sensor, each is only used from its own worker thread
+        self.rngs = {'bme280': np.random.default_rng(seed), 'pm25': np.random.default_rng(seed + 1)}
+        self.reads = {'bme280': 0, 'pm25': 0}
+        self._last_pm = None
+
+    def _wait(self, rng: np.random.Generator):
+        if self.stall_rate and rng.random() < self.stall_rate:
+            sleep(self.stall_seconds)
+        elif self.latency:
+            sleep(rng.exponential(self.latency))
+
+    def read_bme280(self) -> list:
+        rng = self.rngs['bme280']
+        self.reads['bme280'] += 1
+        self._wait(rng)
+        if rng.random() < self.bme_failure_rate:
+            raise OSError(121, 'Remote I/O error')
+        hours = time() / 3600
+        return [round(21 + 2 * np.sin(2 * np.pi * hours / 24) + rng.normal(0, 0.1), 1),
+                round(45 + 8 * np.sin(2 * np.pi * hours / 24 + 1) + rng.normal(0, 0.5), 1),
+                round(1013 + 5 * np.sin(2 * np.pi * hours / 240) + rng.normal(0, 0.2), 1)]
+
+    def read_pm25(self, extremes=False) -> list:
+        rng = self.rngs['pm25']
+        self.reads['pm25'] += 1
+        self._wait(rng)
+        now = monotonic()
+        # one frame a second like the real sensor streams, at least one per read
+        frames = 1 if self._last_pm is None else int(min(max(1, round(now - self._last_pm)), 600))
+        self._last_pm = now
+        if rng.random() < self.pm_failure_rate:
+            raise RuntimeError('Invalid PM2.5 checksum')
+        pm = rng.poisson(8, (frames, 6)).cumsum(axis=1)
+        # particle counts are cumulative, larger bins never exceed smaller ones
+        counts = np.sort(rng.poisson(40, (frames, 6)).cumsum(axis=1) * 10, axis=1)[:, ::-1]
+        frames = np.hstack([pm, counts]).astype(float)
+        values = np.round(frames.mean(axis=0), 1).tolist()
+        if extremes:
+            values += frames.min(axis=0).tolist() + frames.max(axis=0).tolist()
+        return values
+
+    def close(self):
+        pass
+
+
+class ReplayDriver:
+    def __init__(self, data_dir: str, speed=1.0, loop=True):
+        # plays an archive back in real time times speed, each read returns the row that was
+        # current at that point of the recording
+        self.archive = ReadArchive(os.path.join(data_dir, ''))
+        self.archive.manifest.refresh()
+        self.files = self.archive.manifest.files(0, None)
+        if not self.files:
+            raise ValueError(f'no archive files in {data_dir}')
+        self.header = self.archive.read_header(self.files[0])
+        self.timestamp = self.header.index('timestamp')
+        self.fields = {'bme280': [self.header.index(name) for name in ('temperature', 'humidity', 'pressure')],
+                       'pm25': list(range(self.header.index('pressure') + 1, len(self.header)))}
+        self.speed = speed
+        self.loop = loop
+        self._lock = Lock()
+        self._rewind()
+
+    def _rewind(self):
+        self._blocks = self.archive.stream(self.files)
+        self._block = next(self._blocks)
+        self._next = None
+        self._row = 0
+        self._origin = self._block[0, self.timestamp]
+        self._started = monotonic()
+
+    def _current(self) -> np.ndarray:
+        # moves the cursor up to the replay clock, rows are only ever read forward
+        target = self._origin + (monotonic() - self._started) * self.speed
+        while True:
+            timestamps = self._block[:, self.timestamp]
+            self._row += max(0, int(np.searchsorted(timestamps[self._row:], target, side='right')) - 1)
+            if self._row < len(timestamps) - 1:
+                return self._block[self._row]
+            if self._next is None:
+                self._next = next(self._blocks, None)
+            if self._next is None:
+                if not self.loop:
+                    return self._block[self._row]
+                self._rewind()
+                continue
+            if self._next[0, self.timestamp] > target:
+                return self._block[self._row]
+            self._block, self._next, self._row = self._next, None, 0
+
+    def read(self, sensor: str) -> list:
+        with self._lock:
+            row = self._current()
+        values = row[self.fields[sensor]]
+        return [None if value != value else float(value) for value in values]
+
+    def read_bme280(self) -> list:
+        return self.read('bme280')
+
+    def read_pm25(self, extremes=False) -> list:
+        values = self.read('pm25')
+        means = values[:12]
+        # the recording kept a failed PM read as an all-None row, replay it as the failure it was
+        if all(value is None for value in means):
+            raise RuntimeError('Invalid PM2.5 frame (replayed)')
+        if not extremes:
+            return means
+        # recordings made without extremes replay each mean as its own min and max
+        return values if len(values) == 36 else means + means + means
+
+    def close(self):
+        self._blocks = None
+
+
+def from_spec(spec: str, **options):
+    # 'hardware', 'synthetic' or 'replay:<archive dir>', e.g. from ENVIRONMENT_DRIVER
+    name, _, argument = spec.partition(':')
+    if name == 'hardware':
+        return HardwareDriver(**options)
+    if name == 'synthetic':
+        return SyntheticDriver(**options)
+    if name == 'replay':
+        return ReplayDriver(argument or './data/', **options)
+    raise ValueError(f'unknown driver {spec!r}')
@@ -2,14 +2,18 @@ import tkinter as tk
 from tkinter import ttk
 from tkcalendar import DateEntry
 from archive import ReadArchive
+import pipeline
+from profiling import Profiler
 from sensors import Sensors
+import drivers
 import sys, os
-from multiprocessing import Process, Queue
-from threading import Thread
+from threading import Event, Thread
 from datetime import datetime
+from time import perf_counter
 from dateutil.relativedelta import relativedelta
-from time import sleep
+import numpy as np
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.ticker import FixedLocator
 from matplotlib.transforms import Bbox
@@ -17,14 +21,30 @@ from matplotlib.transforms import Bbox
 class Monitor(tk.Tk):
     def __init__(self):
         super().__init__()
-        self.archive = ReadArchive()
+        # per-stage timings of every refresh, ENVIRONMENT_PROFILE=1 also keeps a cProfile dump of each
+        self.profiler = Profiler(log_file='./logs/refresh.log', capture=os.environ.get('ENVIRONMENT_PROFILE') == '1')
+        self.archive = ReadArchive(profiler=self.profiler)
         self.sensor_active = False
-        self.realtime_active = Queue()
-        if 'board' in sys.modules:
+        # real-time mode redraws at most ENVIRONMENT_REALTIME_FPS times a second (and only when there are new
+        # samples), showing the last ENVIRONMENT_REALTIME_WINDOW samples, an hour's worth by default
+        self.realtime_fps = float(os.environ.get('ENVIRONMENT_REALTIME_FPS', 1))
+        self.realtime_window = int(os.environ.get('ENVIRONMENT_REALTIME_WINDOW', 0))
+        self.realtime_job = None
+        # bumped whenever the plots switch to another view, a refresh finishing after that is dropped
+        # instead of drawing over the newer view (see draw_plots)
+        self.view = 0
+        # ENVIRONMENT_DRIVER=synthetic or replay:<archive dir> runs the live paths without the sensors
+        driver = os.environ.get('ENVIRONMENT_DRIVER')
+        if 'board' in sys.modules or driver:
             self.sensor_active = True
-            self.sensor_daemon = Sensors()
+            speed = float(os.environ.get('ENVIRONMENT_REPLAY_SPEED', 1))
+            options = {'speed': speed} if driver and driver.startswith('replay') else {}
+            # ENVIRONMENT_ENGINE=asyncio samples on one event loop instead of threads
+            self.sensor_daemon = Sensors(driver=drivers.from_spec(driver, **options) if driver else None,
+                                         engine=os.environ.get('ENVIRONMENT_ENGINE', 'threads'),
+                                         metrics_port=int(os.environ.get('ENVIRONMENT_METRICS_PORT', 9105)) or None)
             self.sensor_daemon.start_daemon()
-            self.sensor_daemon.start_latest_readings_thread()
+            self.realtime_window = self.realtime_window or self.sensor_daemon.reset_threshold
         self.title('Environment Monitor')
         self.geometry('1280x1024')
         self.rowconfigure(0, weight=1)
@@ -44,12 +64,11 @@ class Monitor(tk.Tk):
         self.protocol('WM_DELETE_WINDOW', self.close_app)
     
     def close_app(self):
+        self.archive.close()
+        self.stop_realtime()
         if self.sensor_active:
             self.sensor_daemon.stop_daemon()
-            # try:
-            #     self.stop_realtime_process()
-            # except:
-            #     pass
+            self.sensor_daemon.close()
         # self.destroy()
         sys.exit()
 
@@ -138,37 +157,43 @@ class Monitor(tk.Tk):
                 self._set_default_readout_values()
         self.after(1000, self.update_live_readout)
 
-    def refresh_plots_thread(self, time_range):
-        self.progress_bar.start()
-        self.status_bar.config(text='Refreshing plots...')
-        self.refresh_plots(time_range)
-        self.status_bar.config(text='*Status Window*')
-        self.progress_bar.stop()
+    def refresh_plots_thread(self, time_range, view=None):
+        self.after(0, self.show_progress, 'Refreshing plots...', True)
+        with self.profiler.refresh(time_range):
+            self.refresh_plots(time_range, view)
+        self.after(0, self.show_progress, self.profiler.summary(), False)
     
-    def refresh_daterange_plots_thread(self, daterange_files):
-        self.progress_bar.start()
-        self.status_bar.config(text='Refreshing plots...')
-        self.refresh_daterange_plots(daterange_files)
-        self.status_bar.config(text='*Status Window*')
-        self.progress_bar.stop()
+    def refresh_daterange_plots_thread(self, daterange_files, start=None, end=None, view=None):
+        self.after(0, self.show_progress, 'Refreshing plots...', True)
+        with self.profiler.refresh('date range'):
+            self.refresh_daterange_plots(daterange_files, start, end, view)
+        self.after(0, self.show_progress, self.profiler.summary(), False)
+
+    def show_progress(self, text: str, busy: bool):
+        # Tk main loop only, the refresh threads get here through after() like their drawing
+        self.status_bar.config(text=text)
+        if busy:
+            self.progress_bar.start()
+        else:
+            self.progress_bar.stop()
 
     
     def create_toolbar(self):
         self.toolbar = tk.Frame(self.root_frame, bg='white')
         self.status_bar = ttk.Label(self.toolbar, text='*Status Window*',
-            relief='sunken', width=40)
+            relief='sunken', width=40, anchor='w')
         self.progress_bar = ttk.Progressbar(self.toolbar, orient='horizontal', mode='indeterminate', length=200)
-        btn_realtime = ttk.Button(self.toolbar, text='Real-time', command=self.start_realtime_process, state='disabled') # Re-enable once realtime is implemented
+        btn_realtime = ttk.Button(self.toolbar, text='Real-time', command=self.start_realtime,
+                                  state='enabled' if self.sensor_active else 'disabled')
         btn_daterange = ttk.Button(self.toolbar, text='Date Range', command=self.get_daterange, state='enabled')
-        btn_1hr = ttk.Button(self.toolbar, text='1 Hour', command=lambda: Thread(target=self.refresh_plots_thread, args=('1h',)).start())
-        btn_8hr = ttk.Button(self.toolbar, text='8 Hours', command=lambda: Thread(target=self.refresh_plots_thread, args=('8h',)).start())
-        btn_24hr = ttk.Button(self.toolbar, text='24 Hours', command=lambda: Thread(target=self.refresh_plots_thread, args=('24h',)).start())
-        btn_7days = ttk.Button(self.toolbar, text='7 Days', command=lambda: Thread(target=self.refresh_plots_thread, args=('7d',)).start())
-        btn_1month = ttk.Button(self.toolbar, text='1 Month', command=lambda: Thread(target=self.refresh_plots_thread, args=('1m',)).start())
-        btn_6month = ttk.Button(self.toolbar, text='6 Month', command=lambda: Thread(target=self.refresh_plots_thread, args=('6m',)).start())
-        btn_1year = ttk.Button(self.toolbar, text='1 Year', command=lambda: Thread(target=self.refresh_plots_thread, args=('1y',)).start())
+        btn_1hr = ttk.Button(self.toolbar, text='1 Hour', command=lambda: self.show_timespan('1h'))
+        btn_8hr = ttk.Button(self.toolbar, text='8 Hours', command=lambda: self.show_timespan('8h'))
+        btn_24hr = ttk.Button(self.toolbar, text='24 Hours', command=lambda: self.show_timespan('24h'))
+        btn_7days = ttk.Button(self.toolbar, text='7 Days', command=lambda: self.show_timespan('7d'))
+        btn_1month = ttk.Button(self.toolbar, text='1 Month', command=lambda: self.show_timespan('1m'))
+        btn_6month = ttk.Button(self.toolbar, text='6 Month', command=lambda: self.show_timespan('6m'))
+        btn_1year = ttk.Button(self.toolbar, text='1 Year', command=lambda: self.show_timespan('1y'))
         btn_exit = ttk.Button(self.toolbar, text='Exit', command=self.close_app)
-        # self.status_bar.grid(row=0, column=0, sticky='ew')
         self.progress_bar.grid(row=0, column=0, sticky='ew')
         btn_realtime.grid(row=0, column=1, padx=(10,5), sticky='w')
         btn_daterange.grid(row=0, column=2, padx=5, sticky='w')
@@ -180,9 +205,20 @@ class Monitor(tk.Tk):
         btn_6month.grid(row=0, column=8, padx=5, sticky='w')
         btn_1year.grid(row=0, column=9, padx=5, sticky='w')
         btn_exit.grid(row=0, column=10, padx=5, sticky='e')
+        self.status_bar.grid(row=1, column=0, columnspan=11, sticky='ew', pady=(2, 0))
         self.toolbar.grid(row=3, column=0, sticky='ew')
+
+    def show_timespan(self, timespan: str):
+        # archive plots replace the real-time view
+        self.stop_realtime()
+        Thread(target=self.refresh_plots_thread, args=(timespan, self.next_view()), daemon=True).start()
+
+    def next_view(self) -> int:
+        self.view += 1
+        return self.view
     
     def get_daterange(self):
+        self.stop_realtime()
         current_date = datetime.now()
         back_date = current_date - relativedelta(months=1)
         top = tk.Toplevel(self)
@@ -197,244 +233,256 @@ class Monitor(tk.Tk):
                                  foreground='white', borderwidth=2,
                                  year=current_date.year, month=current_date.month,
                                  day=current_date.day)
-        btn_ok = ttk.Button(top, text='OK', command=lambda: Thread(target=on_closing).start())
+        btn_ok = ttk.Button(top, text='OK', command=lambda: on_ok())
         lbl_start_date.grid(row=0, column=0, padx=5, pady=5)
         lbl_end_date.grid(row=0, column=2, padx=5, pady=5)
         cal_start_date.grid(row=0, column=1, padx=5, pady=5)
         cal_end_date.grid(row=0, column=3, padx=5, pady=5)
         btn_ok.grid(row=1, columnspan=4, padx=5, pady=5)
-        def on_closing():
-            self.progress_bar.start()
-            sd = cal_start_date.get_date().strftime('%Y-%m-%d %H-%M-%S')
-            ed = cal_end_date.get_date().strftime('%Y-%m-%d %H-%M-%S')
-            dr_files = self.archive.date_range(sd, ed)
-            self.refresh_daterange_plots(dr_files)
-            self.progress_bar.stop()
-            top.destroy()
-    
-    def clear_plots(self):
-        self.thp_figure.th.cla()
-        self.thp_figure.th2.cla()
-        self.thp_figure.p.cla()
-        self.pms_figure.pms_concentration.cla()
-        self.pms_figure.pms_counts.cla()
+        def on_ok():
+            # the dates are read here on the main loop, the thread only touches Tk through after()
+            sd = cal_start_date.get_date().strftime('%Y-%m-%d 00-00-00')
+            # the end date is inclusive
+            ed = cal_end_date.get_date().strftime('%Y-%m-%d 23-59-59')
+            self.show_progress('Refreshing plots...', True)
+            Thread(target=on_closing, args=(sd, ed, self.next_view()), daemon=True).start()
+
+        def on_closing(sd, ed, view):
+            with self.profiler.refresh('date range'):
+                dr_files = self.archive.date_range(sd, ed)
+                self.refresh_daterange_plots(dr_files, datetime.strptime(sd, self.archive.fn_format).timestamp(),
+                                             datetime.strptime(ed, self.archive.fn_format).timestamp(), view)
+            self.after(0, self.show_progress, self.profiler.summary(), False)
+            self.after(0, top.destroy)
     
-    def refresh_plots(self, timespan: str):
-        resample_dict = {'1h': '5T', '8h': '20T', '24h': 'H',
-                         '7d': 'H', '1m': 'D', '6m': 'D',
-                         '1y': 'W'}
-        data_files = os.listdir(self.archive.data_dir)
-        fn_delta = self.archive.cap_archive_list(data_files, limit=timespan)
-        self.plot_data = self.archive.create_df(fn_delta)
-        # Clear plots
-        self.clear_plots()
-        # Plot temperature, humidity, pressure
-        temp_min = 18
-        temp_max = 24
-        self.thp_figure.th.plot(self.plot_data.index, self.plot_data['temperature'], color='C0', label='temperature')
-        self.thp_figure.th.axhline(y=temp_min, color='C0', linestyle='--', label='lower temp limit')
-        self.thp_figure.th.axhline(y=temp_max, color='C0', linestyle='--', label='upper temp limit')
-        self.thp_figure.th.fill_between(self.plot_data.index, temp_min, temp_max, color='C0', alpha=0.2)
-        self.thp_figure.th2.plot(self.plot_data.index, self.plot_data['humidity'], color='C1', label='humidity')
-        self.thp_figure.th2.axhline(y=40, color='C1', linestyle='--', label='lower humidity limit')
-        self.thp_figure.th2.axhline(y=70, color='C1', linestyle='--', label='upper humidity limit')
-        self.thp_figure.th2.fill_between(self.plot_data.index, 40, 70, color='C1', alpha=0.2)
-        self.thp_figure.p.plot(self.plot_data.index, self.plot_data['pressure'], color='C2', label='pressure')
-        # Plot particle data
-        self.plot_data_rs = self.plot_data.resample(resample_dict[timespan]).mean()
-        self.pms_figure.pms_concentration.plot(self.plot_data_rs.index, self.plot_data_rs['pm10_standard'], label='1.0 $\mu$m')
-        self.pms_figure.pms_concentration.plot(self.plot_data_rs.index, self.plot_data_rs['pm25_standard'], label='2.5 $\mu$m')
-        self.pms_figure.pms_concentration.plot(self.plot_data_rs.index, self.plot_data_rs['pm100_standard'], label='10.0 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data_rs.index, self.plot_data_rs['particles_03um'], label='0.3 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data_rs.index, self.plot_data_rs['particles_05um'], label='0.5 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data_rs.index, self.plot_data_rs['particles_10um'], label='1.0 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data_rs.index, self.plot_data_rs['particles_25um'], label='2.5 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data_rs.index, self.plot_data_rs['particles_50um'], label='5.0 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data_rs.index, self.plot_data_rs['particles_100um'], label='10.0 $\mu$m')
-        self.reset_figures()
+    def refresh_plots(self, timespan: str, view=None):
+        self.plot_data, self.plot_data_rs = self.archive.plot_data(timespan)
+        self.draw_plots(self.plot_data, self.plot_data_rs, view)
 
-    def refresh_daterange_plots(self, daterange_files: list):
-        self.plot_data = self.archive.create_df(daterange_files)
-        # Clear plots
-        self.clear_plots()
-        # Plot temperature, humidity, pressure
-        temp_min = 18
-        temp_max = 24
-        self.thp_figure.th.plot(self.plot_data.index, self.plot_data['temperature'], color='C0', label='temperature')
-        self.thp_figure.th.axhline(y=temp_min, color='C0', linestyle='--', label='lower temp limit')
-        self.thp_figure.th.axhline(y=temp_max, color='C0', linestyle='--', label='upper temp limit')
-        self.thp_figure.th.fill_between(self.plot_data.index, temp_min, temp_max, color='C0', alpha=0.2)
-        self.thp_figure.th2.plot(self.plot_data.index, self.plot_data['humidity'], color='C1', label='humidity')
-        self.thp_figure.th2.axhline(y=40, color='C1', linestyle='--', label='lower humidity limit')
-        self.thp_figure.th2.axhline(y=70, color='C1', linestyle='--', label='upper humidity limit')
-        self.thp_figure.th2.fill_between(self.plot_data.index, 40, 70, color='C1', alpha=0.2)
-        self.thp_figure.p.plot(self.plot_data.index, self.plot_data['pressure'], color='C2', label='pressure')
-        # Plot particle data
-        # self.plot_data_rs = self.plot_data.resample(resample_dict[daterange_files]).mean()
-        self.pms_figure.pms_concentration.plot(self.plot_data.index, self.plot_data['pm10_standard'], label='1.0 $\mu$m')
-        self.pms_figure.pms_concentration.plot(self.plot_data.index, self.plot_data['pm25_standard'], label='2.5 $\mu$m')
-        self.pms_figure.pms_concentration.plot(self.plot_data.index, self.plot_data['pm100_standard'], label='10.0 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data.index, self.plot_data['particles_03um'], label='0.3 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data.index, self.plot_data['particles_05um'], label='0.5 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data.index, self.plot_data['particles_10um'], label='1.0 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data.index, self.plot_data['particles_25um'], label='2.5 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data.index, self.plot_data['particles_50um'], label='5.0 $\mu$m')
-        self.pms_figure.pms_counts.plot(self.plot_data.index, self.plot_data['particles_100um'], label='10.0 $\mu$m')
-        self.reset_figures()
+    def refresh_daterange_plots(self, daterange_files: list, start=None, end=None, view=None):
+        self.plot_data = self.archive.create_df(daterange_files, start, end)
+        self.draw_plots(self.plot_data, self.plot_data, view)
 
-    def reset_figures(self):
-        # Reset figures
-        self.thp_figure.reset_thp()
-        self.pms_figure.reset_pms()
-        # align temperature and humidity y ticks
-        t_lim = self.thp_figure.th.get_ylim()
-        h_lim = self.thp_figure.th2.get_ylim()
-        lim_func = lambda x: h_lim[0] + (x - t_lim[0]) / (t_lim[1] - t_lim[0]) * (h_lim[1] - h_lim[0])
-        ticks = lim_func(self.thp_figure.th.get_yticks())
-        self.thp_figure.th2.yaxis.set_major_locator(FixedLocator(ticks))
-        # re-draw plots
-        self.thp_figure.thp_plot.draw()
-        self.pms_figure.pms_plot.draw()
-    
-    def realtime(self):
-        buffer = []
-        if self.sensor_active:
-            rta = True
-            while rta:
-                num_buffer = self.sensor_daemon.sampling_buffer.qsize()
-                for i in range(num_buffer):
-                    buffer.append(ReadArchive.txt2num(self.sensor_daemon.sampling_buffer.get()))
-                self.clear_plots()
-                dt = [datetime.fromtimestamp(i[0]) for i in buffer]
-                self.thp_figure.th.plot(dt, [j[1] for j in buffer], color='C0', label='temperature')
-                self.thp_figure.th2.plot(dt, [j[2] for j in buffer], color='C1', label='humidity')
-                self.thp_figure.p.plot(dt, [j[3] for j in buffer], color='C2', label='pressure')
-                self.pms_figure.pms_concentration.plot(dt, [j[4] for j in buffer], label='1.0 $\mu$m')
-                self.pms_figure.pms_concentration.plot(dt, [j[5] for j in buffer], label='2.5 $\mu$m')
-                self.pms_figure.pms_concentration.plot(dt, [j[6] for j in buffer], label='10.0 $\mu$m')
-                self.pms_figure.pms_counts.plot(dt, [j[7] for j in buffer], label='0.3 $\mu$m')
-                self.pms_figure.pms_counts.plot(dt, [j[8] for j in buffer], label='0.5 $\mu$m')
-                self.pms_figure.pms_counts.plot(dt, [j[9] for j in buffer], label='1.0 $\mu$m')
-                self.pms_figure.pms_counts.plot(dt, [j[10] for j in buffer], label='2.5 $\mu$m')
-                self.pms_figure.pms_counts.plot(dt, [j[11] for j in buffer], label='5.0 $\mu$m')
-                self.pms_figure.pms_counts.plot(dt, [j[12] for j in buffer], label='10.0 $\mu$m')
+    def draw_plots(self, thp_data, pms_data, view=None):
+        # called from the refresh threads: the figures are only drawn on the Tk main loop, like the real-time
+        # updates, and not at all once another view took over; the thread waits so its profile has the drawing
+        dates = mdates.date2num(thp_data.index)
+        pms_dates = dates if pms_data is thp_data else mdates.date2num(pms_data.index)
+        report = []
+        done = Event()
+
+        def draw():
+            try:
+                if view is not None and view != self.view:
+                    return
+                started = perf_counter()
+                self.thp_figure.set_series(dates, thp_data)
+                self.pms_figure.set_series(pms_dates, pms_data)
+                report.append({'stage': 'plot', 'seconds': perf_counter() - started, 'rows': len(thp_data)})
+                started = perf_counter()
                 self.reset_figures()
-                sleep(self.sensor_daemon.sampling_interval)
-                if self.realtime_active.qsize() > 0:
-                    self.realtime_active.get()
-                    rta = False
-        else:
-            pass
-    
-    def start_realtime_process(self):
-        if self.sensor_active:
-            self.realtime_process = Process(target=self.realtime)
-            self.realtime_process.start()
-    
-    def stop_realtime_process(self):
-        self.realtime_process.terminate()
+                report.append({'stage': 'draw', 'seconds': perf_counter() - started, 'rows': None})
+            finally:
+                done.set()
+
+        self.after(0, draw)
+        done.wait()
+        self.profiler.add(report)
+
+    def reset_figures(self):
+        with self.profiler.stage('draw'):
+            self.thp_figure.redraw()
+            self.pms_figure.redraw()
+
+    def start_realtime(self):
+        # runs on the Tk main loop via after(), the rolling window is made once and the figures' lines
+        # are only updated in place, so memory and CPU stay flat however long it runs
+        if not self.sensor_active or self.realtime_job is not None:
+            return
+        # a refresh still loading in the background must not draw over it
+        self.next_view()
+        columns = self.sensor_daemon.columns
+        # matplotlib date numbers instead of the timestamp column, converted once per sample as it comes in
+        self.realtime_data = np.full((self.realtime_window, len(columns)), np.nan)
+        self.realtime_seq = max(0, self.sensor_daemon.ring.seq - self.realtime_window)
+        # the x axis moves on in steps of a tenth of the window, in between only the lines are redrawn
+        self.realtime_span = self.realtime_window * self.sensor_daemon.sampling_delay / 86400
+        self.status_bar.config(text='Real-time')
+        self.update_realtime()
 
-class thpFigure(tk.Frame):
+    def stop_realtime(self):
+        if self.realtime_job is not None:
+            self.after_cancel(self.realtime_job)
+            self.realtime_job = None
+
+    def append_realtime(self) -> int:
+        # new ring records into the rolling window, oldest ones shifted out; the number appended
+        records, self.realtime_seq = self.sensor_daemon.ring.since(self.realtime_seq)
+        new = records[-self.realtime_window:].copy()
+        if not len(new):
+            return 0
+        values = np.column_stack([new[name] for name in self.sensor_daemon.columns])
+        values[:, 0] = mdates.date2num([datetime.fromtimestamp(ts) for ts in values[:, 0]])
+        # per-bin particle counts like the archive views (ReadArchive.build_df), row by row as they come in
+        values = next(pipeline.difference_bins([values], self.sensor_daemon.columns))
+        n = len(values)
+        self.realtime_data[:-n] = self.realtime_data[n:]
+        self.realtime_data[-n:] = values
+        return n
+
+    def update_realtime(self):
+        if self.append_realtime():
+            dates = self.realtime_data[:, 0]
+            step = self.realtime_span / 10
+            right = (np.nanmax(dates) // step + 1) * step
+            series = {name: self.realtime_data[:, i] for i, name in enumerate(self.sensor_daemon.columns)}
+            self.thp_figure.set_series(dates, series, (right - self.realtime_span, right))
+            self.pms_figure.set_series(dates, series, (right - self.realtime_span, right))
+            self.reset_figures()
+        self.realtime_job = self.after(int(1000 / self.realtime_fps), self.update_realtime)
+
+class LiveFigure(tk.Frame):
     def __init__(self, parent, dpi=94):
         super().__init__(parent)
         # self.screen_dpi = 86
         self.screen_dpi = dpi
         self.config(bg='white')
+        # data lines by column name, made once in create_figure and from then on only given new data
+        self.lines = {}
+        self.background = None
+        self.limits = None
         self.create_figure()
-        self.thp_plot.get_tk_widget().grid(row=0, column=0, sticky='nsew')
+        # any full draw, a resize included, caches everything but the lines as the background
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.canvas.draw()
+
+    def add_line(self, ax, name: str, **style):
+        # animated lines are left out of full draws, they are drawn over the cached background instead
+        self.lines[name] = ax.plot([], [], animated=True, **style)[0]
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.limits = self.axis_limits()
+        self.draw_lines()
+
+    def draw_lines(self):
+        for line in self.lines.values():
+            line.axes.draw_artist(line)
+
+    def axis_limits(self) -> list:
+        return [(ax.get_xlim(), ax.get_ylim()) for ax in self.fig.axes]
+
+    def set_series(self, dates, data, xlim=None):
+        # dates as matplotlib date numbers, data anything indexed by column name; xlim fixes the x axis
+        for name, line in self.lines.items():
+            if name in data:
+                line.set_data(dates, np.asarray(data[name], dtype=float))
+        for ax in self.fig.axes:
+            ax.relim()
+            ax.autoscale_view(scalex=xlim is None)
+            if xlim is not None:
+                ax.set_xlim(xlim)
+        self.align_ticks()
+
+    def align_ticks(self):
+        pass
+
+    def redraw(self):
+        # a full draw only when an axis moved, otherwise the lines are blitted over the background
+        if self.background is None or self.axis_limits() != self.limits:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_lines()
+            self.canvas.blit(self.fig.bbox)
+
+class thpFigure(LiveFigure):
+    def __init__(self, parent, dpi=94):
+        super().__init__(parent, dpi)
+        self.canvas.get_tk_widget().grid(row=0, column=0, sticky='nsew')
     
     def create_figure(self):
         self.fig, (self.th, self.p) = plt.subplots(nrows=2, ncols=1, sharex=True,
             figsize=(1280 / self.screen_dpi, 420 / self.screen_dpi),
             dpi=self.screen_dpi)
         # self.fig.autofmt_xdate()
-        self.thp_plot = FigureCanvasTkAgg(self.fig, master=self)
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
         self.th2 = self.th.twinx()
         # Configure subplots
         self.th.set_title('Temperature | Humidity')
         self.th.set_ylabel('Temperature [$^\circ$C]', color='C0')
         self.p.set_xlabel('Date', loc='left')
+        self.p.xaxis_date()
+        # rotate x tick labels by 30 degrees
+        self.p.tick_params(axis='x', labelrotation=30)
         self.th2.set_ylabel('Humidity [%RH]', color='C1')
         self.th2.yaxis.set_label_position('right')
+        self.th2.yaxis.tick_right()
         self.th.grid()
         self.p.set_title('Pressure')
         self.p.set_ylabel('Pressure [mBar]', color='C2')
         self.p.grid()
+        # limit bands
+        temp_min = 18
+        temp_max = 24
+        self.th.axhline(y=temp_min, color='C0', linestyle='--', label='lower temp limit')
+        self.th.axhline(y=temp_max, color='C0', linestyle='--', label='upper temp limit')
+        self.th.axhspan(temp_min, temp_max, color='C0', alpha=0.2)
+        self.th2.axhline(y=40, color='C1', linestyle='--', label='lower humidity limit')
+        self.th2.axhline(y=70, color='C1', linestyle='--', label='upper humidity limit')
+        self.th2.axhspan(40, 70, color='C1', alpha=0.2)
+        self.add_line(self.th, 'temperature', color='C0', label='temperature')
+        self.add_line(self.th2, 'humidity', color='C1', label='humidity')
+        self.add_line(self.p, 'pressure', color='C2', label='pressure')
+        self.align_ticks()
+
+    def align_ticks(self):
+        # align temperature and humidity y ticks
         t_lim = self.th.get_ylim()
         h_lim = self.th2.get_ylim()
         lim_func = lambda x: h_lim[0] + (x - t_lim[0]) / (t_lim[1] - t_lim[0]) * (h_lim[1] - h_lim[0])
         ticks = lim_func(self.th.get_yticks())
         self.th2.yaxis.set_major_locator(FixedLocator(ticks))
-        self.thp_plot.draw()
     
-    def reset_thp(self):
-        self.th.set_title('Temperature | Humidity')
-        self.th.set_ylabel('Temperature [$^\circ$C]', color='C0')
-        self.p.set_xlabel('Date', loc='left')
-        # rotate x tick labels by 45 degrees
-        for tick in self.p.get_xticklabels():
-            tick.set_rotation(30)
-        self.th2.set_ylabel('Humidity [%RH]', color='C1')
-        self.th2.yaxis.set_label_position('right')
-        self.th2.yaxis.tick_right()
-        self.th.grid()
-        self.p.set_title('Pressure')
-        self.p.set_ylabel('Pressure [mBar]', color='C2')
-        self.p.grid()
-    
-class pmsFigure(tk.Frame):
+class pmsFigure(LiveFigure):
     def __init__(self, parent, dpi=94):
-        super().__init__(parent)
         self.particle_sizes = ['0.3', '0.5', '1.0', '2.5', '5.0', '10.0']
-        # self.screen_dpi = 86
-        self.screen_dpi = dpi
-        self.config(bg='white')
-        self.create_figure()
-        self.pms_plot.get_tk_widget().grid(row=0, column=0, sticky='nsew')
-        self.pms_plot.get_tk_widget().rowconfigure(0, weight=1)
-        self.pms_plot.get_tk_widget().columnconfigure(0, weight=1)
+        super().__init__(parent, dpi)
+        self.canvas.get_tk_widget().grid(row=0, column=0, sticky='nsew')
+        self.canvas.get_tk_widget().rowconfigure(0, weight=1)
+        self.canvas.get_tk_widget().columnconfigure(0, weight=1)
     
     def create_figure(self):
         self.fig, (self.pms_concentration, self.pms_counts) = plt.subplots(nrows=2, ncols=1,
             figsize=(1280 / self.screen_dpi, 420 / self.screen_dpi),
             dpi=self.screen_dpi)
         self.fig.subplots_adjust(hspace=0.5)
-        self.pms_plot = FigureCanvasTkAgg(self.fig, master=self)
-        # self.pms_concentration.bar(concentration.keys(), concentration.values())
-        # self.pms_counts.bar(counts.keys(), counts.values())
-        self.pms_concentration.plot([1,2,3,4], [2,3,4,5])
-        self.pms_counts.scatter([1,2,3,4], [2,3,4,5])
-        self.pms_concentration.set_title('Particle Concentration')
-        self.pms_concentration.set_ylabel('$\mu$g/m$^3$')
-        self.pms_concentration.set_xlabel('Particle Size [$\mu$m]')
-        self.pms_counts.set_title('Particle Counts')
-        self.pms_counts.set_yscale('log')
-        self.pms_counts.set_ylabel('Quantity per dL Air')
-        self.pms_counts.set_xlabel('Particle Size [$\mu$m]')
-        self.fig.subplots_adjust(bottom=0.1, top=0.95)
-        self.pms_plot.draw()
-    
-    def reset_pms(self):
-        # Reset concentration figure
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
         self.pms_concentration.set_title('Particle Concentration')
-        self.pms_counts.set_title('Particle Counts')
         self.pms_concentration.set_ylabel('$\mu$g/m$^3$')
         self.pms_concentration.set_xlabel('Date', loc='left')
         self.pms_concentration.grid()
-        self.pms_concentration.legend()
-        # Reset counts figure
         self.pms_counts.set_title('Particle Counts')
         self.pms_counts.set_yscale('log')
         self.pms_counts.set_ylabel('Quantity per dL Air')
         self.pms_counts.set_xlabel('Date', loc='left')
         self.pms_counts.grid()
-        # self.pms_counts.legend()
-        # pos = self.pms_counts.get_position()
+        # rotate x tick labels by 30 degrees
+        for ax in (self.pms_concentration, self.pms_counts):
+            ax.xaxis_date()
+            ax.tick_params(axis='x', labelrotation=30)
+        self.add_line(self.pms_concentration, 'pm10_standard', label='1.0 $\mu$m')
+        self.add_line(self.pms_concentration, 'pm25_standard', label='2.5 $\mu$m')
+        self.add_line(self.pms_concentration, 'pm100_standard', label='10.0 $\mu$m')
+        self.add_line(self.pms_counts, 'particles_03um', label='0.3 $\mu$m')
+        self.add_line(self.pms_counts, 'particles_05um', label='0.5 $\mu$m')
+        self.add_line(self.pms_counts, 'particles_10um', label='1.0 $\mu$m')
+        self.add_line(self.pms_counts, 'particles_25um', label='2.5 $\mu$m')
+        self.add_line(self.pms_counts, 'particles_50um', label='5.0 $\mu$m')
+        self.add_line(self.pms_counts, 'particles_100um', label='10.0 $\mu$m')
+        # a fixed corner, 'best' would search the data on every full draw
+        self.pms_concentration.legend(loc='upper left')
+        self.fig.subplots_adjust(bottom=0.1, top=0.95)
         pos = Bbox([[0.125, 0.1], [0.9, 0.44]])
         self.pms_counts.set_position([pos.x0, pos.y0, pos.width * 0.95, pos.height])
         self.pms_counts.legend(loc='center right', bbox_to_anchor=(1.125, 0.5))
-        # rotate x tick labels by 30 degrees
-        for tick in self.pms_concentration.get_xticklabels():
-            tick.set_rotation(30)
-        for tick in self.pms_counts.get_xticklabels():
-            tick.set_rotation(30)
\ No newline at end of file
@@ -0,0 +1,144 @@
+import os
+import json
+import tempfile
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+import columnar
+import compaction
+
+FIELDS = ('file', 'start', 'first', 'last', 'rows', 'size', 'mtime')
+
+
+class ArchiveManifest:
+    def __init__(self, archive, filename='.manifest.json'):
+        self.archive = archive
+        self.path = archive.data_dir + filename
+        self.entries = {}
+        self.dir_mtime = None
+        self.stems = []
+        self.starts = []
+        self.lasts = []
+        self.by_file = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.dir_mtime = saved.get('dir_mtime')
+        self.entries = {stem: dict(zip(FIELDS, values)) for stem, values in saved.get('entries', {}).items()}
+        self._sort()
+
+    def save(self):
+        # the GUI, the compactor, rollup threads and the daemon all save, each through a temp file of its
+        # own; the manifest is only a cache, so a save that fails leaves the previous one in place
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.', suffix='.tmp',
+                                   dir=os.path.dirname(self.path) or '.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'dir_mtime': self.dir_mtime,
+                           'entries': {stem: [entry[field] for field in FIELDS]
+                                       for stem, entry in self.entries.items()}}, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def refresh(self):
+        dir_mtime = os.stat(self.archive.data_dir).st_mtime_ns
+        changed = False
+        if dir_mtime != self.dir_mtime:
+            files = self.archive.archive_files(os.listdir(self.archive.data_dir))
+            for stem in set(self.entries) - set(files):
+                del self.entries[stem]
+                changed = True
+            for stem, file in files.items():
+                entry = self.entries.get(stem)
+                if entry is None or entry['file'] != file:
+                    changed |= self._update(stem, file)
+            if changed:
+                self._sort()
+        if self.stems:
+            # closed files never change, only the one currently being written
+            stem = self.stems[-1]
+            changed |= self._update(stem, self.entries[stem]['file'])
+        if changed:
+            self._sort()
+            self.save()
+        # saving the manifest touches the directory, so take the mtime afterwards
+        self.dir_mtime = os.stat(self.archive.data_dir).st_mtime_ns if changed else dir_mtime
+        return changed
+
+    def _update(self, stem: str, file: str) -> bool:
+        try:
+            st = os.stat(self.archive.data_dir + file)
+        except FileNotFoundError:
+            return self.entries.pop(stem, None) is not None
+        entry = self.entries.get(stem)
+        if entry and entry['file'] == file and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            # binary files are preallocated and written through mmap, only the row count moves
+            if not file.endswith('.bin') or entry['rows'] == columnar.read_header(self.archive.data_dir + file)[3]:
+                return False
+        if entry and entry['file'] == file:
+            start = entry['start']
+        else:
+            start = datetime.strptime(self.archive.re_compile.search(stem).group(), self.archive.fn_format).timestamp()
+        first, last, rows = self._scan(file)
+        self.entries[stem] = {'file': file, 'start': start, 'first': first, 'last': last,
+                              'rows': rows, 'size': st.st_size, 'mtime': st.st_mtime_ns}
+        return True
+
+    def _scan(self, file: str):
+        path = self.archive.data_dir + file
+        if file.endswith('.bin'):
+            timestamp = columnar.read_columns(path)['timestamp']
+            if not len(timestamp):
+                return None, None, 0
+            return float(timestamp[0]), float(timestamp[-1]), len(timestamp)
+        if file.endswith('.chunk'):
+            # the block table holds the time span, nothing needs decompressing
+            header = compaction.read_header(path)
+            if not header['blocks']:
+                return None, None, 0
+            return header['blocks'][0][1], header['blocks'][-1][2], header['rows']
+        with open(path, 'rb') as f:
+            f.readline()
+            contents = f.read()
+        # only count complete lines, a half-written one is still being appended
+        lines = contents[:contents.rfind(b'\n') + 1].splitlines()
+        if not lines:
+            return None, None, 0
+        return self._first_float(lines[0]), self._first_float(lines[-1]), len(lines)
+
+    def _first_float(self, line: bytes):
+        try:
+            return float(line.split(b' ', 1)[0])
+        except ValueError:
+            return None
+
+    def _sort(self):
+        self.stems = sorted(self.entries, key=lambda stem: self.entries[stem]['start'])
+        self.starts = [self.entries[stem]['start'] for stem in self.stems]
+        # files don't overlap, so the last timestamps are sorted as well
+        self.lasts = [self.entries[stem]['last'] or self.entries[stem]['start'] for stem in self.stems]
+        self.by_file = {entry['file']: entry for entry in self.entries.values()}
+
+    def version(self, file: str):
+        entry = self.by_file.get(file)
+        return None if entry is None else (entry['mtime'], entry['size'])
+
+    def files(self, lo: int, hi: int) -> list:
+        return [self.entries[stem]['file'] for stem in self.stems[lo:hi]]
+
+    def started_between(self, start: float, end: float) -> list:
+        return self.files(bisect_left(self.starts, start), bisect_right(self.starts, end))
+
+    def overlapping(self, start: float, end: float) -> list:
+        return self.files(bisect_left(self.lasts, start), bisect_right(self.starts, end))
+
+    def latest_start(self):
+        return self.starts[-1] if self.starts else None
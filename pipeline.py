@@ -0,0 +1,189 @@
+from datetime import datetime, timezone
+from math import gcd
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+
+def local_datetime64(timestamps: np.ndarray) -> np.ndarray:
+    # same wall-clock times as datetime.fromtimestamp, but the UTC offset is only looked up
+    # once per quarter hour (every real-world DST switch falls on one of those boundaries)
+    seconds = np.floor(timestamps)
+    micros = np.rint((timestamps - seconds) * 1e6).astype(np.int64)
+    quarters, inverse = np.unique(seconds // 900, return_inverse=True)
+    offsets = np.array([(datetime.fromtimestamp(q * 900) -
+                         datetime.fromtimestamp(q * 900, timezone.utc).replace(tzinfo=None)).total_seconds()
+                        for q in quarters], dtype=np.int64)
+    local = (seconds.astype(np.int64) + offsets[inverse.reshape(-1)]) * 1000000 + micros
+    return local.astype('datetime64[us]')
+
+
+def rule_seconds(rule: str):
+    offset = to_offset(rule)
+    if isinstance(offset, pd.offsets.Day):
+        return offset.n * 86400
+    try:
+        return offset.nanos / 1e9
+    except ValueError:
+        # calendar rules (weeks, months) start on midnight boundaries
+        return None
+
+
+def particle_bins(header: list) -> list:
+    # the cumulative counts only, not their _min/_max columns
+    return [i for i, name in enumerate(header) if name.startswith('particles_') and name.endswith('um')]
+
+
+def required_columns(header: list) -> list:
+    # a row is incomplete without any of these; the PM _min/_max columns (Sensors.pm_extremes) and the
+    # <sensor>_time ones (Sensors.sensor_times) come and go with the values, except in rows from files
+    # written before they were switched on
+    return [i for i, name in enumerate(header) if not name.endswith(('_min', '_max', '_time'))]
+
+
+def merge_headers(headers: list) -> list:
+    # every column of every header, in the order they first appear
+    merged = []
+    # a span of files mostly repeats one or two headers
+    for header in dict.fromkeys(map(tuple, headers)):
+        merged.extend(name for name in header if name not in merged)
+    return merged
+
+
+def align(data: np.ndarray, header: list, columns: list) -> np.ndarray:
+    # data with the given columns in that order, nan where its header lacks one
+    if header == columns:
+        return data
+    aligned = np.full((len(data), len(columns)), np.nan)
+    for i, name in enumerate(header):
+        if name in columns:
+            aligned[:, columns.index(name)] = data[:, i]
+    return aligned
+
+
+def drop_incomplete(stream, columns=None):
+    for chunk in stream:
+        yield chunk[~np.isnan(chunk if columns is None else chunk[:, columns]).any(axis=1)]
+
+
+def select_range(stream, column: int, start=None, end=None):
+    for chunk in stream:
+        mask = np.ones(len(chunk), dtype=bool)
+        if start is not None:
+            mask &= chunk[:, column] >= start
+        if end is not None:
+            mask &= chunk[:, column] <= end
+        yield chunk[mask]
+
+
+def difference_bins(stream, header: list):
+    # the sensor reports cumulative counts (>0.3um, >0.5um, ...), turn them into per-bin counts
+    bins = particle_bins(header)
+    for chunk in stream:
+        if not chunk.flags.writeable:
+            chunk = chunk.copy()
+        for a, b in zip(bins, bins[1:]):
+            chunk[:, a] -= chunk[:, b]
+        yield chunk
+
+
+def record_dtype(ncols: int) -> np.dtype:
+    # counts are per column, a column that only some files have averages over the rows that have it
+    return np.dtype([('bucket', '<i8'), ('count', '<i8', (ncols,)), ('sum', '<f8', (ncols,)),
+                     ('min', '<f8', (ncols,)), ('max', '<f8', (ncols,))])
+
+
+def widen_records(records: np.ndarray, columns: list, widened: list) -> np.ndarray:
+    # records over more columns, the ones they lack left empty
+    if columns == widened:
+        return records
+    result = np.zeros(len(records), dtype=record_dtype(len(widened)))
+    result['bucket'] = records['bucket']
+    result['min'] = np.inf
+    result['max'] = -np.inf
+    index = [widened.index(name) for name in columns]
+    for field in ('count', 'sum', 'min', 'max'):
+        result[field][:, index] = records[field]
+    return result
+
+
+def aggregate(df: pd.DataFrame, rule: str) -> np.ndarray:
+    # count/sum/min/max per bucket and column, buckets labelled by their start in local wall-clock ns;
+    # nan counts for nothing, an empty min/max is +/-inf so folding needs no nan checks
+    seconds = rule_seconds(rule)
+    if seconds and 86400 % seconds == 0:
+        # buckets that divide a day line up with pandas' bins, no need for a groupby
+        step = int(seconds * 1e9)
+        values = df.values
+        valid = ~np.isnan(values)
+        records = np.zeros(len(df), dtype=record_dtype(df.shape[1]))
+        records['bucket'] = df.index.values.astype('datetime64[ns]').astype(np.int64) // step * step
+        records['count'] = valid
+        records['sum'] = np.where(valid, values, 0.0)
+        records['min'] = np.where(valid, values, np.inf)
+        records['max'] = np.where(valid, values, -np.inf)
+        return fold(records)
+    grouped = df.resample(rule)
+    keep = grouped.size().values > 0
+    records = np.zeros(int(keep.sum()), dtype=record_dtype(df.shape[1]))
+    records['bucket'] = grouped.size().index.values[keep].astype('datetime64[ns]').astype(np.int64)
+    records['count'] = grouped.count().values[keep]
+    records['sum'] = grouped.sum().values[keep]
+    records['min'] = np.nan_to_num(grouped.min().values[keep], nan=np.inf)
+    records['max'] = np.nan_to_num(grouped.max().values[keep], nan=-np.inf)
+    return records
+
+
+def fold(records: np.ndarray) -> np.ndarray:
+    # merge records that share a bucket
+    if len(records) < 2:
+        return records
+    records = records[np.argsort(records['bucket'], kind='stable')]
+    starts = np.flatnonzero(np.diff(records['bucket'], prepend=records['bucket'][0] - 1))
+    folded = np.zeros(len(starts), dtype=records.dtype)
+    folded['bucket'] = records['bucket'][starts]
+    folded['count'] = np.add.reduceat(records['count'], starts)
+    folded['sum'] = np.add.reduceat(records['sum'], starts)
+    folded['min'] = np.minimum.reduceat(records['min'], starts)
+    folded['max'] = np.maximum.reduceat(records['max'], starts)
+    return folded
+
+
+def combine(records: np.ndarray, columns: list, rule: str, how='mean') -> pd.DataFrame:
+    # buckets are labelled by their start, nudge them inside so right-closed rules bin them correctly
+    index = pd.DatetimeIndex(pd.to_datetime(records['bucket'] + 1, unit='ns'), name='datetime')
+    if how == 'mean':
+        count = pd.DataFrame(records['count'], index=index, columns=columns).resample(rule).sum()
+        df = pd.DataFrame(records['sum'], index=index, columns=columns).resample(rule).sum()
+        return df / count.where(count > 0)
+    df = pd.DataFrame(records[how], index=index, columns=columns).resample(rule).agg(how)
+    return df.replace([np.inf, -np.inf], np.nan) if how in ('min', 'max') else df
+
+
+class StreamResampler:
+    def __init__(self, rule: str, header: list):
+        self.rule = rule
+        self.header = list(header)
+        self.timestamp = self.header.index('timestamp')
+        self.columns = [name for name in self.header if name != 'timestamp']
+        # aggregate on buckets that nest inside the rule's bins, calendar rules go through days
+        seconds = rule_seconds(rule)
+        self.tier = f'{gcd(int(seconds), 86400)}s' if seconds else '1D'
+        self.records = np.zeros(0, dtype=record_dtype(len(self.columns)))
+        self.rows = 0
+
+    def add(self, chunk: np.ndarray):
+        if not len(chunk):
+            return
+        index = pd.DatetimeIndex(local_datetime64(chunk[:, self.timestamp]), name='datetime')
+        df = pd.DataFrame(np.delete(chunk, self.timestamp, axis=1), index=index, columns=self.columns)
+        self.records = fold(np.concatenate([self.records, aggregate(df, self.tier)]))
+        self.rows += len(chunk)
+
+    def consume(self, stream):
+        for chunk in stream:
+            self.add(chunk)
+        return self
+
+    def result(self, how='mean') -> pd.DataFrame:
+        return combine(self.records, self.columns, self.rule, how)
@@ -0,0 +1,136 @@
+import struct
+from collections import deque
+from threading import Event, Lock, Thread
+from time import time
+import numpy as np
+
+# PMS5003 frame, all big endian: 0x42 0x4d | frame length (u2, 28) | 13 data words (u2) | checksum (u2)
+# the checksum is the sum of the 30 bytes before it; the 13th data word is reserved
+START = b'\x42\x4d'
+FRAME = struct.Struct('>2sH13HH')
+FIELDS = ['pm10 standard', 'pm25 standard', 'pm100 standard', 'pm10 env', 'pm25 env', 'pm100 env',
+          'particles 03um', 'particles 05um', 'particles 10um', 'particles 25um', 'particles 50um',
+          'particles 100um']
+
+
+def decode(buffer: bytearray) -> tuple:
+    # (frames, bad) from everything complete in buffer, consumed bytes are removed from it;
+    # each frame is the 12 values in adafruit_pm25 order, bad counts frames that failed the checksum
+    frames = []
+    bad = 0
+    while True:
+        start = buffer.find(START)
+        if start < 0:
+            # keep a trailing 0x42, it may be the first half of the next start marker
+            del buffer[:max(0, len(buffer) - 1)]
+            return frames, bad
+        del buffer[:start]
+        if len(buffer) < FRAME.size:
+            return frames, bad
+        _, length, *words, checksum = FRAME.unpack_from(buffer)
+        if length != FRAME.size - 4 or sum(buffer[:FRAME.size - 2]) != checksum:
+            # not a frame after all, or a corrupted one: resync on the next start marker
+            bad += 1
+            del buffer[:2]
+            continue
+        frames.append(words[:12])
+        del buffer[:FRAME.size]
+
+
+def encode(values: list) -> bytes:
+    # the frame the sensor would send for these 12 values, for simulated serial streams
+    body = struct.pack('>2sH13H', START, FRAME.size - 4, *values, 0)
+    return body + struct.pack('>H', sum(body))
+
+
+class FrameReader:
+    def __init__(self, uart=None, window_seconds=600, retry_seconds=1.0):
+        # every frame the sensor streams (about one a second) lands in a time-stamped window;
+        # feed() takes raw bytes from anywhere, start() reads the uart on a thread of its own
+        self.uart = uart
+        self.window_seconds = window_seconds
+        self.retry_seconds = retry_seconds
+        self.frames = deque()
+        self.valid = 0
+        self.bad = 0
+        # serial errors, the port is reopened after each; last_error is cleared by the next good read
+        self.errors = 0
+        self.last_error = None
+        self._buffer = bytearray()
+        # frames counted in self.valid that a read has already reported
+        self._consumed = 0
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self.run, name='pms5003', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                # returns after the port timeout at the latest, so stop() is noticed
+                data = self.uart.read(self.uart.in_waiting or FRAME.size)
+            except Exception as e:
+                # SerialException from an unplugged adapter, OSError, ...: the thread must not end over it
+                self.failed(e)
+                if not self._stop.wait(self.retry_seconds):
+                    self.reopen()
+                continue
+            self.last_error = None
+            self.feed(data)
+
+    def failed(self, error: Exception):
+        with self._lock:
+            self.errors += 1
+            self.last_error = repr(error)
+
+    def reopen(self):
+        try:
+            self.uart.close()
+            self.uart.open()
+        except Exception as e:
+            self.failed(e)
+
+    def feed(self, data: bytes):
+        self._buffer.extend(data)
+        frames, bad = decode(self._buffer)
+        with self._lock:
+            # stamped under the lock, so a read can never slip in between a frame's timestamp and its append
+            now = time()
+            self.bad += bad
+            self.valid += len(frames)
+            self.frames.extend((now, frame) for frame in frames)
+            while self.frames and self.frames[0][0] < now - self.window_seconds:
+                self.frames.popleft()
+
+    def since(self, start: float) -> np.ndarray:
+        with self._lock:
+            return np.array([frame for timestamp, frame in self.frames if timestamp > start], dtype=float)
+
+    def read(self, extremes=False) -> list:
+        # mean of every valid frame since the previous read, then their min and max if asked;
+        # raises like adafruit_pm25 does when there is nothing to report
+        with self._lock:
+            # the cut is taken under the lock and by count, not time, so every frame goes to exactly one read
+            new = min(self.valid - self._consumed, len(self.frames))
+            frames = np.array([frame for _, frame in list(self.frames)[len(self.frames) - new:]], dtype=float)
+            self._consumed = self.valid
+            error = self.last_error
+        if not len(frames):
+            if error is not None:
+                raise RuntimeError(f'No valid PM2.5 frame since the last read, serial port failing: {error}')
+            raise RuntimeError('No valid PM2.5 frame since the last read')
+        values = np.round(frames.mean(axis=0), 1).tolist()
+        if extremes:
+            values += frames.min(axis=0).tolist() + frames.max(axis=0).tolist()
+        return values
+
+    def stats(self) -> dict:
+        return {'valid': self.valid, 'bad': self.bad, 'errors': self.errors, 'last_error': self.last_error,
+                'buffered': len(self.frames)}
@@ -0,0 +1,109 @@
+import os
+import json
+import logging
+import cProfile
+import resource
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from threading import local
+from time import perf_counter
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss() -> int:
+    # current resident set size in bytes, one small read from /proc
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+
+def max_rss() -> int:
+    # high-water mark of the whole process, ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Profiler:
+    def __init__(self, log_file=None, max_bytes=1024**2, backups=3, capture=False, capture_dir=None):
+        self.capture = capture
+        self.capture_dir = capture_dir or os.path.dirname(log_file or '') or '.'
+        self.last = None
+        self._local = local()
+        self.logger = None
+        if log_file is not None:
+            os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+            self.logger = logging.getLogger(f'profiling.{os.path.abspath(log_file)}')
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+            if not self.logger.handlers:
+                handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups)
+                handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+                self.logger.addHandler(handler)
+
+    @property
+    def stages(self):
+        # breakdown of the refresh running on this thread, None outside of one
+        return getattr(self._local, 'stages', None)
+
+    @contextmanager
+    def refresh(self, name: str):
+        self._local.stages = []
+        profile = cProfile.Profile() if self.capture else None
+        started = perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield self._local.stages
+        finally:
+            if profile is not None:
+                profile.disable()
+            breakdown = {'refresh': name, 'seconds': perf_counter() - started, 'peak': max_rss(),
+                         'stages': self._local.stages}
+            self._local.stages = None
+            self.last = breakdown
+            if self.logger is not None:
+                self.logger.info(json.dumps(breakdown))
+            if profile is not None:
+                os.makedirs(self.capture_dir, exist_ok=True)
+                stamp = datetime.now().strftime('%Y-%m-%d %H-%M-%S')
+                profile.dump_stats(os.path.join(self.capture_dir, f'profile {stamp} {name}.prof'))
+
+    @contextmanager
+    def stage(self, name: str, rows=None):
+        # a no-op outside of a refresh, so library code can carry the hooks unconditionally
+        stages = self.stages
+        if stages is None:
+            yield {}
+            return
+        entry = {'stage': name, 'seconds': 0.0, 'rows': rows}
+        before, peak_before = rss(), max_rss()
+        started = perf_counter()
+        try:
+            yield entry
+        finally:
+            entry['seconds'] = perf_counter() - started
+            after, peak_after = rss(), max_rss()
+            # the process high-water mark only says something if it moved during the stage
+            entry['rss'] = after
+            entry['peak'] = peak_after if peak_after > peak_before else max(before, after)
+            stages.append(entry)
+
+    def add(self, report: list):
+        # stages someone else already timed, e.g. ReadArchive.stage_report
+        stages = self.stages
+        if stages is not None:
+            stages.extend({'stage': entry['stage'], 'seconds': entry['seconds'], 'rows': entry['rows']}
+                          for entry in report)
+
+    def summary(self, top=4) -> str:
+        if self.last is None:
+            return ''
+        totals = {}
+        for entry in self.last['stages']:
+            totals[entry['stage']] = totals.get(entry['stage'], 0.0) + entry['seconds']
+        slowest = sorted(totals.items(), key=lambda item: -item[1])[:top]
+        stages = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in slowest)
+        return f"{self.last['refresh']} {self.last['seconds']:.2f}s: {stages} | peak {self.last['peak'] / 1024**2:.0f} MB"
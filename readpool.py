@@ -0,0 +1,79 @@
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+_worker_archive = None
+
+
+def _init_worker(archive):
+    global _worker_archive
+    _worker_archive = archive
+
+
+def _read_to_shm(filename: str):
+    # parse in the worker and hand back only the name of a shared memory block
+    data = _worker_archive.read_file(filename)
+    if not data.size:
+        return None, data.shape
+    shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    np.ndarray(data.shape, dtype=np.float64, buffer=shm.buf)[:] = data
+    shm.close()
+    return shm.name, data.shape
+
+
+def attach(name: str, shape: tuple) -> np.ndarray:
+    if name is None:
+        return np.empty(shape)
+    shm = shared_memory.SharedMemory(name=name)
+    # the mapping outlives the name, so nothing leaks if the array is never released
+    shm.unlink()
+    data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    weakref.finalize(data, shm.close)
+    return data
+
+
+class ReaderPool:
+    def __init__(self, archive, inline_max=4, thread_max=16, workers=None):
+        # inline_max and thread_max are placeholders, not measured crossovers: benchmarks/pool_crossover.py has
+        # only been run on one core, where inline is as fast as either pool from 1 to 128 files (hence the
+        # workers == 1 rule in mode()); set them from its results on a multi-core board
+        self.archive = archive
+        self.inline_max = inline_max
+        self.thread_max = thread_max
+        self.workers = workers or os.cpu_count() or 1
+        self._threads = None
+        self._processes = None
+
+    def mode(self, nfiles: int) -> str:
+        # a single core gains nothing from either pool, see benchmarks/pool_crossover.py
+        if nfiles <= self.inline_max or self.workers == 1:
+            return 'inline'
+        if nfiles <= self.thread_max:
+            return 'thread'
+        return 'process'
+
+    def read(self, files: list, mode=None) -> list:
+        mode = mode or self.mode(len(files))
+        if mode == 'inline':
+            return [self.archive.read_file(file) for file in files]
+        if mode == 'thread':
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.workers + 2)
+            return list(self._threads.map(self.archive.read_file, files))
+        if self._processes is None:
+            # workers must share our resource tracker, otherwise they'd unlink blocks on exit
+            resource_tracker.ensure_running()
+            self._processes = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                  initargs=(self.archive,))
+        chunksize = max(1, len(files) // (self.workers * 4))
+        return [attach(name, shape) for name, shape in self._processes.map(_read_to_shm, files, chunksize=chunksize)]
+
+    def close(self):
+        if self._threads is not None:
+            self._threads.shutdown()
+            self._threads = None
+        if self._processes is not None:
+            self._processes.shutdown()
+            self._processes = None
@@ -0,0 +1,117 @@
+import struct
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+# Block layout:
+#   seq (u8) | capacity (u8) | header length (u4) | header text, padded up to DATA_ALIGN
+#   2 x capacity records, every record is written to slot and slot + capacity so the
+#   last n records are always one contiguous run
+PREFIX = struct.Struct('<QQI')
+HEADER_MAX = 1024
+DATA_ALIGN = 64
+
+
+def _open(name: str) -> shared_memory.SharedMemory:
+    shm = shared_memory.SharedMemory(name=name)
+    # only the creator unlinks the block, a reader exiting must not take it down with it
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def record_dtype(columns: list) -> np.dtype:
+    # seq is the 1-based sample number, 0 marks a slot that was never written
+    return np.dtype([('seq', '<u8')] + [(name, '<f8') for name in columns])
+
+
+class SampleRing:
+    def __init__(self, shm: shared_memory.SharedMemory, owner=False):
+        self.shm = shm
+        self.owner = owner
+        _, self.capacity, length = PREFIX.unpack_from(shm.buf, 0)
+        self.columns = bytes(shm.buf[PREFIX.size:PREFIX.size + length]).decode().split()
+        self.dtype = record_dtype(self.columns)
+        offset = -(-(PREFIX.size + HEADER_MAX) // DATA_ALIGN) * DATA_ALIGN
+        self._seq = np.ndarray((1,), dtype='<u8', buffer=shm.buf, offset=0)
+        self._records = np.ndarray((2 * self.capacity,), dtype=self.dtype, buffer=shm.buf, offset=offset)
+
+    @classmethod
+    def create(cls, columns: list, capacity=17280, name=None):
+        header = ' '.join(columns).encode()
+        if len(header) > HEADER_MAX:
+            raise ValueError('too many columns for the ring header')
+        offset = -(-(PREFIX.size + HEADER_MAX) // DATA_ALIGN) * DATA_ALIGN
+        shm = shared_memory.SharedMemory(name=name, create=True,
+                                         size=offset + 2 * capacity * record_dtype(columns).itemsize)
+        PREFIX.pack_into(shm.buf, 0, 0, capacity, len(header))
+        shm.buf[PREFIX.size:PREFIX.size + len(header)] = header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str):
+        # for processes that didn't inherit the ring, e.g. an exporter started on its own
+        return cls(_open(name))
+
+    def __getstate__(self):
+        # processes started with spawn map the same block again by name, they share
+        # the creator's resource tracker so registering it again is harmless
+        return {'name': self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(shared_memory.SharedMemory(name=state['name']))
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def seq(self) -> int:
+        return int(self._seq[0])
+
+    def append(self, values: list):
+        # single writer: fill both copies of the slot, then publish the new count
+        seq = self.seq + 1
+        slot = (seq - 1) % self.capacity
+        record = (seq, *[np.nan if value is None else value for value in values])
+        self._records[slot] = record
+        self._records[slot + self.capacity] = record
+        self._seq[0] = seq
+
+    def latest(self, n: int) -> np.ndarray:
+        # zero-copy view of the newest n records, oldest first; it stays intact for
+        # another capacity - n appends, copy it to keep it longer
+        seq = self.seq
+        n = min(n, seq, self.capacity - 1)
+        end = (seq - 1) % self.capacity + 1 + self.capacity
+        return self._records[end - n:end]
+
+    def last(self):
+        # copy of the newest record or None; the writer only ever fills the slot after it, so the
+        # copy can only be stale if the writer lapped the whole ring meanwhile, the seq check catches that
+        while True:
+            seq = self.seq
+            if not seq:
+                return None
+            record = self._records[(seq - 1) % self.capacity].copy()
+            if int(record['seq']) == seq:
+                return record
+
+    def since(self, seq: int) -> tuple:
+        # records written after seq and the seq to pass next time; readers that fell more
+        # than a buffer behind see a gap in the seq field instead of blocking the writer
+        current = self.seq
+        return self.latest(current - seq), current
+
+    def intact(self, records: np.ndarray, first: int) -> bool:
+        # first is records['seq'][0] as read right after latest(), overwritten slots carry newer seqs
+        return not len(records) or (int(records['seq'][0]) == first and
+                                    int(records['seq'][-1]) == first + len(records) - 1)
+
+    def close(self):
+        self._seq = None
+        self._records = None
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,178 @@
+import os
+import json
+import fcntl
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from pipeline import rule_seconds, record_dtype, widen_records, aggregate, fold, combine
+
+# bumped when the tier record layout changes, tiers in an older one are built again from the archive
+FORMAT = 2
+
+
+class RollupStore:
+    def __init__(self, archive, tiers=('5min', '1h', '1D')):
+        self.archive = archive
+        self.tiers = {tier: pd.Timedelta(tier).total_seconds() for tier in tiers}
+        self.folder = archive.data_dir + '.rollups/'
+        self.columns = None
+        self.done = set()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.folder + 'index.json') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get('format') != FORMAT:
+            self.columns = None
+            self.done = set()
+            return
+        self.columns = saved['columns']
+        self.done = set(saved['done'])
+
+    def save(self):
+        tmp = self.folder + 'index.json.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'format': FORMAT, 'columns': self.columns, 'done': sorted(self.done)}, f)
+        os.replace(tmp, self.folder + 'index.json')
+
+    def tier_for(self, rule: str):
+        # the coarsest tier whose buckets nest inside the rule's bins
+        try:
+            seconds = rule_seconds(rule)
+        except ValueError:
+            return None
+        for tier, tier_seconds in sorted(self.tiers.items(), key=lambda item: -item[1]):
+            if (seconds or 86400) % tier_seconds == 0:
+                return tier
+        return None
+
+    def pending(self) -> list:
+        manifest = self.archive.manifest
+        # the newest file is still being written and gets aggregated on the fly
+        return [stem for stem in manifest.stems[:-1] if stem not in self.done]
+
+    def update(self) -> int:
+        self.archive.manifest.refresh()
+        if not self.pending():
+            return 0
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.folder + 'lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # another process may have rolled some files up while we waited
+            self.load()
+            if not self.done:
+                # nothing recorded, whatever tiers are there are from an older format or an interrupted start
+                for tier in self.tiers:
+                    if os.path.exists(self.folder + tier + '.bin'):
+                        os.remove(self.folder + tier + '.bin')
+                self.columns = None
+            pending = self.pending()
+            for stem in pending:
+                file = self.archive.manifest.entries[stem]['file']
+                df = self.archive.build_df(self.archive.read_file(file), self.archive.read_header(file))
+                columns = self.widened(df)
+                if columns != self.columns:
+                    for tier in self.tiers:
+                        self.widen(tier, columns)
+                    self.columns = columns
+                df = self.conform(df)
+                if len(df):
+                    for tier in self.tiers:
+                        self.append(tier, aggregate(df, tier))
+                self.done.add(stem)
+            self.save()
+        return len(pending)
+
+    def transfer(self, sources: list, stem: str, swap) -> bool:
+        # compaction merges rolled-up files into one, which must not be rolled up a second time
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.folder + 'lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.load()
+            if not set(sources) <= self.done:
+                return False
+            # the new stem is recorded before it appears, stems that are gone for good are dropped
+            self.archive.manifest.refresh()
+            self.done &= set(self.archive.manifest.stems)
+            self.done.add(stem)
+            self.save()
+            swap()
+        return True
+
+    def widened(self, df: pd.DataFrame, columns=None) -> list:
+        # the tier columns once df is in: files can add columns (Sensors.pm_extremes) but never take them
+        # away; read times (Sensors.sensor_times) are no measurement and stay out of the tiers
+        columns = list((self.columns if columns is None else columns) or [])
+        return columns + [name for name in df.columns if name not in columns and not name.endswith('_time')]
+
+    def widen(self, tier: str, columns: list):
+        # tier files are rewritten once per new column, under the lock update() holds
+        path = self.folder + tier + '.bin'
+        if self.columns is None or not os.path.exists(path):
+            return
+        records = widen_records(np.fromfile(path, dtype=record_dtype(len(self.columns))), self.columns, columns)
+        records.tofile(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def conform(self, df: pd.DataFrame, columns=None) -> pd.DataFrame:
+        # records are fixed width, columns a file doesn't have are nan and count for nothing
+        columns = self.columns if columns is None else columns
+        return df if list(df.columns) == columns else df.reindex(columns=columns)
+
+    def append(self, tier: str, records: np.ndarray):
+        if not len(records):
+            return
+        path = self.folder + tier + '.bin'
+        with open(path, 'ab+') as f:
+            end = f.seek(0, os.SEEK_END)
+            # hourly files split buckets, fold the first new record into an open last one
+            if end >= records.itemsize:
+                f.seek(end - records.itemsize)
+                last = np.frombuffer(f.read(records.itemsize), dtype=records.dtype).copy()
+                if last['bucket'][0] == records['bucket'][0]:
+                    records = fold(np.concatenate([last, records]))
+                    f.truncate(end - records.itemsize)
+            f.write(records.tobytes())
+
+    def read(self, tier: str) -> np.ndarray:
+        path = self.folder + tier + '.bin'
+        if self.columns is None or not os.path.exists(path):
+            return np.zeros(0, dtype=record_dtype(len(self.columns or [])))
+        return np.fromfile(path, dtype=record_dtype(len(self.columns)))
+
+    def query(self, start: float, end: float, rule: str, how='mean'):
+        tier = self.tier_for(rule)
+        if tier is None:
+            return None
+        # what the daemon has folded so far, it updates at every rotation; files it hasn't got to yet are
+        # aggregated here without being folded, so a refresh never waits on a full update
+        self.archive.manifest.refresh()
+        columns, folded = [], np.zeros(0, dtype=record_dtype(0))
+        if os.path.isdir(self.folder):
+            with open(self.folder + 'lock', 'a') as lock:
+                # append() truncates and rewrites the last record under the exclusive lock
+                fcntl.flock(lock, fcntl.LOCK_SH)
+                self.load()
+                columns = list(self.columns or [])
+                folded = self.read(tier)
+        records = [(folded, columns)]
+        for file in self.archive.manifest.overlapping(start, end):
+            if self.archive.stem(file) in self.done:
+                continue
+            df = self.archive.build_df(self.archive.load_file(file), self.archive.read_header(file))
+            columns = self.widened(df, columns)
+            df = self.conform(df, columns)
+            if len(df):
+                records.append((aggregate(df, tier), columns))
+        if not columns:
+            return None
+        records = np.concatenate([widen_records(r, c, columns) for r, c in records if len(r)] or
+                                 [np.zeros(0, record_dtype(len(columns)))])
+        # keep every bucket that overlaps the requested span
+        lo = pd.Timestamp(datetime.fromtimestamp(start)).value - int(self.tiers[tier] * 1e9)
+        hi = pd.Timestamp(datetime.fromtimestamp(end)).value
+        records = records[(records['bucket'] > lo) & (records['bucket'] <= hi)]
+        return combine(records, columns, rule, how)
@@ -1,6 +1,6 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-import os, sys
+import os
 from datetime import datetime as dt
 from datetime import timedelta
 import numpy as np
@@ -74,6 +74,7 @@ if __name__ == '__main__':
             files.pop(i)
 
     df = create_df(files)
-    print(f'df size: {round(sys.getsizeof(df)/1024**2, 2)} MB')
+    # getsizeof only sees the DataFrame object, not the column buffers it holds
+    print(f'df size: {round(df.memory_usage(deep=True).sum()/1024**2, 2)} MB')
     # print(df.resample('2W').mean())
     print(df[df.index > dt.now() - timedelta(days=60)].resample('D').mean())
\ No newline at end of file
@@ -0,0 +1,76 @@
+from collections import deque
+from datetime import datetime, timedelta
+from time import monotonic, sleep
+import numpy as np
+from metrics import JITTER_BUCKETS
+
+
+def next_boundary(dt: datetime, seconds=3600) -> datetime:
+    # the next wall-clock multiple of seconds after dt, counted from midnight
+    midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = (dt - midnight).total_seconds()
+    return midnight + timedelta(seconds=(elapsed // seconds + 1) * seconds)
+
+
+class Schedule:
+    def __init__(self, period: float, start=None, jitter_window=4096):
+        # deadlines are start + k * period on the monotonic clock, so time spent reading and
+        # writing never pushes the next tick back and the cadence can't drift; the first one is
+        # a whole period after start, whatever ran at start has already had its turn
+        self.period = period
+        self.start = monotonic() if start is None else start
+        self.ticks = 0
+        self.missed = 0
+        self.jitter = deque(maxlen=jitter_window)
+        self._jitter_seconds = None
+
+    @property
+    def deadline(self) -> float:
+        return self.start + (self.ticks + 1) * self.period
+
+    def wait(self, stop=None) -> bool:
+        # sleep until the next deadline, False if stop (an Event) was set meanwhile
+        delay = self.delay()
+        if delay > 0:
+            if stop is not None:
+                if stop.wait(delay):
+                    return False
+            else:
+                sleep(delay)
+        self.tick()
+        return stop is None or not stop.is_set()
+
+    def delay(self) -> float:
+        # seconds left to the next deadline; callers that can't block (asyncio) sleep it themselves, then tick()
+        now = monotonic()
+        late = now - self.deadline
+        if late >= self.period:
+            # overran by whole periods: drop those ticks rather than firing them back to back
+            skipped = int(late // self.period)
+            self.missed += skipped
+            self.ticks += skipped
+        return self.deadline - now
+
+    def tick(self):
+        jitter = monotonic() - self.deadline
+        self.jitter.append(jitter)
+        if self._jitter_seconds is not None:
+            self._jitter_seconds.observe(jitter)
+        self.ticks += 1
+
+    def instrument(self, registry, name: str):
+        # see metrics.Registry; counters read the schedule's own fields when scraped
+        self._jitter_seconds = registry.histogram('environment_schedule_jitter_seconds', 'Lateness of a tick',
+                                                  ('schedule',), JITTER_BUCKETS).labels(name)
+        registry.counter('environment_schedule_ticks_total', 'Deadlines passed, missed ones included',
+                         ('schedule',)).labels(name).set_function(lambda: self.ticks)
+        registry.counter('environment_schedule_missed_total', 'Deadlines skipped after an overrun',
+                         ('schedule',)).labels(name).set_function(lambda: self.missed)
+
+    def stats(self) -> dict:
+        jitter = np.array(self.jitter)
+        stats = {'period': self.period, 'ticks': self.ticks, 'missed': self.missed}
+        if len(jitter):
+            stats.update({'mean': float(jitter.mean()), 'p99': float(np.percentile(jitter, 99)),
+                          'max': float(jitter.max())})
+        return stats
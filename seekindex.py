@@ -0,0 +1,65 @@
+import os
+from threading import Lock
+import numpy as np
+
+
+class SeekIndex:
+    def __init__(self, every=64):
+        self.every = every
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, path: str) -> dict:
+        # sparse timestamp -> line offset table, extended in place while a file grows
+        size = os.stat(path).st_size
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry['end'] == size:
+                return entry
+            with open(path, 'rb') as f:
+                if entry is None or size < entry['end']:
+                    f.readline()
+                    entry = {'data_start': f.tell(), 'end': f.tell(), 'lines': 0,
+                             'timestamps': np.empty(0), 'offsets': np.empty(0, dtype=np.int64)}
+                f.seek(entry['end'])
+                data = f.read(size - entry['end'])
+            # only index complete lines, the tail may still be written
+            cut = data.rfind(b'\n') + 1
+            newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8, count=cut) == ord('\n'))
+            starts = np.concatenate([[0], newlines[:-1] + 1]) if len(newlines) else newlines
+            picks = starts[(entry['lines'] + np.arange(len(starts))) % self.every == 0]
+            timestamps, offsets = [], []
+            for pick in picks:
+                try:
+                    timestamps.append(float(data[pick:data.index(b' ', pick)]))
+                    offsets.append(entry['end'] + pick)
+                except ValueError:
+                    continue
+            entry = {'data_start': entry['data_start'], 'end': entry['end'] + cut,
+                     'lines': entry['lines'] + len(starts),
+                     'timestamps': np.concatenate([entry['timestamps'], timestamps]),
+                     'offsets': np.concatenate([entry['offsets'], np.array(offsets, dtype=np.int64)])}
+            entry['monotonic'] = bool(np.all(np.diff(entry['timestamps']) >= 0))
+            self._entries[path] = entry
+            return entry
+
+    def span(self, path: str, start=None, end=None) -> tuple:
+        # byte range that holds every line between start and end, (data_start, None) if unknown
+        entry = self.get(path)
+        timestamps, offsets = entry['timestamps'], entry['offsets']
+        if not entry['monotonic'] or not len(timestamps):
+            return entry['data_start'], None
+        lo, hi = entry['data_start'], None
+        if start is not None:
+            i = np.searchsorted(timestamps, start, side='right') - 1
+            if i > 0:
+                lo = int(offsets[i])
+        if end is not None:
+            j = np.searchsorted(timestamps, end, side='right')
+            if j < len(offsets):
+                hi = int(offsets[j])
+        return lo, hi
+
+    def forget(self, path: str):
+        with self._lock:
+            self._entries.pop(path, None)
@@ -1,160 +1,156 @@
-from multiprocessing import Process, Queue
-from threading import Event, Thread
-from queue import Empty, Full
-import tkinter as tk
-from tkinter import ttk
-import serial
+import os
+import logging
+from multiprocessing import Process, Queue, Event as ProcessEvent
+from threading import Thread
 from datetime import datetime
-from time import sleep
-# Raspberry Pi specific libraries below
-try:
-    import board
-    import busio
-    import adafruit_bme280, adafruit_pm25
-except ModuleNotFoundError:
-    print('Raspberry Pi libraries not found. Continuing anyway...')
+from time import time
+from writer import ArchiveWriter, recover
+from ringbuffer import SampleRing
+from windowstats import WindowStats
+from acquisition import Acquisition, SensorWorker
+from scheduler import Schedule, next_boundary
+from archive import ReadArchive
+from drivers import HardwareDriver
+from async_engine import AsyncEngine
+import compaction
+import collector
+import metrics
+
+logger = logging.getLogger(__name__)
+
 
 class Sensors:
-    def __init__(self, data_folder='./data/', serial_port='/dev/ttyS0'):
+    def __init__(self, data_folder='./data/', serial_port='/dev/ttyS0', binary_archive=True,
+                 flush_samples=1, flush_seconds=None, fsync='rotation', ring_capacity=17280, serial_timeout=2.0,
+                 sensor_intervals=None, sampling_delay=5, driver=None,
+                 engine='threads', collector=None, station=None, metrics_port=None, pm_extremes=False,
+                 sensor_times=False):
         self.data_folder = data_folder
-        self.loop_counter = 0
-        self.reset_threshold = 720 # 1 hour
-        self.sampling_delay = 5 # 5 seconds
-        self.reset_pin = None
-        self.i2c = busio.I2C(board.SCL, board.SDA)
-        self.bme280 = adafruit_bme280.Adafruit_BME280_I2C(self.i2c)
-        self.savefile = None
-        try:
-            self.uart = serial.Serial(serial_port, baudrate=9600, timeout=None)
-            self.pm25 = adafruit_pm25.PM25_UART(self.uart, self.reset_pin)
-        except serial.SerialException:
-            self.popup('Serial device not found.')
+        self.binary_archive = binary_archive
+        # see writer.ArchiveWriter, the defaults match the old open/append/close per sample
+        self.write_policy = {'flush_samples': flush_samples, 'flush_seconds': flush_seconds, 'fsync': fsync}
+        self.writer = None
+        self.sampling_delay = sampling_delay # 5 seconds
+        self.rotation_seconds = 3600 # new file on every wall-clock hour
+        self.reset_threshold = int(self.rotation_seconds / self.sampling_delay) # samples per file
+        # per-sensor read intervals, e.g. {'bme280': 5, 'pm25': 30}; records still go out every sampling_delay
+        self.sensor_intervals = {'bme280': self.sampling_delay, 'pm25': self.sampling_delay}
+        self.sensor_intervals.update(sensor_intervals or {})
+        for name, interval in self.sensor_intervals.items():
+            # a record only takes the freshest read, faster reads would be thrown away (PM averages its
+            # frames in the driver, not across reads)
+            if interval < self.sampling_delay:
+                raise ValueError(f'{name} interval {interval} is shorter than sampling_delay {self.sampling_delay}')
+        self.schedule = None
+        self.serial_timeout = serial_timeout
+        # drivers.SyntheticDriver or drivers.ReplayDriver stand in for the sensors off the Pi
+        self.driver = driver
+        if self.driver is None:
+            self.driver = HardwareDriver(serial_port, serial_timeout)
+            if self.driver.error is not None:
+                self.popup(self.driver.error)
         self.header = 'timestamp temperature humidity pressure pm10_standard pm25_standard pm100_standard pm10_env pm25_env pm100_env particles_03um particles_05um particles_10um particles_25um particles_50um particles_100um\n'
-        self.nan_dict = {
-            'pm10 standard': None,
-            'pm25 standard': None,
-            'pm100 standard': None,
-            'pm10 env': None,
-            'pm25 env': None,
-            'pm100 env': None,
-            'particles 03um': None,
-            'particles 05um': None,
-            'particles 10um': None,
-            'particles 25um': None,
-            'particles 50um': None,
-            'particles 100 um': None
-            }
-        self.file_state = 0
+        # each PM value is the mean of the sensor's frames over the read interval, pm_extremes also
+        # records their min and max as <field>_min and <field>_max columns after the means
+        self.pm_extremes = pm_extremes
+        if pm_extremes:
+            pm_fields = self.header.split()[4:]
+            self.header = ' '.join(self.header.split() + [f'{name}_min' for name in pm_fields] +
+                                   [f'{name}_max' for name in pm_fields]) + '\n'
+        # a record's timestamp is when it went out, each sensor's values are its freshest read from up to
+        # two of its intervals before (see Acquisition); sensor_times also records when every sensor was
+        # read, as <sensor>_time columns at the end, empty with the sensor's values
+        self.sensor_times = sensor_times
+        if sensor_times:
+            self.header = ' '.join(self.header.split() + ['bme280_time', 'pm25_time']) + '\n'
         self.filename = None
-        self.sampling_buffer = Queue()
+        # the newest samples (24 hours at the default rate) for the GUI and any other reader
+        self.ring = SampleRing.create(self.header.split(), capacity=ring_capacity)
+        self.columns = self.ring.columns
+        # 1h/8h/24h/7d count, mean, std, min and max of every column, kept up to date by the daemon
+        self.window_stats = WindowStats.create(self.columns[1:])
         self.daemon_status = Queue()
-        self.latest_reading = None
-        self.latest_reading_queue = Queue(maxsize=1)
-        self._latest_thread = None
-        self._latest_thread_stop = None
+        # 'threads' runs start_loop, 'asyncio' runs async_engine.AsyncEngine; both write the same files
+        if engine not in ('threads', 'asyncio'):
+            raise ValueError("engine must be 'threads' or 'asyncio'")
+        self.engine = engine
+        self.stop_pipe = None
+        # 'host:port' of a collector.Collector to stream every sample to, None keeps them local
+        self.collector = collector
+        self.station = station
+        self.uploader = None
+        # Prometheus text on http://127.0.0.1:<metrics_port>/metrics from inside the daemon, None for off
+        self.metrics_port = metrics_port
+        self.metrics = None
     
     def start_daemon(self):
         print('Starting daemon...')
-        self.daemon = Process(target=self.start_loop, args=(self.sampling_buffer, self.daemon_status))
+        if self.engine == 'asyncio':
+            # the engine wakes up on the read end the moment stop_daemon writes to it
+            self.stop_pipe = os.pipe()
+            self.daemon = Process(target=self.start_engine, args=(self.stop_pipe[0],))
+        else:
+            self.daemon = Process(target=self.start_loop, args=(self.daemon_status,))
         self.daemon.start()
-        self.start_latest_readings_thread()
+        # merge closed hourly files into compressed chunks next to the sampling loop
+        self.compactor_stop = ProcessEvent()
+        self.compactor = Process(target=compaction.run_forever, args=(self.data_folder, self.compactor_stop), daemon=True)
+        self.compactor.start()
+        if self.collector is not None:
+            host, _, port = self.collector.rpartition(':')
+            self.uploader_stop = ProcessEvent()
+            self.uploader = Process(target=collector.upload_forever,
+                                    args=(self.ring, host, int(port), self.station, self.uploader_stop), daemon=True)
+            self.uploader.start()
         print('Daemon started.')
     
     def stop_daemon(self):
         print('Stopping daemon...')
-        self.daemon_status.put(1)
+        if self.stop_pipe is not None:
+            os.write(self.stop_pipe[1], b'\0')
+        else:
+            self.daemon_status.put(1)
         # self.daemon.kill()
         self.daemon.join()
-        self.stop_latest_readings_thread()
+        if self.stop_pipe is not None:
+            for fd in self.stop_pipe:
+                os.close(fd)
+            self.stop_pipe = None
+        self.compactor_stop.set()
+        self.compactor.join()
+        if self.uploader is not None:
+            self.uploader_stop.set()
+            self.uploader.join()
+            self.uploader = None
         print('Daemon stopped.')
-    
-    def start_latest_readings_thread(self):
-        if self._latest_thread and self._latest_thread.is_alive():
-            return
-        if self._latest_thread_stop is None:
-            self._latest_thread_stop = Event()
-        else:
-            self._latest_thread_stop.clear()
-        self._latest_thread = Thread(target=self._latest_readings_worker, daemon=True)
-        self._latest_thread.start()
-
-    def stop_latest_readings_thread(self):
-        if not self._latest_thread:
-            return
-        stop_event = self._latest_thread_stop
-        if stop_event is not None:
-            stop_event.set()
-        try:
-            self.latest_reading_queue.put_nowait(None)
-        except Full:
-            try:
-                self.latest_reading_queue.get_nowait()
-            except Empty:
-                pass
-            try:
-                self.latest_reading_queue.put_nowait(None)
-            except Full:
-                pass
-        if self._latest_thread.is_alive():
-            self._latest_thread.join(timeout=2.0)
-        self._latest_thread = None
-
-    def _latest_readings_worker(self):
-        stop_event = self._latest_thread_stop
-        if stop_event is None:
-            return
-        while not stop_event.is_set():
-            try:
-                sample = self.latest_reading_queue.get(timeout=1.0)
-            except Empty:
-                continue
-            if sample is None:
-                continue
-            parsed = self._parse_sample(sample)
-            if parsed is not None:
-                self.latest_reading = parsed
 
-    def _publish_latest_sample(self, sample: str):
-        try:
-            self.latest_reading_queue.put_nowait(sample)
-        except Full:
-            try:
-                self.latest_reading_queue.get_nowait()
-            except Empty:
-                pass
-            try:
-                self.latest_reading_queue.put_nowait(sample)
-            except Full:
-                pass
-
-    def _parse_sample(self, sample: str):
-        entries = sample.strip().split()
-        headers = self.header.strip().split()
-        if len(entries) != len(headers):
+    def close(self):
+        # the ring outlives daemon restarts, it goes away with the Sensors object
+        self.ring.unlink()
+        self.window_stats.unlink()
+        self.driver.close()
+    
+    def get_latest_reading(self):
+        # straight from the ring's newest record, no queue, thread or parsing involved
+        record = self.ring.last()
+        if record is None:
             return None
-        parsed = {}
-        for key, value in zip(headers, entries):
-            if key == 'timestamp':
-                try:
-                    parsed[key] = datetime.fromtimestamp(float(value))
-                except (ValueError, OSError):
-                    parsed[key] = None
-            else:
-                if value == 'None':
-                    parsed[key] = None
-                else:
-                    try:
-                        parsed[key] = float(value)
-                    except ValueError:
-                        parsed[key] = value
-        return parsed
+        reading = {name: None if value != value else float(value) for name, value in zip(self.columns, record.item()[1:])}
+        reading['timestamp'] = datetime.fromtimestamp(reading['timestamp'])
+        return reading
 
-    def get_latest_reading(self):
-        if self.latest_reading is None:
+    def get_window_stats(self, window='1h'):
+        # {column: {'count', 'mean', 'std', 'min', 'max'}} over the window, from shared memory like the reading
+        asof, _ = self.window_stats.read()
+        if asof != asof:
             return None
-        return self.latest_reading.copy()
+        return self.window_stats.summary(window)
 
+    @staticmethod
     def popup(msg):
+        # imported here so the daemon also runs headless, e.g. under benchmarks/load_test.py
+        import tkinter as tk
+        from tkinter import ttk
         popup = tk.Tk()
         popup.wm_title("!")
         label = ttk.Label(popup, text=msg)
@@ -163,48 +159,87 @@ class Sensors:
         B1.pack()
         popup.mainloop()
 
-    def read_sensors(self) -> str:
-        now = datetime.now()
-        temperature = self.bme280.temperature
-        humidity = self.bme280.humidity
-        pressure = self.bme280.pressure
-        try:
-            particles = self.pm25.read()
-        except RuntimeError:
-            particles = self.nan_dict
-        particles_packet = ''
-        for value in particles.values():
-            particles_packet += str(value) + ' '
-        particles_packet = particles_packet[:-1]
-        packet = f"{now.timestamp()} {round(temperature, 1)} {round(humidity, 1)} {round(pressure, 1)} {particles_packet}\n"
-        return packet
+    def read_bme280(self) -> list:
+        return self.driver.read_bme280()
+
+    def read_pm25(self) -> list:
+        return self.driver.read_pm25(self.pm_extremes)
+
+    def create_acquisition(self, reader=SensorWorker) -> Acquisition:
+        # one reader per sensor, a record takes the freshest reading of each; both engines start from here
+        fields = [name for name in self.header.split() if not name.endswith('_time')]
+        return Acquisition([reader('bme280', self.read_bme280, fields[1:4], self.sensor_intervals['bme280'],
+                                   timeout=1.0),
+                            reader('pm25', self.read_pm25, fields[4:], self.sensor_intervals['pm25'],
+                                   timeout=self.serial_timeout + 1.0)], times=self.sensor_times)
     
-    def start_loop(self, sampling_buffer: Queue, daemon_status: Queue):
+    def start_metrics(self) -> metrics.Registry:
+        # runs in the daemon process, whichever engine samples reports through this registry
+        self.metrics = metrics.Registry()
+        self.metrics.counter('environment_samples_total', 'Records published to the sample ring').labels().set_function(
+            lambda: self.ring.seq)
+        self.metrics.gauge('environment_last_sample_age_seconds', 'Seconds since the newest record').labels().set_function(
+            self.last_sample_age)
+        self.metrics.gauge('environment_sampling_interval_seconds', 'Configured record interval').set(self.sampling_delay)
+        frames = getattr(self.driver, 'frames', None)
+        if frames is not None:
+            pm_frames = self.metrics.counter('environment_pm_frames_total', 'PMS5003 frames by checksum result', ('result',))
+            pm_frames.labels('valid').set_function(lambda: frames.valid)
+            pm_frames.labels('bad').set_function(lambda: frames.bad)
+            self.metrics.counter('environment_pm_serial_errors_total', 'PMS5003 UART reads that raised'
+                                 ).labels().set_function(lambda: frames.errors)
+        if self.metrics_port is not None:
+            try:
+                metrics.serve(self.metrics, port=self.metrics_port)
+            except OSError as e:
+                # sampling matters more than the endpoint
+                logger.warning('Metrics endpoint not started: %s', e)
+        return self.metrics
+
+    def last_sample_age(self) -> float:
+        record = self.ring.last()
+        return float('nan') if record is None else time() - float(record['timestamp'])
+
+    def start_loop(self, daemon_status: Queue):
+        registry = self.start_metrics()
+        recover(self.data_folder)
+        # a restarted daemon picks the windows up where the archive left off
+        self.window_stats.rebuild(ReadArchive(self.data_folder))
+        self.writer = ArchiveWriter(self.data_folder, self.header, binary=self.binary_archive,
+                                    capacity=self.reset_threshold + 64, **self.write_policy)
+        self.writer.instrument(registry)
+        self.acquisition = self.create_acquisition()
+        self.acquisition.instrument(registry)
+        self.acquisition.start()
+        # started once the first readings are in, so record ticks trail the sensor reads
+        self.schedule = Schedule(self.sampling_delay)
+        self.schedule.instrument(registry, 'record')
         # loop while daemon_status is empty
         while daemon_status.empty():
             fn_dt = datetime.now()
-            self.init_file(fn_dt)
-            while self.loop_counter < self.reset_threshold:
-                self.savefile = open(self.savefile.name, 'a')
-                sample = self.read_sensors()
-                self.savefile.write(sample)
-                sampling_buffer.put(sample)
-                self._publish_latest_sample(sample)
-                sleep(self.sampling_delay)
-                self.savefile.close()
-                self.loop_counter += 1
+            rotate_at = next_boundary(fn_dt, self.rotation_seconds)
+            self.writer.open(fn_dt)
+            self.filename = self.writer.filename
+            while datetime.now() < rotate_at:
+                values = self.acquisition.sample()
+                self.writer.write(values)
+                self.ring.append(values)
+                self.window_stats.update(values[0], values[1:])
+                self.schedule.wait()
                 if daemon_status.empty() == False:
                     break
-            # empty queue and reset counter once it reaches reset threshold
-            for i in range(sampling_buffer.qsize()):
-                sampling_buffer.get()
-            self.loop_counter = 0
+            self.writer.close()
+            # same as AsyncEngine.report
+            logger.info('Write latency: %s', self.writer.stats())
+            logger.info('Sensor latency: %s', {**self.acquisition.stats(), 'record': {'schedule': self.schedule.stats()}})
+            # fold the file that just closed into the rollup tiers without holding up sampling
+            Thread(target=ReadArchive(self.data_folder).rollups.update, daemon=True).start()
+        self.acquisition.stop()
+        # the last samples may have come in under publish_seconds since the previous publish
+        self.window_stats.publish()
 
-    def init_file(self, dt: datetime):
-        filename = self.data_folder + dt.strftime('%Y-%m-%d %H-%M-%S') + '.txt'
-        self.savefile = open(filename, 'w')
-        self.savefile.write(self.header)
-        self.savefile.close()
+    def start_engine(self, stop_fd: int):
+        AsyncEngine(self, stop_fd).run()
 
 if __name__ == '__main__':
     from time import sleep
@@ -212,4 +247,5 @@ if __name__ == '__main__':
     s.start_daemon()
     print('waiting 30 seconds')
     sleep(30)
-    s.stop_daemon()
\ No newline at end of file
+    s.stop_daemon()
+    s.close()
\ No newline at end of file
@@ -0,0 +1,43 @@
+import os
+import sys
+from time import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from acquisition import Acquisition, SensorReader
+from drivers import SyntheticDriver
+from sensors import Sensors
+
+
+def fail():
+    raise OSError('bus error')
+
+
+def test_sample_records_each_sensor_read_time():
+    fast = SensorReader('fast', lambda: [1.0, 2.0], ['a', 'b'], interval=1.0)
+    broken = SensorReader('broken', fail, ['c'], interval=1.0)
+    fast.poll()
+    broken.poll()
+    acquisition = Acquisition([fast, broken], times=True)
+    values = acquisition.sample()
+    assert values[1:4] == [1.0, 2.0, None]
+    # one read time per sensor after the values, none for a sensor without a fresh reading
+    assert values[4] == fast.timestamp
+    assert values[0] - 1.0 < values[4] <= values[0]
+    assert values[5] is None
+
+
+def test_sample_leaves_read_times_out_by_default():
+    reader = SensorReader('fast', lambda: [1.0], ['a'])
+    reader.poll()
+    values = Acquisition([reader]).sample()
+    assert len(values) == 2
+    assert values[0] >= time() - 1.0
+
+
+def test_sensor_intervals_shorter_than_a_record_are_rejected(tmp_path):
+    with pytest.raises(ValueError, match='bme280'):
+        Sensors(str(tmp_path) + '/', driver=SyntheticDriver(seed=1), sampling_delay=5,
+                sensor_intervals={'bme280': 1})
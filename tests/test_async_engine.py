@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import async_engine
+from drivers import SyntheticDriver
+from sensors import Sensors
+
+
+def test_failed_archive_task_ends_the_run(tmp_path, monkeypatch):
+    sensors = Sensors(str(tmp_path) + '/', driver=SyntheticDriver(seed=1), sampling_delay=0.05)
+    writes = []
+
+    def write(self, values):
+        writes.append(values)
+        if len(writes) == 3:
+            raise OSError('disk full')
+
+    monkeypatch.setattr(async_engine.ArchiveWriter, 'write', write)
+    try:
+        # without a stop signal, only the failure can end it
+        with pytest.raises(OSError, match='disk full'):
+            async_engine.AsyncEngine(sensors).run()
+    finally:
+        sensors.close()
+    assert len(writes) == 3
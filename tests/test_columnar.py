@@ -0,0 +1,31 @@
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import columnar
+from archive import ReadArchive
+from writer import ArchiveWriter
+
+HEADER = 'timestamp temperature pm25_standard particles_03um\n'
+
+
+def test_fractional_pm_values_survive_the_binary_copy(tmp_path):
+    folder = str(tmp_path) + '/'
+    writer = ArchiveWriter(folder, HEADER, binary=True)
+    writer.open(datetime(2026, 10, 1, 12))
+    rows = [[1790000000.0 + i * 5, 21.3, 6.8 + i / 10, 1234.5] for i in range(10)]
+    for row in rows:
+        writer.write(row)
+    writer.close()
+    stem = folder + '2026-10-01 12-00-00'
+    columns = columnar.read_columns(stem + '.bin')
+    assert all(np.dtype(columns[name].dtype) == np.float64 for name in columns)
+    text = np.loadtxt(stem + '.txt', skiprows=1)
+    binary = np.column_stack([columns[name] for name in HEADER.split()])
+    assert np.array_equal(text, binary)
+    # read_file prefers the .bin copy
+    assert np.array_equal(ReadArchive(folder).read_file('2026-10-01 12-00-00.txt'), text)
@@ -0,0 +1,128 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from archive import ReadArchive
+from compaction import Compactor
+from writer import ArchiveWriter
+
+BASE = ['timestamp', 'temperature', 'pm25_standard', 'particles_03um', 'particles_05um']
+EXTREMES = BASE + ['pm25_standard_min', 'particles_03um_min', 'particles_05um_min',
+                   'pm25_standard_max', 'particles_03um_max', 'particles_05um_max']
+
+
+def write_hour(folder, dt, header, binary):
+    # one file every 5 minutes' worth of rows, the particle counts cumulative like the sensor's
+    writer = ArchiveWriter(folder, ' '.join(header) + '\n', binary=binary)
+    writer.open(dt)
+    for i in range(12):
+        row = [dt.timestamp() + i * 300, 20.5, 6.8, 900.0, 300.0]
+        writer.write(row + [6.1, 850.0, 280.0, 7.4, 950.0, 320.0][:len(header) - len(BASE)])
+    writer.close()
+
+
+def mixed_archive(tmp_path, binary=True):
+    # pm_extremes switched on between the second and third hour
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    folder = str(tmp_path) + '/'
+    start = datetime(2026, 10, 1, 10)
+    for hour in range(4):
+        write_hour(folder, start + timedelta(hours=hour), BASE if hour < 2 else EXTREMES, binary)
+    return folder, start
+
+
+def test_create_df_reads_files_with_and_without_extremes(tmp_path):
+    for binary in (True, False):
+        folder, _ = mixed_archive(tmp_path / str(binary), binary)
+        archive = ReadArchive(folder)
+        archive.manifest.refresh()
+        df = archive.create_df(archive.manifest.files(0, None))
+        assert len(df) == 48
+        assert list(df.columns) == EXTREMES[1:]
+        assert df['pm25_standard_min'].isna().sum() == 24
+        # the cumulative counts are differenced, their extremes are left alone
+        assert (df['particles_03um'] == 600).all()
+        assert (df['particles_03um_min'].dropna() == 850).all()
+        archive.close()
+
+
+def test_sensor_times_are_optional_too(tmp_path):
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    folder = str(tmp_path) + '/'
+    start = datetime(2026, 10, 1, 10)
+    write_hour(folder, start, BASE, True)
+    writer = ArchiveWriter(folder, ' '.join(BASE + ['bme280_time', 'pm25_time']) + '\n', binary=True)
+    writer.open(start + timedelta(hours=1))
+    for i in range(12):
+        t = (start + timedelta(hours=1)).timestamp() + i * 300
+        writer.write([t, 20.5, 6.8, 900.0, 300.0, t - 1.0, t - 2.0])
+    writer.close()
+    archive = ReadArchive(folder)
+    archive.manifest.refresh()
+    df = archive.create_df(archive.manifest.files(0, None))
+    assert len(df) == 24
+    assert df['pm25_time'].isna().sum() == 12
+    archive.close()
+
+
+def test_stream_resample_and_rollups_over_mixed_files(tmp_path):
+    folder, start = mixed_archive(tmp_path)
+    archive = ReadArchive(folder)
+    archive.manifest.refresh()
+    files = archive.manifest.files(0, None)
+    resampled = archive.stream_resample(files, '1h')
+    assert len(resampled) == 4
+    assert np.allclose(resampled['pm25_standard'], 6.8)
+    archive.rollups.update()
+    rolled = archive.rollups.query(start.timestamp(), (start + timedelta(hours=4)).timestamp(), '1h')
+    assert np.allclose(rolled['pm25_standard'].dropna(), 6.8)
+    # the tiers widen for the extremes, and a day of mixed files averages them over the rows that have them
+    daily = archive.rollups.query(start.timestamp(), (start + timedelta(hours=4)).timestamp(), '1D')
+    assert list(daily.columns) == EXTREMES[1:]
+    assert np.allclose(daily['pm25_standard_min'].dropna(), 6.1)
+    assert np.allclose(archive.stream_resample(files, '1D')['pm25_standard_min'], 6.1)
+    archive.close()
+
+
+def test_query_reads_files_not_folded_yet(tmp_path):
+    folder, start = mixed_archive(tmp_path)
+    archive = ReadArchive(folder)
+    rolled = archive.rollups.query(start.timestamp(), (start + timedelta(hours=4)).timestamp(), '1h')
+    assert np.allclose(rolled['pm25_standard'], 6.8)
+    # folding is left to the daemon
+    assert not archive.rollups.done
+    assert not os.path.exists(folder + '.rollups/1h.bin')
+    archive.close()
+
+
+def test_rollups_leave_read_times_out(tmp_path):
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    folder = str(tmp_path) + '/'
+    start = datetime(2026, 10, 1, 10)
+    for hour in range(3):
+        write_hour(folder, start + timedelta(hours=hour), BASE + ['pm25_time'], True)
+    archive = ReadArchive(folder)
+    archive.rollups.update()
+    rolled = archive.rollups.query(start.timestamp(), (start + timedelta(hours=3)).timestamp(), '1h')
+    assert list(rolled.columns) == BASE[1:]
+    assert len(rolled.dropna()) == 3
+    archive.close()
+
+
+def test_compaction_keeps_every_column(tmp_path):
+    folder, start = mixed_archive(tmp_path)
+    # a file on the next day, so the mixed one is closed and gets compacted
+    write_hour(folder, start + timedelta(days=1), EXTREMES, True)
+    archive = ReadArchive(folder)
+    archive.manifest.refresh()
+    assert Compactor(archive, grace=0).run() >= 1
+    archive.manifest.refresh()
+    chunk = [file for file in archive.manifest.files(0, None) if file.endswith('.chunk')][0]
+    assert archive.read_header(chunk) == EXTREMES
+    df = archive.create_df([chunk])
+    assert len(df) == 48
+    archive.close()
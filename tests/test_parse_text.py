@@ -0,0 +1,100 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from archive import ReadArchive
+
+HEADER = ['timestamp', 'temperature', 'humidity', 'pressure', 'pm25_standard', 'particles_03um', 'particles_05um',
+          'particles_10um', 'particles_25um', 'particles_50um', 'particles_100um']
+START = datetime(2026, 10, 1, 10)
+
+
+def sample(t, i):
+    counts = [1200.0 + i, 400.0, 90.0, 12.0, 3.0, 1.0]
+    return [t, 20.5 + i / 10, 45.0, 1013.25, 6.0 + i] + counts
+
+
+def line(values, trailing=' '):
+    return ' '.join(str(value) for value in values) + trailing + '\n'
+
+
+def hour_text(dt, broken=False, ragged=False):
+    # a sensor writes rows with a trailing space; broken hours hold what a crash or a bad read leaves behind
+    t = dt.timestamp()
+    lines = [line(sample(t + i * 300, i), '' if i % 3 else ' ') for i in range(12)]
+    if broken:
+        lines[2] = line(sample(t + 600, 2)[:6])
+        lines[4] = lines[4].replace('45.0', '4x5.0')
+        lines[6] = line([t + 1800] + [None] * (len(HEADER) - 1))
+        lines.append(line(sample(t + 3600 - 1, 12))[:-30])
+    if ragged:
+        # one token too many, the baseline reader raised on these
+        lines[8] = lines[8].replace(' ', '  ', 1)
+    return ''.join(lines)
+
+
+def write_archive(folder, hours):
+    for hour, broken in enumerate(hours):
+        dt = START + timedelta(hours=hour)
+        with open(folder + dt.strftime('%Y-%m-%d %H-%M-%S') + '.txt', 'w') as f:
+            f.write(' '.join(HEADER) + '\n' + hour_text(dt, broken))
+
+
+def fallback(archive, contents):
+    # the per-line parser parse_text falls back to, run on every line
+    lines = contents[:contents.rfind(b'\n') + 1].decode().split('\n')[:-1]
+    data = np.full((len(lines), len(HEADER)), np.nan)
+    for i, text in enumerate(lines):
+        nums = archive.txt2num(text)
+        if len(nums) == len(HEADER):
+            data[i] = nums
+    return data
+
+
+def baseline_create_df(folder, files):
+    # ReadArchive.create_df before it was vectorized, without the process pool
+    data = []
+    for file in files:
+        with open(folder + file) as f:
+            f.readline()
+            contents = f.read()
+        for text in contents[:-1].split('\n'):
+            data.append(ReadArchive.txt2num(None, text[:-1] if text.endswith(' ') else text))
+    data = [sample for sample in data if not np.isnan(sample[0])]
+    df = pd.DataFrame(data=data, columns=HEADER)
+    df['datetime'] = pd.to_datetime([datetime.fromtimestamp(i) for i in df['timestamp'].values])
+    df = df.set_index('datetime').drop(columns=['timestamp']).dropna()
+    bins = HEADER[5:]
+    for a, b in zip(bins, bins[1:]):
+        df[a] = df[a] - df[b]
+    return df.sort_index()
+
+
+def test_vectorized_parse_matches_the_line_parser():
+    archive = ReadArchive('/nonexistent/')
+    for broken, ragged in ((False, False), (True, False), (False, True), (True, True)):
+        contents = hour_text(START, broken, ragged).encode()
+        parsed = archive.parse_text(contents, len(HEADER))
+        assert np.array_equal(parsed, fallback(archive, contents), equal_nan=True)
+    # None is what Sensors writes for a failed read, the fast path maps it to nan too
+    contents = hour_text(START).encode() + line([START.timestamp() + 3600] + [None] * (len(HEADER) - 1)).encode()
+    assert np.array_equal(archive.parse_text(contents, len(HEADER)), fallback(archive, contents), equal_nan=True)
+
+
+def test_create_df_matches_the_baseline_reader(tmp_path):
+    folder = str(tmp_path) + '/'
+    write_archive(folder, [False, True, False, True])
+    archive = ReadArchive(folder)
+    archive.manifest.refresh()
+    files = archive.manifest.files(0, None)
+    df = archive.create_df(files)
+    expected = baseline_create_df(folder, files)
+    # the three broken rows of each broken hour are dropped, the torn last line along with them
+    assert len(df) == 4 * 12 - 2 * 3
+    pd.testing.assert_frame_equal(df, expected)
+    archive.close()
@@ -0,0 +1,115 @@
+import os
+import sys
+from threading import Timer
+from time import monotonic, sleep
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from async_engine import AsyncEngine
+from pms5003 import FrameReader, encode
+from sensors import Sensors
+
+VALUES = [5, 8, 11, 6, 9, 12, 1200, 900, 600, 300, 100, 20]
+
+
+class FlakyUart:
+    def __init__(self, failures):
+        self.failures = failures
+        self.reopened = 0
+        self.in_waiting = 0
+
+    def read(self, size):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('device disconnected')
+        sleep(0.01)
+        return encode(VALUES)
+
+    def close(self):
+        pass
+
+    def open(self):
+        self.reopened += 1
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = monotonic() + timeout
+    while not condition() and monotonic() < deadline:
+        sleep(0.01)
+
+
+def test_reader_thread_survives_serial_errors():
+    uart = FlakyUart(failures=2)
+    frames = FrameReader(uart, retry_seconds=0.01)
+    frames.start()
+    wait_for(lambda: frames.valid > 0)
+    frames.stop()
+    assert frames.errors == 2
+    assert uart.reopened == 2
+    assert frames.last_error is None
+    assert frames.read() == VALUES
+
+
+def test_read_reports_a_failing_port():
+    frames = FrameReader(FlakyUart(failures=10 ** 6), retry_seconds=0.01)
+    frames.start()
+    wait_for(lambda: frames.errors > 0)
+    frames.stop()
+    with pytest.raises(RuntimeError, match='serial port failing'):
+        frames.read()
+
+
+class PipeUart:
+    # stands in for the tty the asyncio engine watches, hang_up() is the adapter being pulled
+    def __init__(self):
+        self.opened = 0
+        self.open()
+
+    def open(self):
+        self.r, self.w = os.pipe()
+        os.write(self.w, encode(VALUES) * 3)
+        self.opened += 1
+
+    def fileno(self):
+        return self.r
+
+    def hang_up(self):
+        os.close(self.w)
+        self.w = None
+
+    def close(self):
+        for fd in (self.r, self.w):
+            if fd is not None:
+                os.close(fd)
+
+
+class PipeDriver:
+    def __init__(self):
+        self.frames = FrameReader(PipeUart(), retry_seconds=0.05)
+
+    def read_bme280(self):
+        return [20.5, 45.0, 1013.0]
+
+    def read_pm25(self, extremes=False):
+        return self.frames.read(extremes)
+
+    def close(self):
+        self.frames.uart.close()
+
+
+def test_async_engine_reopens_a_hung_up_port(tmp_path):
+    driver = PipeDriver()
+    sensors = Sensors(str(tmp_path) + '/', driver=driver, sampling_delay=0.1)
+    engine = AsyncEngine(sensors)
+    Timer(0.3, driver.frames.uart.hang_up).start()
+    Timer(1.0, engine.stop).start()
+    try:
+        engine.run()
+    finally:
+        sensors.close()
+    assert driver.frames.errors >= 1
+    assert driver.frames.uart.opened == 2
+    # three frames before the hang-up and three from the reopened port
+    assert driver.frames.valid == 6
@@ -0,0 +1,43 @@
+import os
+import sys
+from threading import Event
+from time import monotonic
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scheduler import Schedule
+
+
+def test_first_wait_blocks_one_period():
+    schedule = Schedule(0.2)
+    started = monotonic()
+    assert schedule.wait()
+    assert monotonic() - started >= 0.19
+    assert schedule.ticks == 1
+    assert schedule.missed == 0
+
+
+def test_ticks_follow_start():
+    schedule = Schedule(0.05)
+    for _ in range(4):
+        schedule.wait()
+    # four deadlines after start, none of them early
+    assert monotonic() - schedule.start >= 4 * 0.05 - 0.005
+    assert schedule.ticks == 4
+
+
+def test_stop_interrupts_wait():
+    stop = Event()
+    stop.set()
+    assert not Schedule(10).wait(stop)
+
+
+def test_delay_skips_overrun_ticks():
+    # what the asyncio engine sleeps on instead of wait()
+    schedule = Schedule(0.1, start=monotonic() - 0.35)
+    delay = schedule.delay()
+    assert schedule.missed == 2
+    # less than a period late now, so it fires at once instead of waiting for the one after
+    assert -0.05 - 0.005 <= delay < 0
+    schedule.tick()
+    assert schedule.ticks == 3
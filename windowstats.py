@@ -0,0 +1,218 @@
+import struct
+from multiprocessing import shared_memory
+import numpy as np
+from ringbuffer import _open
+
+# Block layout:
+#   seq (u8) | as-of timestamp (f8) | nwindows (u4) | ncolumns (u4) | header length (u4)
+#   header text (column names, a newline, window names), padded up to DATA_ALIGN
+#   nwindows x len(STATS) x ncolumns f8
+# seq is a seqlock: odd while the daemon is writing, readers retry until they copy an even, unchanged seq
+PREFIX = struct.Struct('<QdIII')
+HEADER_MAX = 2048
+DATA_ALIGN = 64
+STATS = ('count', 'mean', 'std', 'min', 'max')
+WINDOWS = {'1h': 3600, '8h': 8 * 3600, '24h': 24 * 3600, '7d': 7 * 24 * 3600}
+
+
+def _offset() -> int:
+    return -(-(PREFIX.size + HEADER_MAX) // DATA_ALIGN) * DATA_ALIGN
+
+
+class WindowStats:
+    def __init__(self, shm: shared_memory.SharedMemory, owner=False, buckets=60):
+        # each window is kept as `buckets` slots of window / buckets seconds, a slot holds count, mean and
+        # M2 (Welford) plus min and max; a sample touches one slot per window and old slots simply expire,
+        # so a window spans between buckets - 1 and buckets slots of the newest data
+        self.shm = shm
+        self.owner = owner
+        _, _, nwindows, ncolumns, length = PREFIX.unpack_from(shm.buf, 0)
+        columns, windows = bytes(shm.buf[PREFIX.size:PREFIX.size + length]).decode().split('\n')
+        self.columns = columns.split()
+        self.windows = windows.split()
+        self.widths = np.array([WINDOWS[window] / buckets for window in self.windows])
+        self.buckets = buckets
+        # combining the slots costs far more than a sample, fast drivers publish at most this often
+        self.publish_seconds = 1.0
+        self._seq = np.ndarray((1,), dtype='<u8', buffer=shm.buf, offset=0)
+        self._asof = np.ndarray((1,), dtype='<f8', buffer=shm.buf, offset=8)
+        self._published = np.ndarray((nwindows, len(STATS), ncolumns), dtype='<f8', buffer=shm.buf, offset=_offset())
+        self._reset()
+
+    @classmethod
+    def create(cls, columns: list, windows=tuple(WINDOWS), buckets=60, name=None):
+        header = (' '.join(columns) + '\n' + ' '.join(windows)).encode()
+        if len(header) > HEADER_MAX:
+            raise ValueError('too many columns for the window stats header')
+        shm = shared_memory.SharedMemory(name=name, create=True,
+                                         size=_offset() + len(windows) * len(STATS) * len(columns) * 8)
+        PREFIX.pack_into(shm.buf, 0, 0, np.nan, len(windows), len(columns), len(header))
+        shm.buf[PREFIX.size:PREFIX.size + len(header)] = header
+        stats = cls(shm, owner=True, buckets=buckets)
+        stats._published[:] = np.nan
+        return stats
+
+    @classmethod
+    def attach(cls, name: str):
+        return cls(_open(name))
+
+    def __getstate__(self):
+        # see SampleRing.__getstate__; the buckets stay with whoever updates them
+        return {'name': self.shm.name, 'buckets': self.buckets}
+
+    def __setstate__(self, state):
+        self.__init__(shared_memory.SharedMemory(name=state['name']), buckets=state['buckets'])
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _reset(self):
+        shape = (len(self.windows), self.buckets, len(self.columns))
+        self.ids = np.full((len(self.windows), self.buckets), -1, dtype=np.int64)
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self.latest = None
+        self.published_at = None
+
+    def _merge(self, windows: np.ndarray, ids: np.ndarray, count, mean, m2, lo, hi):
+        # Chan et al. pairwise combination of slot statistics with new ones, one row per (window, slot)
+        slots = ids % self.buckets
+        # a slot already holding a newer period keeps it, late samples from before that are dropped
+        current = self.ids[windows, slots] <= ids
+        if not current.all():
+            windows, slots, ids = windows[current], slots[current], ids[current]
+            count, mean, m2, lo, hi = (np.broadcast_to(value, (len(current), len(self.columns)))[current]
+                                       for value in (count, mean, m2, lo, hi))
+        expired = self.ids[windows, slots] != ids
+        if expired.any():
+            w, s = windows[expired], slots[expired]
+            self.ids[w, s] = ids[expired]
+            self.count[w, s] = 0.0
+            self.mean[w, s] = 0.0
+            self.m2[w, s] = 0.0
+            self.min[w, s] = np.inf
+            self.max[w, s] = -np.inf
+        n_a = self.count[windows, slots]
+        n = n_a + count
+        delta = mean - self.mean[windows, slots]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(n > 0, count / n, 0.0)
+        self.mean[windows, slots] += delta * share
+        self.m2[windows, slots] += m2 + delta * delta * n_a * share
+        self.count[windows, slots] = n
+        self.min[windows, slots] = np.fmin(self.min[windows, slots], lo)
+        self.max[windows, slots] = np.fmax(self.max[windows, slots], hi)
+
+    def update(self, timestamp: float, values: list):
+        # one sample, O(windows x columns) whatever the window length; single writer only
+        x = np.array([np.nan if value is None else value for value in values], dtype=float)
+        valid = ~np.isnan(x)
+        windows = np.arange(len(self.windows))
+        ids = (timestamp // self.widths).astype(np.int64)
+        rows = np.broadcast_to(x, (len(windows), len(x)))
+        count = np.broadcast_to(valid.astype(float), rows.shape)
+        mean = np.where(valid, rows, 0.0)
+        self._merge(windows, ids, count, mean, 0.0, rows, rows)
+        self.latest = timestamp if self.latest is None else max(self.latest, timestamp)
+        if self.published_at is None or timestamp - self.published_at >= self.publish_seconds:
+            self.publish()
+
+    def extend(self, timestamps: np.ndarray, data: np.ndarray):
+        # a block of samples (rows x columns) at once, for rebuilding from the archive
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, data = timestamps[order], data[order]
+        valid = ~np.isnan(data)
+        for w, width in enumerate(self.widths):
+            ids = (timestamps // width).astype(np.int64)
+            keep = ids > ids[-1] - self.buckets
+            ids, block, mask = ids[keep], data[keep], valid[keep]
+            starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+            count = np.add.reduceat(mask, starts).astype(float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.add.reduceat(np.where(mask, block, 0.0), starts) / count
+            spread = np.where(mask, block - np.repeat(mean, np.diff(np.r_[starts, len(ids)]), axis=0), 0.0)
+            m2 = np.add.reduceat(spread * spread, starts)
+            lo = np.fmin.reduceat(block, starts)
+            hi = np.fmax.reduceat(block, starts)
+            self._merge(np.full(len(starts), w), ids[starts], count, np.nan_to_num(mean), m2, lo, hi)
+        if len(timestamps):
+            self.latest = timestamps[-1] if self.latest is None else max(self.latest, timestamps[-1])
+
+    def aggregate(self) -> np.ndarray:
+        # windows x STATS x columns over the slots still inside each window as of the newest sample
+        result = np.full(self._published.shape, np.nan)
+        if self.latest is None:
+            return result
+        current = (self.latest // self.widths).astype(np.int64)
+        live = (self.ids > (current - self.buckets)[:, None])[:, :, None]
+        count = np.where(live, self.count, 0.0).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(live, self.count * self.mean, 0.0).sum(axis=1) / count
+            spread = self.mean - mean[:, None, :]
+            m2 = np.where(live, self.m2 + self.count * spread * spread, 0.0).sum(axis=1)
+            std = np.sqrt(m2 / (count - 1))
+        result[:, 0] = count
+        result[:, 1] = np.where(count > 0, mean, np.nan)
+        result[:, 2] = np.where(count > 1, std, np.nan)
+        lo = np.where(live, self.min, np.inf).min(axis=1)
+        hi = np.where(live, self.max, -np.inf).max(axis=1)
+        result[:, 3] = np.where(np.isfinite(lo), lo, np.nan)
+        result[:, 4] = np.where(np.isfinite(hi), hi, np.nan)
+        return result
+
+    def publish(self):
+        result = self.aggregate()
+        self.published_at = self.latest
+        self._seq[0] += 1
+        self._published[:] = result
+        self._asof[0] = np.nan if self.latest is None else self.latest
+        self._seq[0] += 1
+
+    def read(self) -> tuple:
+        # (as-of timestamp, windows x STATS x columns copy), consistent even while the daemon publishes
+        while True:
+            seq = int(self._seq[0])
+            if seq % 2:
+                continue
+            asof = float(self._asof[0])
+            data = self._published.copy()
+            if int(self._seq[0]) == seq:
+                return asof, data
+
+    def summary(self, window: str) -> dict:
+        # {column: {stat: value}} for one window, None where there is no data
+        _, data = self.read()
+        table = data[self.windows.index(window)]
+        return {column: {stat: None if table[i, j] != table[i, j] else float(table[i, j])
+                         for i, stat in enumerate(STATS)} for j, column in enumerate(self.columns)}
+
+    def rebuild(self, archive, max_bytes=8 * 1024**2):
+        # start over from the tail of the archive, so a restarted daemon reports full windows right away
+        self._reset()
+        archive.manifest.refresh()
+        if archive.manifest.stems:
+            latest = archive.manifest.lasts[-1]
+            start = latest - max(WINDOWS[window] for window in self.windows)
+            for file in archive.manifest.overlapping(start, latest):
+                header = archive.read_header(file)
+                # files written with other columns still feed the ones they share
+                index = [header.index(column) if column in header else -1 for column in self.columns]
+                for block in archive.stream([file], start, None, max_bytes):
+                    data = np.where(np.array(index) >= 0, block[:, index], np.nan)
+                    self.extend(block[:, header.index('timestamp')], data)
+        self.publish()
+
+    def close(self):
+        self._seq = None
+        self._asof = None
+        self._published = None
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,130 @@
+import os
+from collections import deque
+from datetime import datetime
+from time import monotonic, perf_counter
+import numpy as np
+from columnar import ColumnarWriter
+from metrics import WRITE_BUCKETS
+
+FSYNC_POLICIES = ('never', 'flush', 'rotation')
+
+
+def recover(data_folder: str, newest=2) -> list:
+    # a crash mid-write leaves a torn last line in the files that were open, cut it off
+    files = sorted(file for file in os.listdir(data_folder) if file.endswith('.txt'))[-newest:]
+    repaired = []
+    for file in files:
+        with open(data_folder + file, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if not size:
+                continue
+            f.seek(max(0, size - 4096))
+            tail = f.read()
+            if tail.endswith(b'\n'):
+                continue
+            cut = tail.rfind(b'\n')
+            if cut < 0:
+                # not even the header made it, or no sample line is that long; leave it alone
+                continue
+            f.truncate(size - len(tail) + cut + 1)
+            repaired.append(file)
+    return repaired
+
+
+class ArchiveWriter:
+    def __init__(self, data_folder: str, header: str, binary=True, capacity=1024,
+                 flush_samples=1, flush_seconds=None, fsync='rotation', latency_window=4096):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'fsync must be one of {FSYNC_POLICIES}')
+        self.data_folder = data_folder
+        self.header = header
+        self.binary = binary
+        self.capacity = capacity
+        # a flush happens after flush_samples writes or flush_seconds, whichever comes first,
+        # and always on rotation; None disables that trigger
+        self.flush_samples = flush_samples
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.filename = None
+        self._text = None
+        self._binary = None
+        self._pending = 0
+        self._last_flush = monotonic()
+        self.latencies = deque(maxlen=latency_window)
+        self.samples = 0
+        self.flushes = 0
+        self.fsyncs = 0
+        self.rotations = 0
+        self._write_seconds = None
+
+    def open(self, dt: datetime):
+        self.close()
+        self.filename = self.data_folder + dt.strftime('%Y-%m-%d %H-%M-%S') + '.txt'
+        # one handle per rotation period instead of an open/close per sample
+        self._text = open(self.filename, 'w', buffering=64 * 1024)
+        self._text.write(self.header)
+        if self.binary:
+            self._binary = ColumnarWriter(self.filename[:-4] + '.bin', self.header.split(), capacity=self.capacity)
+        self._pending = 0
+        self._last_flush = monotonic()
+        self.rotations += 1
+        self.flush()
+
+    def write(self, values: list) -> str:
+        started = perf_counter()
+        line = ' '.join(str(value) for value in values) + '\n'
+        self._text.write(line)
+        if self._binary is not None:
+            self._binary.append(values)
+        self._pending += 1
+        if ((self.flush_samples is not None and self._pending >= self.flush_samples) or
+                (self.flush_seconds is not None and monotonic() - self._last_flush >= self.flush_seconds)):
+            self.flush()
+        latency = perf_counter() - started
+        self.latencies.append(latency)
+        if self._write_seconds is not None:
+            self._write_seconds.observe(latency)
+        self.samples += 1
+        return line
+
+    def flush(self, sync=None):
+        # hand buffered lines to the OS, fsync only where the policy asks for it
+        self._text.flush()
+        self._pending = 0
+        self._last_flush = monotonic()
+        self.flushes += 1
+        if sync or (sync is None and self.fsync == 'flush'):
+            os.fsync(self._text.fileno())
+            if self._binary is not None:
+                self._binary.flush()
+            self.fsyncs += 1
+
+    def close(self):
+        if self._text is None:
+            return
+        self.flush(sync=self.fsync != 'never')
+        self._text.close()
+        self._text = None
+        if self._binary is not None:
+            self._binary.close()
+            self._binary = None
+
+    def instrument(self, registry):
+        # see metrics.Registry; counters read the writer's own fields when scraped
+        self._write_seconds = registry.histogram('environment_write_seconds', 'Time to append one sample',
+                                                 buckets=WRITE_BUCKETS).labels()
+        for name, help, field in (('environment_samples_written_total', 'Samples appended to the archive', 'samples'),
+                                  ('environment_flushes_total', 'Buffered lines handed to the OS', 'flushes'),
+                                  ('environment_fsyncs_total', 'fsync calls', 'fsyncs'),
+                                  ('environment_rotations_total', 'Archive files opened', 'rotations')):
+            registry.counter(name, help).labels().set_function(lambda field=field: getattr(self, field))
+        registry.gauge('environment_write_pending', 'Samples written but not flushed yet').labels().set_function(
+            lambda: self._pending)
+
+    def stats(self) -> dict:
+        latencies = np.array(self.latencies)
+        if not len(latencies):
+            return {'samples': self.samples, 'flushes': self.flushes, 'fsyncs': self.fsyncs}
+        return {'samples': self.samples, 'flushes': self.flushes, 'fsyncs': self.fsyncs,
+                'mean': float(latencies.mean()), 'p50': float(np.percentile(latencies, 50)),
+                'p99': float(np.percentile(latencies, 99)), 'max': float(latencies.max())}